@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, g
 import mimetypes
 from flask_cors import CORS
 import os
@@ -7,40 +7,241 @@ import time
 import uuid
 import threading
 import queue
+import random
+import socket
+import sqlite3
+import argparse
+import zlib
+import hashlib
+import mmap
+import ast
+import operator
+import itertools
+import gzip
+import atexit
+import zipfile
+from collections import deque, OrderedDict
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import math
 from datetime import datetime
 from typing import List, Dict, Any
 import requests
 import re
-import PyPDF2
-import docx
 from io import BytesIO
+from contextlib import contextmanager
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, origins="*", allow_headers=["Content-Type"], methods=["GET", "POST", "OPTIONS"])
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
+# Optional batching of small, ready tasks for the same agent into a single LLM call
+app.config['BATCH_SMALL_TASKS'] = False
+app.config['BATCH_MAX_TASKS'] = 4
+app.config['BATCH_MAX_DESCRIPTION_CHARS'] = 120
+
+# Number of worker threads sharing the LLM backend across all projects
+app.config['WORKER_THREADS'] = 1
+
+# Finished generations are handed through a bounded queue to post-processing threads that store
+# results and write files, so workers start the next generation right away (0 threads: inline)
+app.config['POSTPROCESS_THREADS'] = 2
+app.config['POSTPROCESS_QUEUE_SIZE'] = 4
+
+# Seconds of history behind the per-stage utilization gauges
+app.config['STAGE_UTILIZATION_WINDOW'] = 60
+
+# Order of ready tasks: critical_path (longest remaining chain first), lpt (longest task first) or priority
+app.config['SCHEDULING_POLICY'] = 'critical_path'
+app.config['TASK_HISTORY_PATH'] = 'task_durations.json'  # Recorded task durations the estimates come from
+
+# Task traces kept in memory; the least recently used ones are dropped beyond this
+app.config['TRACE_MAX_TASKS'] = 5000
+app.config['DEFAULT_TASK_SECONDS'] = 60  # Estimate used before any history exists
+
+# Shared durable task queue (an SQLite file on shared storage). When set, tasks are leased by
+# distributed workers started with `python agent.py worker` instead of running in-process
+app.config['TASK_QUEUE_PATH'] = os.environ.get('AUTONAI_TASK_QUEUE')
+app.config['TASK_LEASE_TIMEOUT'] = 120  # Seconds a lease stays valid without a heartbeat
+# Unleased tasks the dispatcher keeps on the shared queue, so workers on any number of machines find work
+app.config['DISPATCH_QUEUE_DEPTH'] = 8
+
+# Ollama backends shared by all LLM calls (comma-separated URLs in OLLAMA_ENDPOINTS)
+app.config['OLLAMA_ENDPOINTS'] = [url.strip() for url in os.environ.get('OLLAMA_ENDPOINTS', 'http://localhost:11434').split(',') if url.strip()]
+app.config['OLLAMA_HEALTH_INTERVAL'] = 15  # Seconds between health and model inventory checks
+
+# Models loaded into memory in the background at startup, and how long Ollama keeps them loaded after use
+app.config['WARMUP_MODELS'] = [m.strip() for m in os.environ.get('AUTONAI_WARMUP_MODELS', 'llama2:13b').split(',') if m.strip()]
+app.config['MODEL_KEEP_ALIVE'] = os.environ.get('AUTONAI_KEEP_ALIVE', '30m')
+
+# Restart the development server when the code changes (AUTONAI_RELOADER=0 runs a single process)
+app.config['DEBUG_RELOADER'] = os.environ.get('AUTONAI_RELOADER', '1') != '0'
+
+# Per-endpoint Ollama options (and faster model variants) measured by `python autotune.py`; used when the file exists
+app.config['RUNTIME_PROFILE_PATH'] = os.environ.get('AUTONAI_RUNTIME_PROFILE', 'runtime_profile.json')
+
+# Semantic cache of task results: near-duplicate tasks get the earlier result as a draft, or reuse it outright
+app.config['SEMANTIC_CACHE_ENABLED'] = True
+app.config['SEMANTIC_CACHE_EMBED_MODEL'] = 'nomic-embed-text'  # Falls back to a local hashing vectorizer
+# Similarity needed to draft from or reuse a result, per embedding space ('ollama' covers every model); None disables it.
+# Hashed word counts score unrelated tasks that share words as near-duplicates, so that fallback never drafts or reuses
+app.config['SEMANTIC_CACHE_THRESHOLDS'] = {'ollama': {'draft': 0.80, 'reuse': 0.95}, 'hashing': {'draft': None, 'reuse': None}}
+app.config['SEMANTIC_CACHE_MAX_ENTRIES'] = 2000
+
+# Rolling shared memory of each project, read by every agent prompt at a fixed size
+app.config['MEMORY_SUMMARY_ITEMS'] = 12  # Most recent task digests kept in the summary
+app.config['MEMORY_DIGEST_CHARS'] = 240
+app.config['MEMORY_MAX_ARTIFACTS'] = 6  # Latest artifact of each kind, up to this many kinds
+app.config['MEMORY_ARTIFACT_CHARS'] = 400
+
+# Consecutive tasks of one agent in a project continue a session from the context Ollama returned,
+# sending only the new task and what changed instead of the whole prompt again
+app.config['AGENT_SESSIONS_ENABLED'] = True
+# A session starts over after this many tasks, once its context holds this many tokens
+# (at most half of the model's num_ctx), or after being idle this long
+app.config['SESSION_MAX_TASKS'] = 8
+app.config['SESSION_MAX_TOKENS'] = 3072
+app.config['SESSION_IDLE_SECONDS'] = 600
+
+# On-disk cache of extracted document text and chunks, keyed by content hash
+app.config['DOCUMENT_CACHE_DIR'] = 'document_cache'
+app.config['DOCUMENT_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+app.config['DOCUMENT_CHUNK_CHARS'] = 1000
+
+# Uploaded documents of all projects, stored as memory-mapped text files and read only when a prompt needs them
+app.config['DOCUMENT_STORE_DIR'] = 'document_store'
+app.config['DOCUMENT_CONTEXT_CHARS'] = 5000  # Document text budget per prompt, shared by the selected documents
+
+# Agent tool loop: tools requested with ACTION/INPUT run in sandbox processes and their results go back to the model
+app.config['TOOL_LOOP_ENABLED'] = True
+app.config['TOOL_MAX_ROUNDS'] = 3  # Tool round trips per task before the model must answer
+app.config['TOOL_SANDBOX_PROCESSES'] = 4
+app.config['TOOL_MEMORY_LIMIT_MB'] = 1024  # Address space limit of each sandbox process (POSIX only)
+
+# Admission control of all LLM calls by priority class, highest first: chat, planning, task work
+app.config['ADMISSION_SLOTS_PER_ENDPOINT'] = 4  # Generations each usable Ollama endpoint runs at once (its OLLAMA_NUM_PARALLEL)
+app.config['ADMISSION_INTERACTIVE_RESERVE'] = 1  # Slots only chat may use, so it never queues behind task work
+app.config['ADMISSION_PLANNING_SLOTS'] = 1  # Kept apart from task work, so tasks generate while the plan still streams
+app.config['ADMISSION_QUEUE_LIMITS'] = {'interactive': 8, 'planning': 4, 'background': None}  # None: wait, never reject
+app.config['ADMISSION_MAX_WAIT'] = {'interactive': 30, 'planning': 300, 'background': None}  # Seconds queued before rejecting
+
+# Structured log of agent updates: JSONL segments written by a background thread and rotated by size
+app.config['LOG_DIR'] = 'logs'
+app.config['LOG_SEGMENT_BYTES'] = 4 * 1024 * 1024
+app.config['LOG_MAX_SEGMENTS'] = 50  # Oldest segments are deleted beyond this
+app.config['LOG_QUEUE_SIZE'] = 10000  # Records waiting for the writer; further records are dropped instead of blocking
+app.config['LOG_MEMORY_RECORDS'] = 1000  # Most recent records kept in memory for the UI
+app.config['LOG_STDOUT'] = True  # Echo records to the console, from the writer thread
+app.config['LOG_MESSAGE_CHARS'] = 300  # Chat replies are logged up to this length
+
+# API responses larger than this are compressed for clients that accept brotli (if installed) or gzip
+app.config['COMPRESS_MIN_BYTES'] = 1024
+app.config['COMPRESS_LEVEL'] = 6
+
 # Global variables for the task system
-task_queue = queue.Queue()
-agent_updates = []
-shared_memory = []
-document_context = ""
+workers = []
+agent_updates = deque(maxlen=app.config['LOG_MEMORY_RECORDS'])  # Recent log records, oldest first
 system_running = False
-project_status = {
-    "description": "",
-    "tasks": [],
-    "progress": 0,
-    "start_time": None,
-    "last_update": None
-}
+
+# Projects keyed by id; several can run at once and share the workers fairly
+projects = {}
+projects_lock = threading.RLock()
+current_project_id = None  # Project the chat UI and unscoped endpoints refer to
+
+def new_project(description, weight=1, max_concurrency=1):
+    """Create the state of a new project"""
+    return {
+        "id": str(uuid.uuid4())[:8],
+        "description": description,
+        "tasks": [],
+        "progress": 0,
+        "start_time": datetime.now(),
+        "last_update": datetime.now(),
+        "planning": False,
+        "running": True,
+        "weight": weight,  # Share of the workers relative to other projects
+        "max_concurrency": max_concurrency,  # Tasks of this project allowed in flight at once
+        "in_flight": 0,
+        "deficit": 0.0,
+        "memory": ProjectMemory(),
+        "sessions": {}  # Agent type -> AgentSession
+    }
+
+class ProjectMemory:
+    """Rolling summary and key artifacts of a project, updated as tasks complete and read at constant cost"""
+    
+    def __init__(self):
+        self.digests = []  # (agent type, task description, digest), oldest first
+        self.artifacts = {}  # artifact kind -> (agent type, file name, excerpt)
+        self.completed = 0
+        self.rendered = ""
+        self.lock = threading.Lock()
+    
+    def record(self, task, agent_type, artifacts=()):
+        """Fold a completed task into the memory; artifacts is a list of (kind, file info)"""
+        digest = digest_result(task.result or "", app.config['MEMORY_DIGEST_CHARS'])
+        with self.lock:
+            self.completed += 1
+            self.digests.append((agent_type, task.description, digest))
+            del self.digests[:-app.config['MEMORY_SUMMARY_ITEMS']]
+            for kind, file_info in artifacts:
+                # The newest artifact of a kind supersedes the older one
+                self.artifacts.pop(kind, None)
+                excerpt = extract_code_from_response(task.result, kind)[:app.config['MEMORY_ARTIFACT_CHARS']]
+                self.artifacts[kind] = (agent_type, file_info['name'], excerpt)
+                while len(self.artifacts) > app.config['MEMORY_MAX_ARTIFACTS']:
+                    self.artifacts.pop(next(iter(self.artifacts)))
+            self.rendered = self.render()
+    
+    def render(self):
+        lines = []
+        if self.digests:
+            older = self.completed - len(self.digests)
+            lines.append(f"Completed so far: {self.completed} task(s)" + (f" ({older} older ones not listed)" if older else ""))
+            for agent_type, description, digest in self.digests:
+                lines.append(f"- {description} (by {agent_type}): {digest}")
+        if self.artifacts:
+            lines.append("Key artifacts:")
+            for kind, (agent_type, name, excerpt) in self.artifacts.items():
+                lines.append(f"[{kind}] {name} (by {agent_type}):\n{excerpt}")
+        return "\n".join(lines)
+    
+    def to_dict(self):
+        with self.lock:
+            return {
+                "completed": self.completed,
+                "summary": [{"agent_type": a, "task": d, "digest": g} for a, d, g in self.digests],
+                "artifacts": [{"kind": k, "agent_type": a, "file": n, "excerpt": e} for k, (a, n, e) in self.artifacts.items()],
+                "text": self.rendered
+            }
+
+def digest_result(text, limit):
+    """Prose of a result without its code blocks, collapsed to a single line"""
+    prose = re.sub(r"```[\s\S]*?(```|$)", " [code] ", text)
+    prose = re.sub(r"\s+", " ", prose).strip()
+    return prose if len(prose) <= limit else prose[:limit].rsplit(" ", 1)[0] + "..."
+
+def get_project(project_id=None):
+    """Get a project by id, defaulting to the current one"""
+    return projects.get(project_id or current_project_id)
+
+def find_task(task_id):
+    """Find a task in any project and return (project, task)"""
+    for project in list(projects.values()):
+        for t in project["tasks"]:
+            if t.id == task_id:
+                return project, t
+    return None, None
 
 class Tool:
     """A tool that the agent can use to interact with the world"""
     
-    def __init__(self, name: str, description: str, func):
+    def __init__(self, name: str, description: str, func, timeout: float = 5):
         self.name = name
         self.description = description
         self.func = func
+        self.timeout = timeout  # Seconds the tool may run in the sandbox before it is killed
         
     def run(self, input_str: str) -> str:
         """Execute the tool's function with the given input"""
@@ -49,48 +250,99 @@ class Tool:
     def __str__(self) -> str:
         return f"{self.name}: {self.description}"
 
+# Task ids count up from a random start, which is unique enough and cheaper than a uuid per task
+task_ids = itertools.count(random.getrandbits(32))
+task_changes = itertools.count(1)  # Version numbers of task changes, increasing across all tasks
+
+def format_timestamp(epoch):
+    """Format an epoch time the way the API reports timestamps"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch)) if epoch else None
+
 class Task:
-    """Represents a task that can be assigned to an agent"""
+    """Represents a task that can be assigned to an agent; projects store these objects directly"""
+    
+    __slots__ = ("id", "description", "agent_type", "priority", "dependencies", "status", "created_at", "updated_at",
+                 "completed_at", "result", "notes", "attempts", "last_error", "retry_at", "semantic_cache", "documents",
+                 "tool_calls", "file_info", "files", "plan_ref", "unresolved_dependencies", "batch_excluded", "_version", "_serialized")
     
     def __init__(self, description, agent_type=None, priority=1, dependencies=None):
-        self.id = str(uuid.uuid4())[:8]  # Short unique ID
+        object.__setattr__(self, "_version", next(task_changes))
+        object.__setattr__(self, "_serialized", (-1, None))
+        self.id = f"{next(task_ids) & 0xffffffff:08x}"  # Short unique ID
         self.description = description
         self.agent_type = agent_type
         self.priority = priority  # 1 = highest, 5 = lowest
         self.dependencies = dependencies or []
-        self.status = "pending"  # pending, in_progress, completed, blocked
-        self.created_at = datetime.now()
+        self.status = "pending"  # pending, in_progress, completed, failed, blocked, cancelled
+        self.created_at = time.time()  # Epoch times; formatted only when the task is serialized
         self.updated_at = self.created_at
         self.completed_at = None
         self.result = None
         self.notes = []
+        self.attempts = 0
+        self.last_error = None
+        self.retry_at = None  # Epoch time after which a failed task may run again
+        self.semantic_cache = None  # How a near-duplicate earlier task was used (draft or reuse)
+        self.documents = None  # Ids of the documents to include in the prompt; None means all of the project's
+        self.tool_calls = []  # Tools run for this task; also its tool result cache
+        self.file_info = None  # Full response file saved for the task
+        self.files = []  # Every file saved for the task: the full response and the extracted artifacts
+        self.plan_ref = None  # How the planner referred to this task
+        self.unresolved_dependencies = []  # Planner references to tasks that have not been streamed yet
+        self.batch_excluded = False  # Set once the task failed to come back from a batched call
+    
+    def __setattr__(self, name, value):
+        # Any change makes the cached serialized form stale and shows up in delta status responses
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "_version", next(task_changes))
         
     def update_status(self, status, note=None):
         self.status = status
-        self.updated_at = datetime.now()
+        self.updated_at = time.time()
         if note:
             self.add_note(note)
         if status == "completed":
-            self.completed_at = datetime.now()
+            self.completed_at = self.updated_at
     
     def add_note(self, note):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.notes.append({"timestamp": timestamp, "note": note})
+        # Notes are serialized once, when they are added
+        self.notes.append({"timestamp": format_timestamp(time.time()), "note": note})
+        object.__setattr__(self, "_version", next(task_changes))
+    
+    @property
+    def version(self):
+        return self._version
     
     def to_dict(self):
-        return {
+        """Serialized form of the task, rebuilt only after it changed; callers must not modify it"""
+        version, serialized = self._serialized
+        if version == self._version:
+            return serialized
+        version = self._version
+        serialized = {
             "id": self.id,
             "description": self.description,
             "agent_type": self.agent_type,
             "priority": self.priority,
             "status": self.status,
-            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "completed_at": self.completed_at.strftime("%Y-%m-%d %H:%M:%S") if self.completed_at else None,
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at),
+            "completed_at": format_timestamp(self.completed_at),
             "result": self.result,
             "notes": self.notes,
-            "dependencies": self.dependencies
+            "dependencies": self.dependencies,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "retry_at": self.retry_at,
+            "semantic_cache": self.semantic_cache,
+            "documents": self.documents,
+            "tool_calls": self.tool_calls,
+            "files": self.files,
+            "plan_ref": self.plan_ref,
+            "unresolved_dependencies": self.unresolved_dependencies
         }
+        object.__setattr__(self, "_serialized", (version, serialized))
+        return serialized
 
 class DocumentProcessor:
     """Process various document types"""
@@ -98,6 +350,7 @@ class DocumentProcessor:
     @staticmethod
     def extract_text_from_pdf(file_data):
         """Extract text from PDF file"""
+        import PyPDF2  # Imported on first use; only uploads need it
         pdf_reader = PyPDF2.PdfReader(BytesIO(file_data))
         text = ""
         for page in pdf_reader.pages:
@@ -107,6 +360,7 @@ class DocumentProcessor:
     @staticmethod
     def extract_text_from_docx(file_data):
         """Extract text from DOCX file"""
+        import docx  # Imported on first use; only uploads need it
         doc = docx.Document(BytesIO(file_data))
         text = ""
         for para in doc.paragraphs:
@@ -129,6 +383,297 @@ class DocumentProcessor:
             return DocumentProcessor.extract_text_from_txt(file_data)
         else:
             return "Unsupported file format"
+    
+    @staticmethod
+    def is_supported(file_type):
+        return file_type.lower().endswith(('.pdf', '.docx', '.txt'))
+
+def chunk_text(text, chunk_chars):
+    """Split text into chunks of about chunk_chars, preferring paragraph and line boundaries"""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > chunk_chars:
+            cut = paragraph.rfind("\n", 0, chunk_chars)
+            if cut <= 0:
+                cut = paragraph.rfind(" ", 0, chunk_chars)
+            if cut <= 0:
+                cut = chunk_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        if paragraph:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+class DocumentCache:
+    """Size-bounded LRU cache on disk of extracted document text and chunks, keyed by content hash"""
+    
+    VERSION = 1  # Bump when extraction or chunking changes so stale entries are not served
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None  # key -> [size, last used]; loaded from disk on first use
+    
+    def load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, name))
+                self.entries[name[:-5]] = [stat.st_size, stat.st_mtime]
+    
+    def key(self, file_data, file_type):
+        extension = os.path.splitext(file_type.lower())[1]
+        return f"{hashlib.sha256(file_data).hexdigest()}-{extension.lstrip('.')}-v{self.VERSION}"
+    
+    def get(self, key):
+        with self.lock:
+            if self.entries is None:
+                self.load_index()
+            if key not in self.entries:
+                return None
+            path = os.path.join(self.directory, f"{key}.json")
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self.entries.pop(key, None)
+                return None
+            # The file's mtime doubles as the LRU timestamp across restarts
+            now = time.time()
+            os.utime(path, (now, now))
+            self.entries[key][1] = now
+            return entry
+    
+    def put(self, key, entry):
+        data = json.dumps(entry).encode("utf-8")
+        with self.lock:
+            if self.entries is None:
+                self.load_index()
+            path = os.path.join(self.directory, f"{key}.json")
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self.entries[key] = [len(data), time.time()]
+            self.evict()
+    
+    def evict(self):
+        total = sum(size for size, _ in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k][1]):
+            if total <= self.max_bytes:
+                break
+            size, _ = self.entries.pop(key)
+            total -= size
+            try:
+                os.remove(os.path.join(self.directory, f"{key}.json"))
+            except OSError:
+                pass
+
+document_cache = DocumentCache(app.config['DOCUMENT_CACHE_DIR'], app.config['DOCUMENT_CACHE_MAX_BYTES'])
+
+def extract_document(file_data, file_type):
+    """Extracted text and chunks of a document, served from the content-hash cache when possible"""
+    if not DocumentProcessor.is_supported(file_type):
+        text = DocumentProcessor.process_document(file_data, file_type)
+        return {"text": text, "chunks": [text], "hash": None, "cache_hit": False}
+    
+    key = document_cache.key(file_data, file_type)
+    entry = document_cache.get(key)
+    if entry is not None:
+        metrics.inc("autonai_document_cache_lookups_total", {"outcome": "hit"})
+        return dict(entry, hash=key.split("-")[0], cache_hit=True)
+    
+    metrics.inc("autonai_document_cache_lookups_total", {"outcome": "miss"})
+    start = time.time()
+    text = DocumentProcessor.process_document(file_data, file_type)
+    entry = {"text": text, "chunks": chunk_text(text, app.config['DOCUMENT_CHUNK_CHARS'])}
+    metrics.observe("autonai_document_extraction_seconds", time.time() - start)
+    try:
+        document_cache.put(key, entry)
+    except OSError as e:
+        print(f"Could not cache extracted document text: {str(e)}")
+    return dict(entry, hash=key.split("-")[0], cache_hit=False)
+
+class StoredDocument:
+    """An uploaded document whose text stays on disk and is memory-mapped on first read"""
+    
+    def __init__(self, doc_id, name, path, project_id, content_hash, chunk_offsets, uploaded_at):
+        self.id = doc_id
+        self.name = name
+        self.path = path
+        self.project_id = project_id  # None makes the document visible to every project
+        self.content_hash = content_hash
+        self.chunk_offsets = chunk_offsets  # Byte offset where each chunk starts, plus the file size at the end
+        self.uploaded_at = uploaded_at
+        self.file = None
+        self.mapping = None
+        self.lock = threading.Lock()
+    
+    @property
+    def size(self):
+        return self.chunk_offsets[-1]
+    
+    def read(self, max_bytes=None):
+        """Read the text, or as many whole chunks as fit in max_bytes (at least part of the first one)"""
+        end = self.size
+        if max_bytes is not None and max_bytes < end:
+            end = max([offset for offset in self.chunk_offsets if offset <= max_bytes] + [0]) or max_bytes
+        if end == 0:
+            return ""
+        with self.lock:
+            if self.mapping is None:
+                self.file = open(self.path, "rb")
+                self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.mapping[:end].decode("utf-8", errors="ignore").strip()
+    
+    def close(self):
+        with self.lock:
+            if self.mapping is not None:
+                self.mapping.close()
+                self.file.close()
+                self.mapping = None
+                self.file = None
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "project_id": self.project_id,
+            "content_hash": self.content_hash,
+            "bytes": self.size,
+            "chunks": len(self.chunk_offsets) - 1,
+            "uploaded_at": self.uploaded_at,
+            "mapped": self.mapping is not None
+        }
+
+class DocumentStore:
+    """Documents of every project, indexed in memory with their text in files on disk"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.documents = None  # id -> StoredDocument; loaded from the index file on first use
+        self.lock = threading.RLock()
+    
+    def load(self):
+        if self.documents is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.documents = {}
+        try:
+            with open(os.path.join(self.directory, "index.json"), encoding="utf-8") as f:
+                for d in json.load(f):
+                    if os.path.exists(os.path.join(self.directory, f"{d['id']}.txt")):
+                        self.documents[d["id"]] = StoredDocument(
+                            d["id"], d["name"], os.path.join(self.directory, f"{d['id']}.txt"), d["project_id"],
+                            d["content_hash"], d["chunk_offsets"], d["uploaded_at"])
+        except (OSError, ValueError):
+            pass
+    
+    def save_index(self):
+        index = [dict(d.to_dict(), chunk_offsets=d.chunk_offsets) for d in self.documents.values()]
+        path = os.path.join(self.directory, "index.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(f"{path}.tmp", path)
+    
+    def add(self, name, chunks, content_hash, project_id=None):
+        """Store a document's chunks; returns (document, created) and reuses an identical upload"""
+        with self.lock:
+            self.load()
+            for d in self.documents.values():
+                if d.content_hash and d.content_hash == content_hash and d.project_id == project_id:
+                    return d, False
+            
+            doc_id = str(uuid.uuid4())[:8]
+            path = os.path.join(self.directory, f"{doc_id}.txt")
+            offsets = [0]
+            with open(path, "wb") as f:
+                for chunk in chunks:
+                    data = (chunk + "\n\n").encode("utf-8")
+                    f.write(data)
+                    offsets.append(offsets[-1] + len(data))
+            document = StoredDocument(doc_id, name, path, project_id, content_hash, offsets,
+                                      datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            self.documents[doc_id] = document
+            self.save_index()
+            return document, True
+    
+    def get(self, doc_id):
+        with self.lock:
+            self.load()
+            return self.documents.get(doc_id)
+    
+    def remove(self, doc_id):
+        with self.lock:
+            self.load()
+            document = self.documents.pop(doc_id, None)
+            if document is None:
+                return False
+            # Unmap before deleting; Windows refuses to delete a mapped file
+            document.close()
+            try:
+                os.remove(document.path)
+            except OSError:
+                pass
+            self.save_index()
+            return True
+    
+    def list(self, project_id=None):
+        """Documents visible to a project (its own and the shared ones), or all of them"""
+        with self.lock:
+            self.load()
+            documents = list(self.documents.values())
+        if project_id is not None:
+            documents = [d for d in documents if d.project_id in (None, project_id)]
+        return documents
+    
+    def clear(self, project_id=None):
+        """Remove the documents of one project, or every document"""
+        for document in list(self.list()):
+            if project_id is None or document.project_id == project_id:
+                self.remove(document.id)
+    
+    def selected(self, project, selection=None):
+        """The documents a prompt includes: the selected ones, or all visible ones when the selection is None"""
+        documents = self.list(project["id"])
+        if selection is not None:
+            documents = [d for d in documents if d.id in selection]
+        return documents
+    
+    def fingerprint(self, project, selection=None):
+        """Ids and content hashes of the documents a prompt with this selection includes"""
+        return tuple(sorted((d.id, d.content_hash) for d in self.selected(project, selection)))
+    
+    def context_for(self, project, selection=None):
+        """Document text for a prompt: the selected documents (default: all visible ones) within the budget"""
+        documents = self.selected(project, selection)
+        if not documents:
+            return ""
+        
+        # Smallest documents first, so the budget they leave unused goes to the larger ones
+        remaining = app.config['DOCUMENT_CONTEXT_CHARS']
+        texts = {}
+        for count, document in enumerate(sorted(documents, key=lambda d: d.size)):
+            text = document.read(remaining // (len(documents) - count))
+            remaining -= len(text)
+            if len(text.encode("utf-8")) < document.size - 2:
+                text += f"\n[Note: {document.name} truncated to {len(text)} of about {document.size} characters]"
+            texts[document.id] = text
+        return "\n\n".join(f"--- {d.name} ---\n{texts[d.id]}" for d in documents)
+
+document_store = DocumentStore(app.config['DOCUMENT_STORE_DIR'])
 
 # Define the versatile agent types that can handle any domain
 AGENT_TYPES = {
@@ -235,10 +780,40 @@ def get_weather(location: str) -> str:
     """Simulate a weather checking tool"""
     return f"The weather in {location} is currently sunny and 72°F"
 
+CALCULATOR_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.USub: operator.neg, ast.UAdd: operator.pos
+}
+CALCULATOR_FUNCTIONS = {name: getattr(math, name) for name in
+                        ("sqrt", "log", "log10", "exp", "sin", "cos", "tan", "floor", "ceil", "fabs")}
+CALCULATOR_FUNCTIONS.update({"abs": abs, "round": round, "min": min, "max": max})
+CALCULATOR_CONSTANTS = {"pi": math.pi, "e": math.e}
+
+def evaluate_arithmetic(node):
+    """Evaluate an arithmetic expression tree; anything but numbers, operators and math functions is rejected"""
+    if isinstance(node, ast.Expression):
+        return evaluate_arithmetic(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in CALCULATOR_CONSTANTS:
+        return CALCULATOR_CONSTANTS[node.id]
+    if isinstance(node, ast.BinOp) and type(node.op) in CALCULATOR_OPERATORS:
+        left, right = evaluate_arithmetic(node.left), evaluate_arithmetic(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > 1000:
+            raise ValueError("exponent too large")
+        return CALCULATOR_OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in CALCULATOR_OPERATORS:
+        return CALCULATOR_OPERATORS[type(node.op)](evaluate_arithmetic(node.operand))
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in CALCULATOR_FUNCTIONS
+            and not node.keywords):
+        return CALCULATOR_FUNCTIONS[node.func.id](*[evaluate_arithmetic(arg) for arg in node.args])
+    raise ValueError(f"unsupported expression element: {type(node).__name__}")
+
 def calculate(expression: str) -> str:
     """A simple calculator tool"""
     try:
-        result = eval(expression)
+        result = evaluate_arithmetic(ast.parse(expression.strip().strip("`"), mode="eval"))
         return f"Result: {result}"
     except Exception as e:
         return f"Error in calculation: {str(e)}"
@@ -261,9 +836,372 @@ AGENT_TOOLS = {
     # Add other agent-specific tools as needed
 }
 
-def call_llm(messages, model="llama2:13b", timeout=300, max_retries=2):
-    """Call the local Ollama API with extended timeout and better error handling"""
-    # Format the messages for Ollama
+def sandbox_main(conn, memory_limit_mb):
+    """Loop of a tool sandbox process: run one tool call at a time and send back (ok, output)"""
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # No address space limit on this platform; the timeout still applies
+    while True:
+        try:
+            func, input_str = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = (True, str(func(input_str)))
+        except MemoryError:
+            result = (False, "Tool exceeded its memory limit")
+        except Exception as e:
+            result = (False, f"Tool error: {type(e).__name__}: {str(e)}")
+        conn.send(result)
+
+class ToolSandbox:
+    """Pool of separate processes running tools, so a slow or crashing tool cannot take a worker thread down"""
+    
+    def __init__(self):
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = []  # (process, connection) ready for a call
+        self.started = 0
+        self.condition = threading.Condition()
+    
+    def spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=sandbox_main, args=(child_conn, app.config['TOOL_MEMORY_LIMIT_MB']), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+    
+    def acquire(self, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while not self.idle and self.started >= app.config['TOOL_SANDBOX_PROCESSES']:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            return self.spawn()
+        except Exception:
+            with self.condition:
+                self.started -= 1
+                self.condition.notify()
+            raise
+    
+    def release(self, worker, healthy):
+        with self.condition:
+            if healthy:
+                self.idle.append(worker)
+            else:
+                self.started -= 1
+            self.condition.notify()
+        if not healthy:
+            process, conn = worker
+            process.kill()
+            process.join(1)
+            conn.close()
+    
+    def run(self, tool, input_str):
+        """Run a tool with its timeout; returns (ok, output) and never raises"""
+        worker = self.acquire(tool.timeout)
+        if worker is None:
+            return False, f"No tool sandbox became free within {tool.timeout}s"
+        process, conn = worker
+        try:
+            conn.send((tool.func, input_str))
+            if not conn.poll(tool.timeout):
+                self.release(worker, False)
+                return False, f"Tool {tool.name} timed out after {tool.timeout}s and was stopped"
+            result = conn.recv()
+        except (EOFError, OSError):
+            self.release(worker, False)
+            return False, f"Tool {tool.name} crashed"
+        except Exception as e:
+            self.release(worker, False)
+            return False, f"Tool {tool.name} could not run: {str(e)}"
+        self.release(worker, True)
+        return result
+
+tool_sandbox = ToolSandbox()
+
+def get_agent_tools(agent_type):
+    """Tools an agent may call"""
+    return {**COMMON_TOOLS, **AGENT_TOOLS.get(agent_type, {})}
+
+def parse_tool_calls(response):
+    """Every ACTION/INPUT tool request in a response, in order"""
+    return [{"tool": tool.strip(), "input": input_str.strip()}
+            for tool, input_str in re.findall(r"ACTION:\s*(\w+)[\s\n]*INPUT:\s*([\s\S]+?)(?=\n\s*\n|\n\s*ACTION:|$)",
+                                              response, re.IGNORECASE)]
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms rendered in Prometheus text format"""
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> {"type", "help", "buckets", "values"}
+        self.collectors = []  # Callables run at scrape time to refresh gauges
+
+    def register(self, name, metric_type, help_text, buckets=None):
+        self.metrics[name] = {
+            "type": metric_type,
+            "help": help_text,
+            "buckets": tuple(buckets or self.DEFAULT_BUCKETS),
+            "values": {}
+        }
+
+    def inc(self, name, labels=None, value=1):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            values = self.metrics[name]["values"]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self.metrics[name]["values"][key] = value
+
+    def remove(self, name, labels=None):
+        """Drop one label set of a metric, e.g. a gauge of something that no longer exists"""
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self.metrics[name]["values"].pop(key, None)
+
+    def observe(self, name, value, labels=None):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            metric = self.metrics[name]
+            series = metric["values"].get(key)
+            if series is None:
+                series = {"counts": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+                metric["values"][key] = series
+            for i, bound in enumerate(metric["buckets"]):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def add_collector(self, func):
+        self.collectors.append(func)
+
+    @staticmethod
+    def format_labels(pairs):
+        if not pairs:
+            return ""
+        escaped = []
+        for k, v in pairs:
+            v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            escaped.append(f'{k}="{v}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+
+        lines = []
+        with self.lock:
+            for name, metric in self.metrics.items():
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['type']}")
+                for key, value in metric["values"].items():
+                    if metric["type"] != "histogram":
+                        lines.append(f"{name}{self.format_labels(key)} {value}")
+                        continue
+                    for bound, count in zip(metric["buckets"], value["counts"]):
+                        lines.append(f"{name}_bucket{self.format_labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{self.format_labels(key + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{name}_sum{self.format_labels(key)} {value['sum']}")
+                    lines.append(f"{name}_count{self.format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.register("autonai_llm_request_duration_seconds", "histogram", "Wall-clock latency of LLM calls by model and agent")
+metrics.register("autonai_llm_prompt_eval_seconds", "histogram", "Time Ollama spent evaluating the prompt")
+metrics.register("autonai_llm_generation_seconds", "histogram", "Time Ollama spent generating tokens")
+metrics.register("autonai_llm_generation_tokens_per_second", "histogram", "Generation throughput per LLM call",
+                 buckets=(1, 2, 5, 10, 20, 40, 80, 160, 320))
+metrics.register("autonai_llm_prompt_tokens_per_second", "histogram", "Prompt evaluation throughput per LLM call",
+                 buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000))
+metrics.register("autonai_llm_prompt_tokens_total", "counter", "Prompt tokens evaluated by Ollama")
+metrics.register("autonai_llm_generated_tokens_total", "counter", "Tokens generated by Ollama")
+metrics.register("autonai_llm_model_loads_total", "counter", "LLM calls that had to load the model into memory first")
+metrics.register("autonai_llm_model_load_seconds", "histogram", "Time spent loading the model when a load occurred")
+metrics.register("autonai_llm_retries_total", "counter", "LLM call attempts that were retried")
+metrics.register("autonai_llm_failures_total", "counter", "LLM calls that failed after all retries")
+metrics.register("autonai_llm_cancellations_total", "counter", "LLM generations aborted by a cancel request")
+metrics.register("autonai_task_queue_depth", "gauge", "Pending tasks waiting for a worker across running projects")
+metrics.register("autonai_tasks", "gauge", "Tasks of all projects by status")
+metrics.register("autonai_projects_running", "gauge", "Projects currently being worked on")
+metrics.register("autonai_project_in_flight", "gauge", "Tasks in flight per project")
+metrics.register("autonai_task_duration_seconds", "histogram", "End-to-end task processing time by agent")
+metrics.register("autonai_http_request_duration_seconds", "histogram", "HTTP endpoint latency")
+metrics.register("autonai_tool_calls_total", "counter", "Agent tool calls by tool and outcome (ok, error, cached)")
+metrics.register("autonai_tool_duration_seconds", "histogram", "Time tools spent in the sandbox")
+metrics.register("autonai_document_cache_lookups_total", "counter", "Document extraction cache lookups by outcome (hit, miss)")
+metrics.register("autonai_document_extraction_seconds", "histogram", "Time spent extracting text from uploaded documents")
+
+# Ollama reports a small load_duration even for resident models; above this we count a real load
+MODEL_LOAD_THRESHOLD = 0.5
+
+def collect_queue_metrics():
+    """Refresh the queue and task gauges just before a scrape"""
+    counts = {"pending": 0, "in_progress": 0, "completed": 0, "failed": 0, "blocked": 0}
+    waiting = 0
+    running = 0
+    for project in list(projects.values()):
+        for t in project["tasks"]:
+            counts[t.status] = counts.get(t.status, 0) + 1
+            if project["running"] and t.status == "pending":
+                waiting += 1
+        if project["running"]:
+            running += 1
+        metrics.set("autonai_project_in_flight", {"project": project["id"]}, project["in_flight"])
+    metrics.set("autonai_task_queue_depth", value=waiting)
+    metrics.set("autonai_projects_running", value=running)
+    for status, count in counts.items():
+        metrics.set("autonai_tasks", {"status": status}, count)
+
+metrics.add_collector(collect_queue_metrics)
+
+def record_llm_stats(stats, model, agent, elapsed):
+    """Record the timing and token counters Ollama returns with a generation"""
+    labels = {"model": model, "agent": agent}
+    metrics.observe("autonai_llm_request_duration_seconds", elapsed, labels)
+
+    # Ollama reports durations in nanoseconds
+    prompt_tokens = stats.get("prompt_eval_count", 0) or 0
+    generated_tokens = stats.get("eval_count", 0) or 0
+    prompt_seconds = (stats.get("prompt_eval_duration", 0) or 0) / 1e9
+    generation_seconds = (stats.get("eval_duration", 0) or 0) / 1e9
+    load_seconds = (stats.get("load_duration", 0) or 0) / 1e9
+
+    metrics.inc("autonai_llm_prompt_tokens_total", labels, prompt_tokens)
+    metrics.inc("autonai_llm_generated_tokens_total", labels, generated_tokens)
+    metrics.observe("autonai_llm_prompt_eval_seconds", prompt_seconds, {"model": model})
+    metrics.observe("autonai_llm_generation_seconds", generation_seconds, {"model": model})
+    if generation_seconds > 0:
+        metrics.observe("autonai_llm_generation_tokens_per_second", generated_tokens / generation_seconds, {"model": model})
+    if prompt_seconds > 0:
+        metrics.observe("autonai_llm_prompt_tokens_per_second", prompt_tokens / prompt_seconds, {"model": model})
+    if load_seconds >= MODEL_LOAD_THRESHOLD:
+        metrics.inc("autonai_llm_model_loads_total", {"model": model})
+        metrics.observe("autonai_llm_model_load_seconds", load_seconds, {"model": model})
+
+class TaskTrace:
+    """Timed spans recorded for each phase a task goes through"""
+
+    def __init__(self, task_id, agent_type=None, project_id=None):
+        self.task_id = task_id
+        self.agent_type = agent_type
+        self.project_id = project_id
+        self.created = time.time()
+        self.finished = None
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, name, start, end, **attrs):
+        with self.lock:
+            self.spans.append({"name": name, "start": start, "end": end, "attrs": attrs})
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block; the yielded dict can be filled with extra attributes"""
+        start = time.time()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, start, time.time(), **attrs)
+
+    def to_dict(self):
+        with self.lock:
+            spans = [{
+                "name": s["name"],
+                "start": s["start"],
+                "end": s["end"],
+                "duration": round(s["end"] - s["start"], 6),
+                "attrs": s["attrs"]
+            } for s in self.spans]
+        phases = {}
+        for s in spans:
+            phases[s["name"]] = round(phases.get(s["name"], 0) + s["duration"], 6)
+        return {
+            "task_id": self.task_id,
+            "project_id": self.project_id,
+            "agent_type": self.agent_type,
+            "created": self.created,
+            "finished": self.finished,
+            "phases": phases,
+            "spans": spans
+        }
+
+    def to_trace_events(self, pid=1, tid=1):
+        """Convert the spans to Chrome Trace Event Format 'complete' events (microseconds); tid is a numeric thread id"""
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+        for s in spans:
+            args = dict(s["attrs"], task_id=self.task_id)
+            events.append({
+                "name": s["name"], "cat": "task", "ph": "X", "pid": pid, "tid": tid,
+                "ts": int(s["start"] * 1e6), "dur": int((s["end"] - s["start"]) * 1e6), "args": args
+            })
+            # Lay out Ollama's own timings inside the LLM span so viewers show where it went
+            if s["name"] == "llm_call":
+                offset = s["start"]
+                for phase in ("load_seconds", "prompt_eval_seconds", "generation_seconds"):
+                    seconds = s["attrs"].get(phase)
+                    if seconds:
+                        events.append({
+                            "name": phase.replace("_seconds", ""), "cat": "llm", "ph": "X", "pid": pid, "tid": tid,
+                            "ts": int(offset * 1e6), "dur": int(seconds * 1e6), "args": {"task_id": self.task_id}
+                        })
+                        offset += seconds
+        return events
+
+# Traces keyed by task id, for every project, least recently used first
+task_traces = OrderedDict()
+task_traces_lock = threading.Lock()
+
+def get_task_trace(task_id, agent_type=None, project_id=None):
+    """Get or create the trace for a task, evicting the least recently used traces beyond the limit"""
+    with task_traces_lock:
+        trace = task_traces.get(task_id)
+        if trace is None:
+            trace = TaskTrace(task_id, agent_type, project_id)
+            task_traces[task_id] = trace
+            while len(task_traces) > app.config['TRACE_MAX_TASKS']:
+                task_traces.popitem(last=False)
+        else:
+            task_traces.move_to_end(task_id)
+            if agent_type and not trace.agent_type:
+                trace.agent_type = agent_type
+    return trace
+
+def build_trace_file(traces):
+    """Build a Chrome/Perfetto compatible trace document from a list of task traces"""
+    events = []
+    thread_ids = {}  # Agent type -> numeric thread id; the trace event format wants integers
+    for trace in traces:
+        name = trace.agent_type or "System"
+        tid = thread_ids.setdefault(name, len(thread_ids) + 1)
+        events.extend(trace.to_trace_events(tid=tid))
+    for name, tid in thread_ids.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+    events.append({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "AutonAI project"}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def format_prompt(messages):
+    """Format chat-style messages into a Llama 2 instruction prompt for Ollama"""
     prompt = ""
     for msg in messages:
         role = msg["role"]
@@ -277,30 +1215,696 @@ def call_llm(messages, model="llama2:13b", timeout=300, max_retries=2):
                 prompt += f"[INST] {content} [/INST]"
         elif role in ["assistant", "agent"]:
             prompt += f" {content} </s>"
+    return prompt
+
+def summarize_llm_stats(data, model, attempts):
+    """Convert Ollama's nanosecond counters into the stats dict handed back to callers"""
+    return {
+        "model": model,
+        "attempts": attempts,
+        "prompt_tokens": data.get("prompt_eval_count", 0),
+        "generated_tokens": data.get("eval_count", 0),
+        "load_seconds": (data.get("load_duration", 0) or 0) / 1e9,
+        "prompt_eval_seconds": (data.get("prompt_eval_duration", 0) or 0) / 1e9,
+        "generation_seconds": (data.get("eval_duration", 0) or 0) / 1e9
+    }
+
+# Timeouts for a streamed generation: reaching Ollama, waiting for the first token
+# (which includes model load and prompt evaluation) and silence between tokens
+LLM_CONNECT_TIMEOUT = 5
+LLM_FIRST_TOKEN_TIMEOUT = 180
+LLM_IDLE_TIMEOUT = 60
+
+# Exponential backoff with full jitter between attempts
+LLM_BACKOFF_BASE = 1
+LLM_BACKOFF_MAX = 30
+
+class LLMError(Exception):
+    """Raised when the LLM backend could not produce a complete response"""
+
+class LLMTimeoutError(LLMError):
+    """Raised when a generation exceeded its first-token or idle timeout"""
+
+class LLMUnavailableError(LLMError):
+    """Raised without contacting Ollama while the circuit breaker is open"""
+
+class LLMCancelledError(LLMError):
+    """Raised when a generation was cancelled through its CancelToken"""
+
+class LLMOverloadedError(LLMError):
+    """Raised when admission control turns a call away because its priority class is saturated"""
+    
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CancelToken:
+    """Cancellation flag shared between the API and the generation running for a task"""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.reset_status = "pending"  # Status the task returns to once the generation has stopped
+    
+    def cancel(self, reset_status="pending"):
+        self.reset_status = reset_status
+        self.event.set()
+    
+    def is_set(self):
+        return self.event.is_set()
+
+class CancelGroup:
+    """Several cancel tokens watched as one, for a generation shared by a batch of tasks"""
+    
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+    
+    def is_set(self):
+        return any(token.is_set() for token in self.tokens)
+
+# Cancel tokens of generations in flight, keyed by task id
+active_generations = {}
+active_generations_lock = threading.Lock()
+
+def register_generation(key):
+    """Create the cancel token for a generation that is about to start"""
+    token = CancelToken()
+    with active_generations_lock:
+        active_generations[key] = token
+    return token
+
+def unregister_generation(key, token):
+    with active_generations_lock:
+        if active_generations.get(key) is token:
+            del active_generations[key]
+
+def cancel_generation(key, reset_status="pending"):
+    """Cancel the generation running for a task; returns False if nothing was in flight"""
+    with active_generations_lock:
+        token = active_generations.get(key)
+    if token is None:
+        return False
+    token.cancel(reset_status)
+    return True
+
+def cancel_all_generations(reset_status="pending"):
+    """Cancel every generation in flight and return how many were cancelled"""
+    with active_generations_lock:
+        tokens = list(active_generations.values())
+    for token in tokens:
+        token.cancel(reset_status)
+    return len(tokens)
+
+def sleep_unless_cancelled(seconds, cancel_token=None):
+    """Sleep for a backoff delay, waking early and raising if the call is cancelled"""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if cancel_token is not None and cancel_token.is_set():
+            raise LLMCancelledError("Generation cancelled")
+        time.sleep(min(0.2, max(0, deadline - time.time())))
+
+class CircuitBreaker:
+    """Fail fast while the backend is down instead of waiting out every timeout"""
+    
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"  # closed, open, half_open
+        self.opened_at = None
+        self.lock = threading.Lock()
+    
+    def before_call(self):
+        """Raise LLMUnavailableError if calls are currently not allowed"""
+        with self.lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_timeout:
+                    retry_in = int(self.reset_timeout - (time.time() - self.opened_at)) + 1
+                    raise LLMUnavailableError(f"Ollama circuit is open after {self.failures} failures; retry in {retry_in}s")
+                # Let a single trial call through to probe the backend
+                self.state = "half_open"
+            elif self.state == "half_open":
+                raise LLMUnavailableError("Ollama circuit is half-open and a trial call is already running")
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = "closed"
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Opening the Ollama circuit after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.time()
+    
+    def end_trial(self):
+        """Reopen a circuit whose trial call ended without an outcome (cancelled or abandoned), so the next call probes again"""
+        with self.lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.time() - self.reset_timeout
+
+def normalize_model_name(model):
+    """Ollama reports untagged models with the implicit :latest tag"""
+    return model if ":" in model else f"{model}:latest"
+
+class RuntimeProfile:
+    """Tuned Ollama options per endpoint and model, reloaded whenever autotune rewrites the profile"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.endpoints = {}  # endpoint url -> model -> {"model": variant to request, "options": {...}}
+        self.lock = threading.Lock()
+    
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            endpoints = {}
+            if mtime is not None:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        for url, entry in json.load(f).get("endpoints", {}).items():
+                            endpoints[url.rstrip("/")] = {normalize_model_name(model): tuned
+                                                          for model, tuned in entry.get("models", {}).items()}
+                    print(f"Loaded runtime profile {self.path} for {len(endpoints)} endpoint(s)")
+                except (OSError, ValueError, AttributeError) as e:
+                    print(f"Ignoring runtime profile {self.path}: {str(e)}")
+            self.endpoints = endpoints
+            self.mtime = mtime
+    
+    def settings(self, endpoint_url, model):
+        """The model name to request and the Ollama options to send for a model on an endpoint"""
+        self.reload_if_changed()
+        tuned = self.endpoints.get(endpoint_url, {}).get(normalize_model_name(model))
+        if not tuned:
+            return model, None
+        return tuned.get("model") or model, tuned.get("options") or None
+    
+    def with_targets(self, endpoint_url, names):
+        """Model names Ollama reported, plus the targets whose tuned variant is among them"""
+        self.reload_if_changed()
+        names = set(names)
+        for target, tuned in self.endpoints.get(endpoint_url, {}).items():
+            variant = tuned.get("model")
+            if variant and (variant in names or normalize_model_name(variant) in names):
+                names.add(target)
+        return names
+
+runtime_profile = RuntimeProfile(app.config['RUNTIME_PROFILE_PATH'])
+
+class OllamaEndpoint:
+    """One Ollama backend with its health, model inventory and load"""
+    
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.models = None  # Model names from /api/tags; None until the first check
+        self.loaded = set()  # Models currently in memory according to /api/ps
+        self.in_flight = 0
+        self.last_check = None
+        self.last_error = None
+        self.circuit = CircuitBreaker()
+    
+    def accepts_calls(self):
+        """Healthy and not behind an open circuit (a half-open probe may still be let through)"""
+        if not self.healthy:
+            return False
+        if self.circuit.state == "open":
+            return time.time() - self.circuit.opened_at >= self.circuit.reset_timeout
+        return self.circuit.state == "closed"
+    
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.circuit.state,
+            "in_flight": self.in_flight,
+            "models": sorted(self.models) if self.models is not None else None,
+            "loaded": sorted(self.loaded),
+            "last_check": self.last_check,
+            "last_error": self.last_error
+        }
+
+class OllamaPool:
+    """Least-loaded routing over the configured Ollama endpoints, preferring hosts with the model loaded"""
+    
+    def __init__(self):
+        self.endpoints = []
+        self.lock = threading.Lock()
+        self.monitor = None
+    
+    def sync(self):
+        """Follow changes to app.config['OLLAMA_ENDPOINTS'], keeping the state of known endpoints"""
+        urls = [url.rstrip("/") for url in app.config['OLLAMA_ENDPOINTS']]
+        with self.lock:
+            if [e.url for e in self.endpoints] != urls:
+                known = {e.url: e for e in self.endpoints}
+                self.endpoints = [known.get(url) or OllamaEndpoint(url) for url in urls]
+        if self.monitor is None or not self.monitor.is_alive():
+            self.monitor = threading.Thread(target=self.monitor_loop, daemon=True)
+            self.monitor.start()
+    
+    def ranked(self, model, exclude=(), prefer=None):
+        """Usable endpoints for a call, best first; call with the lock held"""
+        model = normalize_model_name(model)
+        candidates = [e for e in self.endpoints if e.accepts_calls()]
+        # Prefer endpoints that did not just fail this call, then ones that have the model at all
+        candidates = [e for e in candidates if e not in exclude] or candidates
+        candidates = [e for e in candidates if e.models is None or model in e.models] or candidates
+        # Least loaded first; a host without the model in memory counts one extra call for the load
+        # The endpoint holding a session's context is worth one extra call, since it can reuse that prefix
+        candidates.sort(key=lambda e: (e.in_flight + (0 if model in e.loaded else 1) - (1 if e.url == prefer else 0),
+                                       random.random()))
+        return candidates
+    
+    def acquire(self, model, exclude=(), prefer=None):
+        """Pick an endpoint for a call and count it as in flight; raises LLMUnavailableError if none is usable"""
+        self.sync()
+        with self.lock:
+            candidates = self.ranked(model, exclude, prefer)
+            if not candidates:
+                raise LLMUnavailableError(f"No healthy Ollama endpoint out of {len(self.endpoints)} configured")
+            for endpoint in candidates:
+                try:
+                    endpoint.circuit.before_call()
+                except LLMUnavailableError:
+                    continue
+                endpoint.in_flight += 1
+                return endpoint
+        raise LLMUnavailableError("Every Ollama endpoint is waiting for a circuit breaker probe")
+    
+    def expected_model(self, model):
+        """The model a call for this model would most likely request: the profile's variant on the best endpoint"""
+        self.sync()
+        with self.lock:
+            candidates = self.ranked(model)
+        return runtime_profile.settings(candidates[0].url, model)[0] if candidates else model
+    
+    def release(self, endpoint, model=None):
+        """Finish a call; a successful call leaves the model loaded on that endpoint"""
+        with self.lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            if model:
+                endpoint.loaded.add(normalize_model_name(model))
+    
+    def mark_loaded(self, endpoint, model):
+        """Mark a model as loaded on an endpoint outside of a counted call"""
+        with self.lock:
+            endpoint.loaded.add(normalize_model_name(model))
+    
+    def usable_count(self):
+        """Endpoints currently accepting calls"""
+        self.sync()
+        with self.lock:
+            return sum(1 for e in self.endpoints if e.accepts_calls())
+    
+    def retry_after(self):
+        """Seconds until an ejected or open endpoint may be tried again"""
+        waits = [app.config['OLLAMA_HEALTH_INTERVAL']]
+        for e in self.endpoints:
+            if e.healthy and e.circuit.state == "open":
+                waits.append(e.circuit.reset_timeout - (time.time() - e.circuit.opened_at))
+        return max(1, int(min(waits)) + 1)
+    
+    def check(self, endpoint):
+        """Refresh one endpoint's health and inventory, ejecting it from the pool if it does not answer"""
+        try:
+            response = requests.get(f"{endpoint.url}/api/tags", timeout=LLM_CONNECT_TIMEOUT)
+            response.raise_for_status()
+            # A tuned variant being present or loaded counts for the target model the agents ask for
+            models = runtime_profile.with_targets(endpoint.url, (m.get("name") for m in response.json().get("models", [])))
+            loaded = None
+            try:
+                ps = requests.get(f"{endpoint.url}/api/ps", timeout=LLM_CONNECT_TIMEOUT)
+                if ps.status_code == 200:
+                    loaded = runtime_profile.with_targets(endpoint.url, (m.get("name") for m in ps.json().get("models", [])))
+            except (requests.exceptions.RequestException, ValueError):
+                pass  # Older Ollama versions have no /api/ps
+            with self.lock:
+                recovered = not endpoint.healthy
+                endpoint.healthy = True
+                endpoint.models = models
+                if loaded is not None:
+                    endpoint.loaded = loaded
+                endpoint.last_error = None
+            if recovered:
+                log_update("System", f"Ollama endpoint {endpoint.url} is healthy again and back in the pool")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self.lock:
+                ejected = endpoint.healthy
+                endpoint.healthy = False
+                endpoint.loaded = set()
+                endpoint.last_error = str(e)
+            if ejected:
+                log_update("System", f"Ejected Ollama endpoint {endpoint.url}: {str(e)}")
+        endpoint.last_check = time.time()
+    
+    def monitor_loop(self):
+        while True:
+            for endpoint in list(self.endpoints):
+                self.check(endpoint)
+            time.sleep(app.config['OLLAMA_HEALTH_INTERVAL'])
+
+ollama_pool = OllamaPool()
+
+# Warm-up state per endpoint and model: pending, loading, ready or failed
+warmup_state = {"started": None, "finished": None, "models": {}}
+warmup_lock = threading.Lock()
+
+def warm_up_models():
+    """Load the warm-up models on every healthy endpoint that has them, so the first task does not pay the load"""
+    ollama_pool.sync()
+    for endpoint in list(ollama_pool.endpoints):
+        # Do not wait for the monitor's first round: the inventory decides where each model is loaded
+        ollama_pool.check(endpoint)
+        for model in app.config['WARMUP_MODELS']:
+            key = f"{endpoint.url}|{normalize_model_name(model)}"
+            if not endpoint.healthy or (endpoint.models is not None and normalize_model_name(model) not in endpoint.models):
+                warmup_state["models"][key] = "failed" if not endpoint.healthy else "missing"
+                continue
+            warmup_state["models"][key] = "loading"
+            start = time.time()
+            try:
+                # A generate request without a prompt only loads the model and keeps it for keep_alive;
+                # it must use the tuned options, or the first real call would reload the model with them
+                request_model, options = runtime_profile.settings(endpoint.url, model)
+                payload = {"model": request_model, "stream": False, "keep_alive": app.config['MODEL_KEEP_ALIVE']}
+                if options:
+                    payload["options"] = options
+                response = requests.post(f"{endpoint.url}/api/generate", json=payload,
+                                         timeout=(LLM_CONNECT_TIMEOUT, LLM_FIRST_TOKEN_TIMEOUT))
+                response.raise_for_status()
+                ollama_pool.mark_loaded(endpoint, model)
+                warmup_state["models"][key] = "ready"
+                log_update("System", f"Warmed up {model} on {endpoint.url} in {time.time() - start:.1f}s")
+            except requests.exceptions.RequestException as e:
+                warmup_state["models"][key] = "failed"
+                log_update("System", f"Warm-up of {model} on {endpoint.url} failed: {str(e)}", level="warning")
+    warmup_state["finished"] = time.time()
+
+def start_warmup():
+    """Start warming up the models once per process; later calls do nothing"""
+    with warmup_lock:
+        if warmup_state["started"] is not None:
+            return
+        warmup_state["started"] = time.time()
+    threading.Thread(target=warm_up_models, daemon=True).start()
+
+def readiness():
+    """Whether every warm-up model is loaded on at least one healthy endpoint"""
+    # Probing readiness must not depend on some other call having started the pool and the warm-up
+    ollama_pool.sync()
+    start_warmup()
+    endpoints = list(ollama_pool.endpoints)
+    for endpoint in endpoints:
+        if endpoint.last_check is None:
+            ollama_pool.check(endpoint)
+    models = {}
+    for model in app.config['WARMUP_MODELS']:
+        name = normalize_model_name(model)
+        models[model] = [e.url for e in endpoints if e.accepts_calls() and name in e.loaded]
+    healthy = [e.url for e in endpoints if e.accepts_calls()]
+    return {
+        "ready": bool(healthy) and all(models.values()),
+        "healthy_endpoints": healthy,
+        "models": models,
+        "warmup": {
+            "started": warmup_state["started"],
+            "finished": warmup_state["finished"],
+            "models": dict(warmup_state["models"])
+        }
+    }
+
+def collect_endpoint_metrics():
+    for e in list(ollama_pool.endpoints):
+        labels = {"endpoint": e.url}
+        metrics.set("autonai_llm_circuit_open", labels, 1 if e.circuit.state == "open" else 0)
+        metrics.set("autonai_ollama_endpoint_healthy", labels, 1 if e.healthy else 0)
+        metrics.set("autonai_ollama_endpoint_in_flight", labels, e.in_flight)
+
+metrics.register("autonai_llm_circuit_open", "gauge", "1 while an Ollama endpoint's circuit breaker is open")
+metrics.register("autonai_ollama_endpoint_healthy", "gauge", "1 while an Ollama endpoint passes health checks")
+metrics.register("autonai_ollama_endpoint_in_flight", "gauge", "LLM calls in flight per Ollama endpoint")
+metrics.add_collector(collect_endpoint_metrics)
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def abort_response(response):
+    """Shut down the socket of a streaming response so a read blocked in another thread returns"""
+    try:
+        connection = getattr(response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+class AdmissionController:
+    """Admits LLM calls into a bounded number of concurrent generations, by priority class and FIFO within a class"""
     
-    # Call the Ollama API with retries
+    CLASSES = ("interactive", "planning", "background")  # Highest priority first
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.active = {c: 0 for c in self.CLASSES}
+        self.waiting = {c: deque() for c in self.CLASSES}
+        self.hold_seconds = 30.0  # Moving average of how long a call keeps its slot
+    
+    def budgets(self):
+        """Slots per class: planning and task work get their own share of the pool, chat the reserve plus any idle slot"""
+        capacity = app.config['ADMISSION_SLOTS_PER_ENDPOINT'] * max(1, ollama_pool.usable_count())
+        reserve = app.config['ADMISSION_INTERACTIVE_RESERVE']
+        planning = app.config['ADMISSION_PLANNING_SLOTS']
+        return {
+            "interactive": max(reserve, capacity - self.active["planning"] - self.active["background"]),
+            "planning": planning,
+            "background": max(1, capacity - reserve - planning)
+        }
+    
+    def has_room(self, priority):
+        return self.active[priority] < self.budgets()[priority]
+    
+    def can_start(self, priority, ticket):
+        if self.waiting[priority][0] is not ticket or not self.has_room(priority):
+            return False
+        # A higher class that could use the free slot goes first
+        for higher in self.CLASSES[:self.CLASSES.index(priority)]:
+            if self.waiting[higher] and self.has_room(higher):
+                return False
+        return True
+    
+    def retry_after(self, priority):
+        """Seconds until a call of this class would likely be admitted"""
+        ahead = len(self.waiting[priority]) + (0 if priority == "interactive" else len(self.waiting["interactive"]))
+        return max(1, math.ceil(self.hold_seconds * (ahead + 1) / self.budgets()[priority]))
+    
+    def acquire(self, priority, cancel_token=None):
+        """Wait for a generation slot; raises LLMOverloadedError when the class is saturated"""
+        if priority not in self.CLASSES:
+            priority = "background"
+        ticket = object()
+        start = time.time()
+        max_wait = app.config['ADMISSION_MAX_WAIT'].get(priority)
+        with self.condition:
+            limit = app.config['ADMISSION_QUEUE_LIMITS'].get(priority)
+            must_queue = bool(self.waiting[priority]) or not self.has_room(priority)
+            if must_queue and limit is not None and len(self.waiting[priority]) >= limit:
+                metrics.inc("autonai_admission_rejected_total", {"class": priority, "reason": "queue_full"})
+                raise LLMOverloadedError(f"Too many {priority} LLM requests queued", self.retry_after(priority))
+            self.waiting[priority].append(ticket)
+            try:
+                while not self.can_start(priority, ticket):
+                    if cancel_token is not None and cancel_token.is_set():
+                        raise LLMCancelledError("Generation cancelled while queued")
+                    if max_wait is not None and time.time() - start > max_wait:
+                        metrics.inc("autonai_admission_rejected_total", {"class": priority, "reason": "timeout"})
+                        raise LLMOverloadedError(f"No LLM capacity for {priority} requests within {max_wait}s",
+                                                 self.retry_after(priority))
+                    self.condition.wait(0.2)
+            finally:
+                self.waiting[priority].remove(ticket)
+                self.condition.notify_all()
+            self.active[priority] += 1
+        metrics.observe("autonai_admission_wait_seconds", time.time() - start, {"class": priority})
+        return priority, time.time()
+    
+    def release(self, slot):
+        priority, started = slot
+        with self.condition:
+            self.active[priority] -= 1
+            self.hold_seconds += 0.2 * (time.time() - started - self.hold_seconds)
+            self.condition.notify_all()
+    
+    def collect_metrics(self):
+        with self.condition:
+            for priority in self.CLASSES:
+                metrics.set("autonai_admission_queue_depth", {"class": priority}, len(self.waiting[priority]))
+                metrics.set("autonai_admission_active", {"class": priority}, self.active[priority])
+
+admission = AdmissionController()
+metrics.register("autonai_admission_queue_depth", "gauge", "LLM calls waiting for admission by priority class")
+metrics.register("autonai_admission_active", "gauge", "LLM calls admitted and running by priority class")
+metrics.register("autonai_admission_wait_seconds", "histogram", "Time LLM calls waited for admission")
+metrics.register("autonai_admission_rejected_total", "counter", "LLM calls rejected by admission control")
+metrics.add_collector(admission.collect_metrics)
+
+def stream_llm(messages, model="llama2:13b", max_retries=3, agent="System", stats=None, priority="background",
+               cancel_token=None, session=None, followup=None, **timeouts):
+    """Stream a generation once admission control lets a call of this priority class run"""
+    slot = admission.acquire(priority, cancel_token)
+    try:
+        yield from stream_from_pool(messages, model, max_retries, agent, stats, cancel_token=cancel_token,
+                                    session=session, followup=followup, **timeouts)
+    finally:
+        admission.release(slot)
+
+def stream_from_pool(messages, model="llama2:13b", max_retries=3, agent="System", stats=None,
+                     connect_timeout=None, first_token_timeout=None, idle_timeout=None, cancel_token=None,
+                     session=None, followup=None):
+    """Stream a generation from Ollama, yielding text fragments as they arrive; a session sends only the followup"""
+    connect_timeout = connect_timeout or LLM_CONNECT_TIMEOUT
+    first_token_timeout = first_token_timeout or LLM_FIRST_TOKEN_TIMEOUT
+    idle_timeout = idle_timeout or LLM_IDLE_TIMEOUT
+    
+    # Retries are only possible until the first fragment has been handed to the caller
+    received = False
+    last_error = None
+    failed_endpoints = set()
     for attempt in range(max_retries):
+        if cancel_token is not None and cancel_token.is_set():
+            raise LLMCancelledError("Generation cancelled before it started")
+        # Retries go to another endpoint when the pool has one
+        endpoint = ollama_pool.acquire(model, exclude=failed_endpoints, prefer=session.endpoint if session else None)
+        succeeded = False
+        start = time.time()
+        watch = {"last": start, "first": False, "timed_out": None, "cancelled": False}
+        finished = threading.Event()
         try:
-            response = requests.post('http://localhost:11434/api/generate',
-                            json={
-                                'model': model,
-                                'prompt': prompt,
-                                'stream': False
-                            }, timeout=timeout)  # Increased timeout
-            
-            if response.status_code == 200:
-                return response.json()['response']
+            # The endpoint's runtime profile may substitute a tuned variant of the model and its options
+            request_model, options = runtime_profile.settings(endpoint.url, model)
+            if session is not None:
+                prompt, context = session.prompt(endpoint.url, request_model, options or {}, messages, followup)
             else:
+                prompt, context = format_prompt(messages), None
+            payload = {
+                'model': request_model,
+                'prompt': prompt,
+                'stream': True,
+                'keep_alive': app.config['MODEL_KEEP_ALIVE']
+            }
+            if options:
+                payload['options'] = options
+            if context:
+                payload['context'] = context
+            response = requests.post(f'{endpoint.url}/api/generate', json=payload,
+                                     timeout=(connect_timeout, max(first_token_timeout, idle_timeout)), stream=True)
+            
+            if response.status_code != 200:
+                last_error = LLMError(f"Ollama returned {response.status_code}: {response.text[:200]}")
                 print(f"Error calling Ollama API (attempt {attempt+1}): {response.status_code} - {response.text}")
+                if response.status_code < 500:
+                    # Bad requests and unknown models will not get better by retrying
+                    endpoint.circuit.record_success()
+                    break
+                endpoint.circuit.record_failure()
+                failed_endpoints.add(endpoint)
                 if attempt < max_retries - 1:
-                    time.sleep(2)  # Wait before retry
-        except Exception as e:
+                    metrics.inc("autonai_llm_retries_total", {"model": model, "reason": "http_error"})
+                    sleep_unless_cancelled(backoff_delay(attempt), cancel_token)
+                continue
+            
+            # Watch the stream from another thread: the socket read timeout alone cannot
+            # tell the first token apart from the gaps between tokens, and closing the
+            # connection is what makes Ollama stop generating on cancel
+            def watchdog():
+                while not finished.wait(0.2):
+                    if cancel_token is not None and cancel_token.is_set():
+                        watch["cancelled"] = True
+                        abort_response(response)
+                        return
+                    limit = idle_timeout if watch["first"] else first_token_timeout
+                    if time.time() - watch["last"] > limit:
+                        watch["timed_out"] = "idle" if watch["first"] else "first_token"
+                        abort_response(response)
+                        return
+            threading.Thread(target=watchdog, daemon=True).start()
+            
+            done = False
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    if watch["cancelled"]:
+                        break
+                    chunk = json.loads(line)
+                    watch["last"] = time.time()
+                    watch["first"] = True
+                    if chunk.get("error"):
+                        raise LLMError(f"Ollama error: {chunk['error']}")
+                    if chunk.get("response"):
+                        received = True
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        done = True
+                        record_llm_stats(chunk, model, agent, time.time() - start)
+                        if stats is not None:
+                            stats.update(summarize_llm_stats(chunk, model, attempt + 1))
+                            stats["endpoint"] = endpoint.url
+                            stats["request_model"] = request_model
+                        if session is not None:
+                            if stats is not None:
+                                stats["session"] = "continued" if context else "fresh"
+                            session.advance(endpoint.url, request_model, chunk.get("context"))
+            if watch["cancelled"] or (cancel_token is not None and cancel_token.is_set()):
+                raise LLMCancelledError("Generation cancelled")
+            if not done:
+                raise LLMTimeoutError(f"Ollama stream stopped ({watch['timed_out'] or 'connection closed'}) before the generation finished")
+            endpoint.circuit.record_success()
+            succeeded = True
+            return
+        except (requests.exceptions.RequestException, LLMError, ValueError) as e:
+            if isinstance(e, LLMCancelledError) or watch["cancelled"]:
+                metrics.inc("autonai_llm_cancellations_total", {"model": model})
+                raise LLMCancelledError("Generation cancelled") from e
+            if watch["timed_out"] and not isinstance(e, LLMTimeoutError):
+                e = LLMTimeoutError(f"No {'token' if watch['first'] else 'first token'} from Ollama within "
+                                    f"{idle_timeout if watch['first'] else first_token_timeout}s")
+            last_error = e if isinstance(e, LLMError) else LLMError(str(e))
             print(f"Exception when calling Ollama (attempt {attempt+1}): {str(e)}")
+            endpoint.circuit.record_failure()
+            failed_endpoints.add(endpoint)
+            if received:
+                # The caller already consumed part of this generation, so it cannot be replayed
+                break
             if attempt < max_retries - 1:
-                time.sleep(2)  # Wait before retry
+                metrics.inc("autonai_llm_retries_total", {"model": model, "reason": type(e).__name__})
+                sleep_unless_cancelled(backoff_delay(attempt), cancel_token)
+        finally:
+            finished.set()
+            if not succeeded:
+                # Cancelled or abandoned calls record no outcome, but must not leave a half-open circuit stuck
+                endpoint.circuit.end_trial()
+            ollama_pool.release(endpoint, model if succeeded else None)
     
-    # If all retries failed, return a simple error message
-    return "I was unable to process this task due to a connection issue. Please try a different approach or provide a different task description."
+    metrics.inc("autonai_llm_failures_total", {"model": model})
+    if not received and ollama_pool.usable_count() == 0:
+        # The failures took the last endpoint out of the pool: an outage, not a problem with this call
+        raise LLMUnavailableError(f"Ollama unavailable: {last_error}")
+    raise last_error or LLMError("Ollama call failed")
+
+def call_llm(messages, model="llama2:13b", max_retries=3, agent="System", stats=None, **options):
+    """Call the Ollama pool and return the full response, raising LLMError on failure"""
+    return "".join(stream_llm(messages, model=model, max_retries=max_retries, agent=agent, stats=stats, **options))
 
 def parse_llm_response(response: str, expecting_json=False):
     """Parse the LLM response for actions or JSON content with better resilience"""
@@ -357,7 +1961,7 @@ def parse_llm_response(response: str, expecting_json=False):
         "content": response
     }
 
-def get_agent_prompt(agent_type, task_description):
+def get_agent_prompt(agent_type, task_description, project, documents=None):
     """Get a prompt for a specific agent type and task"""
     base_prompt = AGENT_TYPES[agent_type]["system_prompt"]
     
@@ -372,24 +1976,19 @@ INPUT: input for the tool
 You can also provide your results in a structured format using JSON when appropriate.
 
 Project Context:
-{project_status["description"]}
+{project["description"]}
 
 """
     
-    # Add document context if available
-    global document_context
+    # Add the text of the selected documents, read from disk only now
+    document_context = document_store.context_for(project, documents)
     if document_context:
         prompt += f"\nDocument Context:\n{document_context}\n"
     
-    # Add related task information
-    related_tasks = [t for t in project_status["tasks"] 
-                    if t["agent_type"] != agent_type and t["status"] == "completed"]
-    if related_tasks:
-        prompt += "\nCompleted tasks from other team members:\n"
-        for task in related_tasks[-3:]:  # Only show the last 3 to avoid context overflow
-            prompt += f"- {task['description']} (by {task['agent_type']})\n"
-            if task['result']:
-                prompt += f"  Result: {task['result'][:200]}...\n"
+    # Add the shared project memory; it is kept up to date as tasks complete, so this costs the same every time
+    memory = project["memory"].rendered
+    if memory:
+        prompt += f"\nShared project memory:\n{memory}\n"
     
     return prompt
 
@@ -400,7 +1999,7 @@ if not os.path.exists(OUTPUT_DIR):
 
 # Improved file saving function for agent.py
 
-def save_output_file(agent_type, file_name, content, file_type='text'):
+def save_output_file(agent_type, file_name, content, file_type='text', trace=None):
     """Save agent output as a file, extracting code blocks if needed"""
     # Create agent-specific folder if it doesn't exist
     agent_dir = os.path.join(OUTPUT_DIR, agent_type)
@@ -419,7 +2018,10 @@ def save_output_file(agent_type, file_name, content, file_type='text'):
     extension = ".txt"  # Default
     
     # Try to extract code blocks from the content
+    extract_start = time.time()
     extracted_content = extract_code_from_response(content, file_type)
+    if trace:
+        trace.add_span("extract_artifact", extract_start, time.time(), file_type=file_type)
     
     # Set proper extension based on file_type
     if file_type == 'html':
@@ -436,8 +2038,11 @@ def save_output_file(agent_type, file_name, content, file_type='text'):
     file_path = os.path.join(agent_dir, full_name)
     
     # Write content to file
+    write_start = time.time()
     with open(file_path, 'w', encoding='utf-8') as f:
         f.write(extracted_content)
+    if trace:
+        trace.add_span("write_file", write_start, time.time(), file=full_name, bytes=len(extracted_content))
     
     return {
         'path': file_path,
@@ -491,83 +2096,746 @@ def extract_code_from_response(content, file_type):
     # Default case, just return the content
     return content
 
-def process_task(task):
-    """Process a single task with better error handling and file extraction"""
-    agent_type = task.agent_type
-    if not agent_type:
-        log_update("System", f"No agent type specified for task: {task.description}. Defaulting to Agent1.")
-        agent_type = "Agent1"
+HASHING_DIMENSIONS = 512
+
+def hashing_vector(text, dimensions=HASHING_DIMENSIONS):
+    """Embed text without a model: signed feature hashing of words and character trigrams"""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        features = [(word, 1.0)]
+        padded = f"#{word}#"
+        features += [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        for feature, weight in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % dimensions] += weight if h & 0x80000000 else -weight
+    return normalize_vector(vector)
+
+def normalize_vector(vector):
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+class VectorIndex:
+    """Approximate nearest neighbours with random-hyperplane LSH, re-ranked by exact cosine similarity"""
     
-    # Get appropriate prompt for this agent and task
-    system_prompt = get_agent_prompt(agent_type, task.description)
+    EXACT_SCAN_LIMIT = 256  # Below this many vectors a full scan is cheaper than hashing
     
-    # Add direct instructions to avoid tool usage
-    system_prompt += """
+    def __init__(self, dimensions, tables=8, bits=8, seed=0):
+        rng = random.Random(seed)
+        self.dimensions = dimensions
+        self.planes = [[[rng.gauss(0, 1) for _ in range(dimensions)] for _ in range(bits)] for _ in range(tables)]
+        self.buckets = [{} for _ in range(tables)]
+        self.vectors = {}
+    
+    def signatures(self, vector):
+        return [sum(1 << i for i, plane in enumerate(planes) if sum(p * x for p, x in zip(plane, vector)) >= 0)
+                for planes in self.planes]
+    
+    def add(self, key, vector):
+        self.vectors[key] = (vector, self.signatures(vector))
+        for table, signature in zip(self.buckets, self.vectors[key][1]):
+            table.setdefault(signature, set()).add(key)
+    
+    def remove(self, key):
+        entry = self.vectors.pop(key, None)
+        if entry is None:
+            return
+        for table, signature in zip(self.buckets, entry[1]):
+            table.get(signature, set()).discard(key)
+    
+    def nearest(self, vector, k=1):
+        """Return up to k (similarity, key) pairs, best first"""
+        if len(self.vectors) <= self.EXACT_SCAN_LIMIT:
+            candidates = self.vectors.keys()
+        else:
+            candidates = set()
+            for table, signature in zip(self.buckets, self.signatures(vector)):
+                candidates |= table.get(signature, set())
+        scored = [(sum(a * b for a, b in zip(vector, self.vectors[key][0])), key) for key in candidates]
+        scored.sort(reverse=True)
+        return scored[:k]
+
+class SemanticCache:
+    """Results of earlier tasks indexed by the embedding of their description, per agent type"""
+    
+    PENDING_LIMIT = 256  # Lookups whose embedding is kept until their result is added
+    CANDIDATES = 8  # Nearest entries considered per lookup, so a reusable one of the same project is not missed
+    
+    def __init__(self):
+        self.entries = {}  # key -> {"agent_type", "project_id", "description", "result", "created", "hits"}
+        self.indexes = {}  # (embedding space, agent type) -> VectorIndex
+        self.lock = threading.Lock()
+        self.embed_retry_at = 0  # Skip the embedding model until then after it failed
+        self.pending_vectors = OrderedDict()  # Description -> vectors from its lookup, reused when its result is added
+    
+    def embed(self, text):
+        """Embed with the local embedding model, or the hashing vectorizer if it is not available"""
+        model = app.config['SEMANTIC_CACHE_EMBED_MODEL']
+        vectors = {"hashing": hashing_vector(text)}
+        if model and time.time() >= self.embed_retry_at:
+            try:
+                # Embedding calls are short, so they bypass admission instead of queueing behind generations
+                endpoint = ollama_pool.acquire(model)
+                try:
+                    response = requests.post(f"{endpoint.url}/api/embeddings", json={"model": model, "prompt": text},
+                                             timeout=(LLM_CONNECT_TIMEOUT, 30))
+                finally:
+                    ollama_pool.release(endpoint)
+                response.raise_for_status()
+                embedding = response.json().get("embedding")
+                if not embedding:
+                    raise ValueError("empty embedding")
+                vectors[f"ollama:{model}"] = normalize_vector(embedding)
+            except (requests.exceptions.RequestException, LLMError, ValueError) as e:
+                print(f"Embedding model {model} unavailable, using the hashing vectorizer: {str(e)}")
+                self.embed_retry_at = time.time() + 300
+        return vectors
+    
+    def lookup(self, agent_type, description, project_id):
+        """Return (outcome, similarity, entry): a same-project entry to reuse, else the closest one as a draft, or a miss"""
+        vectors = self.embed(description)
+        with self.lock:
+            # The task's result is added later under the same description; keep its embedding for then
+            self.pending_vectors[description] = vectors
+            self.pending_vectors.move_to_end(description)
+            while len(self.pending_vectors) > self.PENDING_LIMIT:
+                self.pending_vectors.popitem(last=False)
+            # Prefer the model's space; entries added while it was down only exist in the hashing space
+            for space in sorted(vectors, key=lambda name: name == "hashing"):
+                index = self.indexes.get((space, agent_type))
+                if index is None or len(index.vectors) == 0:
+                    continue
+                nearest = index.nearest(vectors[space], k=self.CANDIDATES)
+                if not nearest:
+                    continue
+                thresholds = semantic_cache_thresholds(space)
+                # Only a task of the same project is reused outright; the closest of any project can still be a draft
+                same_project = [n for n in nearest if self.entries[n[1]]["project_id"] == project_id]
+                for outcome, candidates in (("reuse", same_project), ("draft", nearest)):
+                    if candidates and thresholds[outcome] is not None and candidates[0][0] >= thresholds[outcome]:
+                        similarity, key = candidates[0]
+                        entry = self.entries[key]
+                        entry["hits"] += 1
+                        return outcome, similarity, dict(entry, space=space)
+                return "miss", nearest[0][0], None
+        return "miss", 0.0, None
+    
+    def add(self, agent_type, description, result, project_id):
+        with self.lock:
+            vectors = self.pending_vectors.pop(description, None)
+        if vectors is None:
+            vectors = self.embed(description)
+        with self.lock:
+            key = str(uuid.uuid4())
+            self.entries[key] = {"agent_type": agent_type, "project_id": project_id, "description": description,
+                                 "result": result, "created": time.time(), "hits": 0}
+            for space, vector in vectors.items():
+                index = self.indexes.get((space, agent_type))
+                if index is None:
+                    index = self.indexes[(space, agent_type)] = VectorIndex(len(vector))
+                index.add(key, vector)
+            # Evict the oldest entries beyond the size limit
+            while len(self.entries) > app.config['SEMANTIC_CACHE_MAX_ENTRIES']:
+                oldest = min(self.entries, key=lambda k: self.entries[k]["created"])
+                del self.entries[oldest]
+                for index in self.indexes.values():
+                    index.remove(oldest)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.indexes.clear()
+            self.pending_vectors.clear()
+
+def semantic_cache_thresholds(space):
+    """Draft and reuse similarity thresholds of an embedding space, such as 'hashing' or 'ollama:nomic-embed-text'"""
+    thresholds = app.config['SEMANTIC_CACHE_THRESHOLDS']
+    return dict({"draft": None, "reuse": None}, **thresholds.get(space, thresholds.get(space.split(":")[0], {})))
+
+semantic_cache = SemanticCache()
+metrics.register("autonai_semantic_cache_lookups_total", "counter", "Semantic cache lookups by outcome (reuse, draft, miss)")
+
+def consult_semantic_cache(task, agent_type, messages, trace, project):
+    """Look for a near-duplicate earlier task; returns its result to reuse outright, or None after adding any draft to messages"""
+    if not app.config['SEMANTIC_CACHE_ENABLED']:
+        return None
+    with trace.span("semantic_cache") as span:
+        outcome, similarity, entry = semantic_cache.lookup(agent_type, task.description, project["id"])
+        span["similarity"] = round(similarity, 4)
+        span["outcome"] = outcome
+        metrics.inc("autonai_semantic_cache_lookups_total", {"outcome": outcome})
+        if outcome == "reuse":
+            span["space"] = entry["space"]
+            log_update(agent_type, f"Reusing the result of a similar task ({similarity:.2f}): {entry['description'][:50]}")
+            task.semantic_cache = {"outcome": "reuse", "similarity": round(similarity, 4), "source": entry["description"]}
+            return entry["result"]
+        if outcome == "draft":
+            span["space"] = entry["space"]
+            messages[-1]["content"] += (
+                f"\n\nA similar task (\"{entry['description']}\") was completed earlier. "
+                f"Use its result below as a starting draft and adapt it to this task:\n\n{entry['result']}"
+            )
+            task.semantic_cache = {"outcome": "draft", "similarity": round(similarity, 4), "source": entry["description"]}
+        return None
+
+def remember_task_result(task, agent_type, project):
+    """Add a freshly generated result to the semantic cache"""
+    if app.config['SEMANTIC_CACHE_ENABLED'] and task.result and (task.semantic_cache or {}).get("outcome") != "reuse":
+        semantic_cache.add(agent_type, task.description, task.result, project["id"])
+
+def reuse_cached_result(task, agent_type, result, trace, project):
+    """Complete a task with the result of a near-duplicate one without calling the LLM"""
+    with trace.span("store_result", reused=True):
+        task.result = result
+        source = task.semantic_cache
+        task.update_status("completed", f"Reused the result of a similar task (similarity {source['similarity']}): {source['source'][:50]}")
+    save_task_outputs(task, agent_type, trace, project)
+
+class AgentSession:
+    """An agent's running conversation with the model in one project, kept as the context tokens Ollama returns"""
+    
+    def __init__(self, agent_type):
+        self.agent_type = agent_type
+        self.lock = threading.Lock()  # Held by the task using the session
+        self.context = None
+        self.endpoint = None
+        self.model = None
+        self.tasks = 0
+        self.last_used = time.time()
+        self.documents = None  # Fingerprint of the documents and the memory lines the context already covers
+        self.memory_lines = set()
+        self.pending = None
+        self.stale = None  # Reset requested while a task held the session
+    
+    def reset(self, reason):
+        if self.context is not None:
+            metrics.inc("autonai_agent_session_resets_total", {"reason": reason})
+        self.context = None
+        self.endpoint = self.model = None
+        self.tasks = 0
+        self.documents = None
+        self.memory_lines = set()
+    
+    def expired(self):
+        """Why the session should start over before the next task, or None"""
+        if self.context is None:
+            return None
+        if self.tasks >= app.config['SESSION_MAX_TASKS']:
+            return "max_tasks"
+        if len(self.context) >= app.config['SESSION_MAX_TOKENS']:
+            return "max_tokens"
+        if time.time() - self.last_used > app.config['SESSION_IDLE_SECONDS']:
+            return "idle"
+        return None
+    
+    def followup(self, task, project, messages):
+        """The user message that continues the session with this task, or None when it must start over"""
+        documents = document_store.fingerprint(project, task.documents)
+        memory_lines = project["memory"].rendered.splitlines()
+        self.pending = (documents, memory_lines)
+        if self.context is not None and documents != self.documents:
+            # The documents the task sees were added, removed or replaced: the full prompt carries the new set
+            self.reset("documents")
+            return None
+        parts = []
+        new_lines = [line for line in memory_lines if line not in self.memory_lines]
+        if new_lines:
+            parts.append("Shared project memory, updated since your last task:\n" + "\n".join(new_lines))
+        parts.append(f"That task is done; move on to the next one.\n{messages[-1]['content']}")
+        return [{"role": "user", "content": "\n\n".join(parts)}]
+    
+    def prompt(self, endpoint_url, model, options, messages, followup):
+        """Prompt and context for a call: the follow-up on top of the session's context, or the full messages"""
+        limit = app.config['SESSION_MAX_TOKENS']
+        if options.get('num_ctx'):
+            # Leave room in the window for the new prompt and the answer
+            limit = min(limit, options['num_ctx'] // 2)
+        if self.context is not None and followup:
+            if endpoint_url != self.endpoint or model != self.model:
+                self.reset("endpoint")
+            elif len(self.context) >= limit:
+                self.reset("max_tokens")
+            else:
+                metrics.inc("autonai_agent_session_calls_total", {"outcome": "continued"})
+                return format_prompt(followup), self.context
+        metrics.inc("autonai_agent_session_calls_total", {"outcome": "fresh"})
+        return format_prompt(messages), None
+    
+    def advance(self, endpoint_url, model, context):
+        """Keep the context a finished call returned"""
+        if not context:
+            self.reset("no_context")
+            return
+        self.context = context
+        self.endpoint = endpoint_url
+        self.model = model
+        self.last_used = time.time()
+        if self.pending is not None:
+            self.documents = self.pending[0]
+            self.memory_lines.update(self.pending[1])
+    
+    def to_dict(self):
+        return {
+            "agent_type": self.agent_type,
+            "active": self.context is not None,
+            "tasks": self.tasks,
+            "context_tokens": len(self.context or ()),
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "idle_seconds": round(time.time() - self.last_used, 1)
+        }
+
+metrics.register("autonai_agent_session_calls_total", "counter", "Task LLM calls that continued an agent session or started fresh")
+metrics.register("autonai_agent_session_resets_total", "counter", "Agent sessions started over, by reason")
+
+def checkout_session(project, agent_type):
+    """Take the agent's session in this project for a task, or None if disabled or another task holds it"""
+    if not app.config['AGENT_SESSIONS_ENABLED']:
+        return None
+    with projects_lock:
+        session = project["sessions"].setdefault(agent_type, AgentSession(agent_type))
+    if not session.lock.acquire(blocking=False):
+        return None
+    reason = session.expired()
+    if reason:
+        session.reset(reason)
+    return session
+
+def checkin_session(session, succeeded):
+    """Return a session after its task; a failed or cancelled task leaves a context that must not be continued"""
+    if not succeeded:
+        session.reset("task_failed")
+    elif session.stale:
+        session.reset(session.stale)
+    else:
+        session.tasks += 1
+    session.pending = session.stale = None
+    session.lock.release()
+
+def reset_sessions(project, reason="manual"):
+    """Start every agent session of a project over; sessions in use are reset when their task ends"""
+    count = 0
+    for session in list(project["sessions"].values()):
+        if session.lock.acquire(blocking=False):
+            if session.context is not None:
+                count += 1
+            session.reset(reason)
+            session.lock.release()
+        else:
+            session.stale = reason
+    return count
+
+def build_task_messages(task, agent_type, project):
+    """Build the LLM messages for a single task"""
+    system_prompt = get_agent_prompt(agent_type, task.description, project, task.documents)
+    
+    if app.config['TOOL_LOOP_ENABLED']:
+        tools = "\n".join(f"- {tool}" for tool in get_agent_tools(agent_type).values())
+        system_prompt += f"""
+Available tools:
+{tools}
+
+To use tools, reply with only the ACTION/INPUT blocks you need (several are run at the same time);
+their results will be sent back to you. Once you have what you need, provide your complete solution
+directly in your response, including any code in markdown code blocks with appropriate language tags.
+"""
+    else:
+        # Add direct instructions to avoid tool usage
+        system_prompt += """
 IMPORTANT: Please provide your complete solution directly in your response. 
 Do not try to use specialized tools or actions. Include any code directly using 
 markdown code blocks with appropriate language tags.
 """
     
     # Create context for the LLM
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": f"Complete this task: {task.description}"}
     ]
+
+def run_tool_calls(calls, agent_type, tool_calls, trace=None):
+    """Run the requested tools concurrently in the sandbox, reusing results already in the task's cache"""
+    tools = get_agent_tools(agent_type)
+    cache = {(c["tool"], c["input"]): c for c in tool_calls if c["ok"]}
+    
+    def run(call):
+        start = time.time()
+        cached = cache.get((call["tool"], call["input"]))
+        if cached:
+            metrics.inc("autonai_tool_calls_total", {"tool": call["tool"], "outcome": "cached"})
+            return dict(cached, cached=True)
+        tool = tools.get(call["tool"]) or tools.get(call["tool"].lower())
+        if tool is None:
+            ok, output = False, f"Unknown tool '{call['tool']}'. Available tools: {', '.join(tools)}"
+        else:
+            ok, output = tool_sandbox.run(tool, call["input"])
+            metrics.observe("autonai_tool_duration_seconds", time.time() - start, {"tool": tool.name})
+        metrics.inc("autonai_tool_calls_total", {"tool": call["tool"], "outcome": "ok" if ok else "error"})
+        if trace:
+            trace.add_span("tool_call", start, time.time(), tool=call["tool"], ok=ok)
+        return {"tool": call["tool"], "input": call["input"], "output": output[:4000], "ok": ok,
+                "seconds": round(time.time() - start, 3), "cached": False}
+    
+    with ThreadPoolExecutor(max_workers=min(len(calls), app.config['TOOL_SANDBOX_PROCESSES'])) as executor:
+        results = list(executor.map(run, calls))
+    tool_calls.extend(r for r in results if not r["cached"])
+    log_update(agent_type, f"Used tools: {', '.join(r['tool'] + (' (cached)' if r['cached'] else '') for r in results)}")
+    return results
+
+def generate_with_tools(messages, agent_type, tool_calls, cancel_token=None, trace=None, stats=None,
+                        session=None, followup=None):
+    """Call the LLM, running the tools it asks for and feeding their results back, until it answers"""
+    messages = list(messages)
+    max_rounds = app.config['TOOL_MAX_ROUNDS'] if app.config['TOOL_LOOP_ENABLED'] else 0
+    for round_number in range(max_rounds + 1):
+        round_stats = {}
+        if trace:
+            with trace.span("llm_call", round=round_number) as span:
+                try:
+                    response = call_llm(messages, agent=agent_type, stats=span, cancel_token=cancel_token,
+                                        session=session, followup=followup)
+                except LLMCancelledError:
+                    span["cancelled"] = True
+                    raise
+                except LLMError as e:
+                    span["error"] = str(e)
+                    raise
+                span["response_chars"] = len(response)
+                round_stats = span
+        else:
+            response = call_llm(messages, agent=agent_type, stats=round_stats, cancel_token=cancel_token,
+                                session=session, followup=followup)
+        if stats is not None:
+            stats.update(round_stats)
+        
+        calls = parse_tool_calls(response) if round_number < max_rounds else []
+        if not calls:
+            return response
+        results = run_tool_calls(calls, agent_type, tool_calls, trace)
+        if cancel_token is not None and cancel_token.is_set():
+            raise LLMCancelledError("Generation cancelled")
+        messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "user", "content": "Tool results:\n" + "\n".join(
+            f"[{r['tool']}] {r['input']}\n{r['output']}" for r in results
+        ) + "\n\nContinue with the task. Use more tools only if you still need them."})
+        # A session already holds everything up to the answer, so only the tool results are new
+        followup = messages[-1:]
+    return response
+
+def generate_task(task, project):
+    """Run the LLM for a task; returns the response still to be stored, or None if there is nothing to store"""
+    agent_type = task.agent_type
+    if not agent_type:
+        log_update("System", f"No agent type specified for task: {task.description}. Defaulting to Agent1.")
+        agent_type = "Agent1"
+    trace = get_task_trace(task.id, agent_type)
+    
+    # Get appropriate prompt for this agent and task
+    with trace.span("build_prompt") as span:
+        messages = build_task_messages(task, agent_type, project)
+        span["prompt_chars"] = len(messages[0]["content"])
+        span["prompt_size"] = task_prompt_size(task, project)
+    
+    # Near-duplicates of earlier tasks are reused outright or get the earlier result as a draft
+    cached = consult_semantic_cache(task, agent_type, messages, trace, project)
+    if cached is not None:
+        reuse_cached_result(task, agent_type, cached, trace, project)
+        return None
     
     # Update task status
     task.update_status("in_progress", f"Task started by {agent_type}")
     log_update(agent_type, f"Working on: {task.description}")
     
-    # Call the LLM with increased timeout
-    response = call_llm(messages, timeout=300)
+    # Follow-up tasks of the same agent continue its session and only send what is new
+    session = checkout_session(project, agent_type)
+    followup = session.followup(task, project, messages) if session else None
     
-    # Store the result
-    task.result = response
+    # Call the LLM; the generation can be cancelled through the API while it runs
+    cancel_token = register_generation(task.id)
+    succeeded = False
+    tool_calls = list(task.tool_calls)
+    try:
+        response = generate_with_tools(messages, agent_type, tool_calls, cancel_token, trace,
+                                       session=session, followup=followup)
+        succeeded = not cancel_token.is_set()
+    except LLMCancelledError:
+        reset_cancelled_task(task, agent_type, cancel_token)
+        return None
+    except LLMError as e:
+        fail_task(task, agent_type, e)
+        return None
+    finally:
+        unregister_generation(task.id, cancel_token)
+        if session:
+            checkin_session(session, succeeded)
+        # Assigned rather than extended in place, so the task's version and serialization follow the new calls
+        if len(tool_calls) != len(task.tool_calls):
+            task.tool_calls = tool_calls
+    
+    # A cancel that arrived just as the generation finished still discards the result
+    if cancel_token.is_set():
+        reset_cancelled_task(task, agent_type, cancel_token)
+        return None
     
-    # Mark task as completed
-    task.update_status("completed", f"Task completed by {agent_type}")
-    log_update(agent_type, f"Completed task: {task.description}")
+    return response
+
+def store_task_result(task, agent_type, response, trace, project, batch_size=1):
+    """Store a generated result, mark the task completed and save its output files"""
+    with trace.span("store_result"):
+        task.result = response
+        
+        # Mark task as completed
+        note = f"Task completed by {agent_type}" + (" (batched)" if batch_size > 1 else "")
+        task.update_status("completed", note)
+        log_update(agent_type, f"Completed task: {task.description}")
     
     # Save relevant output files based on task description
-    if task.result:
-        # Detect file types from task description
-        desc_lower = task.description.lower()
+    save_task_outputs(task, agent_type, trace, project)
+    if batch_size == 1:
+        remember_task_result(task, agent_type, project)
+
+# Failed tasks are retried with backoff until they have used up their attempts
+TASK_MAX_ATTEMPTS = 3
+TASK_RETRY_DELAY = 30
+
+def reset_cancelled_task(task, agent_type, cancel_token):
+    """Return a cancelled task to a clean state without a partial result or artifacts"""
+    task.result = None
+    task.update_status(cancel_token.reset_status, f"Generation cancelled; task reset to {cancel_token.reset_status}")
+    log_update(agent_type, f"Cancelled task: {task.description}")
+
+def fail_task(task, agent_type, error, retry_after=None):
+    """Mark a task as failed without storing a result, scheduling a retry if attempts remain"""
+    task.last_error = str(error)
+    task.result = None
+    if isinstance(error, (LLMUnavailableError, LLMOverloadedError)):
+        # An outage or a saturated backend is not the task's fault: wait it out without using up an attempt
+        if retry_after is None:
+            retry_after = error.retry_after if isinstance(error, LLMOverloadedError) else ollama_pool.retry_after()
+        task.retry_at = time.time() + retry_after
+        note = f"LLM unavailable ({error}); requeued in {retry_after}s"
+        task.update_status("failed", note)
+        log_update(agent_type, f"Deferred task: {task.description} - {note}", level="warning")
+        return
+    task.attempts += 1
+    if task.attempts < TASK_MAX_ATTEMPTS:
+        task.retry_at = time.time() + TASK_RETRY_DELAY * (2 ** (task.attempts - 1))
+        note = f"Attempt {task.attempts} failed ({error}); requeued"
+    else:
+        task.retry_at = None
+        note = f"Attempt {task.attempts} failed ({error}); giving up"
+    task.update_status("failed", note)
+    log_update(agent_type, f"Failed task: {task.description} - {note}", level="error" if task.retry_at is None else "warning")
+
+def save_task_outputs(task, agent_type, trace=None, project=None):
+    """Save the full response and any code artifacts the task description asks for, and update the project memory"""
+    if not task.result:
+        return
+    
+    # Detect file types from task description
+    desc_lower = task.description.lower()
+    
+    # First save the full response as text
+    file_info = save_output_file(agent_type, f"{task.description[:30]}_full", task.result, 'text', trace)
+    log_update(agent_type, f"Full response saved as: {file_info['name']}")
+    
+    # Now extract and save specific files based on content detected in description
+    artifacts = []
+    if 'html' in desc_lower or 'webpage' in desc_lower or 'website' in desc_lower:
+        html_info = save_output_file(agent_type, f"{task.description[:30]}_html", task.result, 'html', trace)
+        log_update(agent_type, f"HTML content saved as: {html_info['name']}")
+        artifacts.append(('html', html_info))
         
-        # First save the full response as text
-        file_info = save_output_file(agent_type, f"{task.description[:30]}_full", task.result, 'text')
-        log_update(agent_type, f"Full response saved as: {file_info['name']}")
+    if 'css' in desc_lower or 'style' in desc_lower:
+        css_info = save_output_file(agent_type, f"{task.description[:30]}_css", task.result, 'css', trace)
+        log_update(agent_type, f"CSS content saved as: {css_info['name']}")
+        artifacts.append(('css', css_info))
         
-        # Now extract and save specific files based on content detected in description
-        if 'html' in desc_lower or 'webpage' in desc_lower or 'website' in desc_lower:
-            html_info = save_output_file(agent_type, f"{task.description[:30]}_html", task.result, 'html')
-            log_update(agent_type, f"HTML content saved as: {html_info['name']}")
-            
-        if 'css' in desc_lower or 'style' in desc_lower:
-            css_info = save_output_file(agent_type, f"{task.description[:30]}_css", task.result, 'css')
-            log_update(agent_type, f"CSS content saved as: {css_info['name']}")
-            
-        if 'javascript' in desc_lower or 'js' in desc_lower:
-            js_info = save_output_file(agent_type, f"{task.description[:30]}_js", task.result, 'js')
-            log_update(agent_type, f"JavaScript content saved as: {js_info['name']}")
-        
-        # Store file info on the task
-        task.file_info = file_info
+    if 'javascript' in desc_lower or 'js' in desc_lower:
+        js_info = save_output_file(agent_type, f"{task.description[:30]}_js", task.result, 'js', trace)
+        log_update(agent_type, f"JavaScript content saved as: {js_info['name']}")
+        artifacts.append(('js', js_info))
+    
+    # Store file info on the task
+    task.file_info = file_info
+    task.files = [file_info] + [info for _, info in artifacts]
     
-    # Return the result
-    return task.result
+    if project is not None:
+        memory_start = time.time()
+        project["memory"].record(task, agent_type, artifacts)
+        if trace:
+            trace.add_span("update_memory", memory_start, time.time())
 
-def create_project_plan(description):
-    """Create an initial project plan with proper agent type validation"""
-    global project_status
+def generate_task_batch(tasks, project):
+    """Run several small tasks for the same agent with one LLM call; returns the answer split per task id"""
+    agent_type = tasks[0].agent_type or "Agent1"
+    traces = [get_task_trace(task.id, agent_type) for task in tasks]
     
-    # Reset project status
-    project_status = {
-        "description": description,
-        "tasks": [],
-        "progress": 0,
-        "start_time": datetime.now(),
-        "last_update": datetime.now()
-    }
+    # The agent prompt and document context are evaluated once for the whole batch
+    build_start = time.time()
+    system_prompt = get_agent_prompt(agent_type, "Several small, independent tasks listed below", project)
+    system_prompt += """
+IMPORTANT: Please provide your complete solutions directly in your response. 
+Do not try to use specialized tools or actions. Include any code directly using 
+markdown code blocks with appropriate language tags.
+"""
+    task_list = "\n".join(f"=== TASK {task.id} ===\n{task.description}\n" for task in tasks)
+    user_message = f"""Complete each of the following tasks.
+
+{task_list}
+Answer every task in its own section. Start each section with the exact header line
+"=== TASK <id> ===" using the task's id, followed only by the solution for that task."""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+    build_end = time.time()
+    
+    for task, trace in zip(tasks, traces):
+        trace.add_span("build_prompt", build_start, build_end, prompt_chars=len(system_prompt),
+                       prompt_size=task_prompt_size(task, project), batch_size=len(tasks))
+        task.update_status("in_progress", f"Task started by {agent_type} in a batch of {len(tasks)}")
+    log_update(agent_type, f"Working on a batch of {len(tasks)} small tasks: " + "; ".join(t.description[:40] for t in tasks))
+    
+    # One generation for the whole batch
+    llm_start = time.time()
+    stats = {}
+    cancel_tokens = {task.id: register_generation(task.id) for task in tasks}
+    batch_token = CancelGroup(cancel_tokens.values())
+    try:
+        response = call_llm(messages, agent=agent_type, stats=stats, cancel_token=batch_token)
+    except LLMCancelledError:
+        # Tasks that were not cancelled themselves simply go back to pending
+        for task in tasks:
+            reset_cancelled_task(task, agent_type, cancel_tokens[task.id])
+        return {}
+    except LLMError as e:
+        for task in tasks:
+            fail_task(task, agent_type, e)
+        return {}
+    finally:
+        for task in tasks:
+            unregister_generation(task.id, cancel_tokens[task.id])
+    if batch_token.is_set():
+        for task in tasks:
+            reset_cancelled_task(task, agent_type, cancel_tokens[task.id])
+        return {}
+    llm_end = time.time()
+    
+    # Split the combined answer back into per-task sections
+    sections = {}
+    parts = re.split(r'^\s*=== TASK (\w+) ===\s*$', response, flags=re.MULTILINE)
+    for i in range(1, len(parts) - 1, 2):
+        sections[parts[i]] = parts[i + 1].strip()
+    
+    results = {}
+    for task, trace in zip(tasks, traces):
+        trace.add_span("llm_call", llm_start, llm_end, batch_size=len(tasks), response_chars=len(response), **stats)
+        section = sections.get(task.id)
+        if not section:
+            # Leave the task for an individual run rather than storing someone else's answer
+            task.update_status("pending", "Batch response had no section for this task; it will run on its own")
+            log_update(agent_type, f"No batch result for: {task.description}. Requeued individually.")
+            task.batch_excluded = True
+            continue
+        results[task.id] = section
+    
+    return results
+
+class StreamingJSONObjectParser:
+    """Pull complete top-level JSON objects out of a streamed LLM response as soon as they close"""
+    
+    def __init__(self):
+        self.buffer = ""
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.object_start = None
+        self.position = 0
+    
+    def feed(self, text):
+        """Add a fragment of the stream and return the objects it completed"""
+        self.buffer += text
+        objects = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth > 0:
+                # Quotes only matter inside objects; prose around the array may contain apostrophes
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        objects.append(json.loads(self.buffer[self.object_start:self.position + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    # Drop consumed text so the buffer stays small on long plans
+                    self.buffer = self.buffer[self.position + 1:]
+                    self.position = -1
+                    self.object_start = None
+            self.position += 1
+        if self.depth == 0 and self.position > 0:
+            self.buffer = ""
+            self.position = 0
+        return objects
+
+def add_planned_task(task_data, plan_refs, project):
+    """Register one task parsed from the planner, resolving dependencies on tasks already seen"""
+    # Get agent type with validation
+    agent_type = task_data.get("agent_type", "Agent1")
+    # Ensure it's a valid agent type
+    if agent_type not in AGENT_TYPES:
+        log_update("System", f"Invalid agent type: {agent_type}. Using Agent1 instead.")
+        agent_type = "Agent1"
+    
+    dependencies = []
+    unresolved = []
+    for ref in task_data.get("dependencies", []) or []:
+        ref = str(ref)
+        if ref in plan_refs:
+            dependencies.append(plan_refs[ref])
+        else:
+            unresolved.append(ref)
+    
+    task = Task(
+        description=task_data.get("description", "Undefined task"),
+        agent_type=agent_type,
+        priority=task_data.get("priority", 3),
+        dependencies=dependencies
+    )
+    
+    # Planner references are either explicit ids or the 1-based position in the array
+    plan_ref = str(task_data.get("id", len(plan_refs) + 1))
+    plan_refs[plan_ref] = task.id
+    
+    task.plan_ref = plan_ref
+    task.unresolved_dependencies = unresolved
+    
+    # Tasks that were waiting for this one can now point at its real id
+    for t in project["tasks"]:
+        if plan_ref in t.unresolved_dependencies:
+            t.dependencies = t.dependencies + [task.id]
+            t.unresolved_dependencies = [r for r in t.unresolved_dependencies if r != plan_ref]
+    
+    project["tasks"].append(task)
+    get_task_trace(task.id, task.agent_type, project["id"])
+    scheduler.notify()
+    return task
+
+def create_project_plan(project):
+    """Create a project plan, dispatching each task as soon as the planner has streamed it"""
+    description = project["description"]
+    project["planning"] = True
     
     # Create a prompt for the project manager
     system_prompt = AGENT_TYPES["Agent1"]["system_prompt"]
@@ -585,43 +2853,44 @@ Break down this project into specific tasks that can be assigned to our team of
 - Agent4: Testing, validation
 
 For each task, specify:
-1. A clear, specific description
-2. The agent type who should handle it (Agent1, Agent2, Agent3, or Agent4 only)
-3. Priority (1-5, where 1 is highest)
-4. Any dependencies (task IDs that must be completed first)
+1. A short id such as "T1", "T2", ...
+2. A clear, specific description
+3. The agent type who should handle it (Agent1, Agent2, Agent3, or Agent4 only)
+4. Priority (1-5, where 1 is highest)
+5. Any dependencies (ids of tasks that must be completed first)
 
-Respond with a JSON array of tasks, where each task has the fields: description, agent_type, priority.
+Respond with a JSON array of tasks, where each task has the fields: id, description, agent_type, priority, dependencies.
+List tasks in the order they can start, so that dependencies appear before the tasks that need them.
 """
     
-    # Call the LLM with an increased timeout
-    response = call_llm([{"role": "system", "content": prompt}], timeout=300)
-    
-    # Parse the response to extract tasks
-    parsed = parse_llm_response(response, expecting_json=True)
-    
+    # Stream the plan and hand each task to the workers as soon as its object closes
+    parser = StreamingJSONObjectParser()
+    plan_refs = {}
     tasks = []
-    if parsed["type"] == "json" and isinstance(parsed["content"], list):
-        # Successfully parsed JSON list of tasks
-        task_list = parsed["content"]
-        for task_data in task_list:
-            # Get agent type with validation
-            agent_type = task_data.get("agent_type", "Agent1")
-            # Ensure it's a valid agent type
-            if agent_type not in AGENT_TYPES:
-                log_update("System", f"Invalid agent type: {agent_type}. Using Agent1 instead.")
-                agent_type = "Agent1"
-                
-            task = Task(
-                description=task_data.get("description", "Undefined task"),
-                agent_type=agent_type,
-                priority=task_data.get("priority", 3),
-                dependencies=task_data.get("dependencies", [])
-            )
-            tasks.append(task)
-    else:
+    response = ""
+    cancel_token = register_generation(f"planner:{project['id']}")
+    try:
+        for fragment in stream_llm([{"role": "system", "content": prompt}], agent="Agent1", priority="planning",
+                                   cancel_token=cancel_token):
+            response += fragment
+            for task_data in parser.feed(fragment):
+                if not isinstance(task_data, dict) or "description" not in task_data:
+                    continue
+                task = add_planned_task(task_data, plan_refs, project)
+                tasks.append(task)
+                log_update("Agent1", f"Task: {task.description} (Assigned to: {task.agent_type})")
+    except LLMError as e:
+        project["planning"] = False
+        if not tasks:
+            raise
+        # Keep the tasks that were already streamed and dispatched
+        log_update("System", f"Planning stopped early after {len(tasks)} tasks: {str(e)}")
+    finally:
+        unregister_generation(f"planner:{project['id']}", cancel_token)
+    
+    if not tasks:
         # Fallback: manual parsing
         lines = response.split("\n")
-        current_task = None
         
         for line in lines:
             line = line.strip()
@@ -638,74 +2907,359 @@ Respond with a JSON array of tasks, where each task has the fields: description,
                 description = re.sub(r'^\s*[-*]\s*', '', line)
                 description = re.sub(r'\(.*?\)', '', description).strip()
                 
-                task = Task(description=description, agent_type=agent_type)
-                tasks.append(task)
+                tasks.append(add_planned_task({"description": description, "agent_type": agent_type}, plan_refs, project))
+        
+        # If we still have no tasks, create a generic one
+        if not tasks:
+            tasks.append(add_planned_task({"description": f"Implement project: {description}", "agent_type": "Agent1"}, plan_refs, project))
+        
+        for task in tasks:
+            log_update("Agent1", f"Task: {task.description} (Assigned to: {task.agent_type})")
     
-    # If we still have no tasks, create a generic one
-    if not tasks:
-        task = Task(description=f"Implement project: {description}", agent_type="Agent1")
-        tasks.append(task)
+    # References to tasks the planner never produced can no longer be satisfied
+    for t in project["tasks"]:
+        if t.unresolved_dependencies:
+            log_update("System", f"Dropping unknown dependencies {t.unresolved_dependencies} of task: {t.description[:50]}")
+            t.unresolved_dependencies = []
+    project["planning"] = False
+    scheduler.notify()
     
     # Sort tasks by priority
     tasks.sort(key=lambda t: getattr(t, 'priority', 3))
     
-    # Update project status
-    for task in tasks:
-        project_status["tasks"].append(task.to_dict())
-    
     # Log the plan creation
     log_update("Agent1", f"Created project plan with {len(tasks)} tasks")
-    for task in tasks:
-        log_update("Agent1", f"Task: {task.description} (Assigned to: {task.agent_type})")
     
     return tasks
 
-# Update the initial UI message
-def initializeUI():
-    # Display welcome message
-    appendMessage('system', 'Multi-Agent System initialized. The following versatile agents are ready to assist you:\n' +
-        '- Agent1: Versatile coordinator capable of handling any task\n' +
-        '- Agent2: Versatile agent capable of handling any task\n' +
-        '- Agent3: Versatile agent capable of handling any task\n' +
-        '- Agent4: Versatile agent capable of handling any task\n\n' +
-        'To start a project, type "start project: [your project description]"')
+# Update the initial UI message
+def initializeUI():
+    # Display welcome message
+    appendMessage('system', 'Multi-Agent System initialized. The following versatile agents are ready to assist you:\n' +
+        '- Agent1: Versatile coordinator capable of handling any task\n' +
+        '- Agent2: Versatile agent capable of handling any task\n' +
+        '- Agent3: Versatile agent capable of handling any task\n' +
+        '- Agent4: Versatile agent capable of handling any task\n\n' +
+        'To start a project, type "start project: [your project description]"')
+
+class LogSink:
+    """Background writer of log records into size-rotated JSONL segments, each with a small index"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+        self.thread = None
+        self.lock = threading.Lock()
+        self.segment = None  # Open file of the current segment
+        self.summary = None  # Index entry of the current segment
+        self.written_seq = 0  # Highest record sequence number already in a segment
+        self.dropped = 0
+    
+    def submit(self, record):
+        """Hand a record to the writer without waiting; records are dropped when the writer falls behind"""
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("autonai_log_records_dropped_total")
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            # Write whatever else is waiting in the same batch
+            while len(records) < 500:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Whatever goes wrong with one batch, the writer must live on and count the batch as done
+            try:
+                self.write(records)
+            except Exception as e:
+                try:
+                    print(f"Could not write log records: {ascii(e)}")
+                except Exception:
+                    pass  # The console may be what failed
+            finally:
+                for _ in records:
+                    self.queue.task_done()
+    
+    def write(self, records):
+        lines = [json.dumps(record) for record in records if record is not None]
+        if not lines:
+            return
+        if self.segment is None:
+            self.open_segment()
+        self.segment.write("\n".join(lines) + "\n")
+        self.segment.flush()
+        summary = self.summary
+        for record in records:
+            if record is None:
+                continue
+            summary["start"] = summary["start"] or record["time"]
+            summary["end"] = record["time"]
+            summary["first_seq"] = summary["first_seq"] or record["seq"]
+            summary["last_seq"] = record["seq"]
+            summary["agents"][record["agent"]] = summary["agents"].get(record["agent"], 0) + 1
+            summary["levels"][record["level"]] = summary["levels"].get(record["level"], 0) + 1
+            self.written_seq = record["seq"]
+        if self.segment.tell() >= app.config['LOG_SEGMENT_BYTES']:
+            self.close_segment()
+        # Echo only once the records are safely in the segment, since the console may not take every character
+        if app.config['LOG_STDOUT']:
+            for record in records:
+                if record is not None:
+                    print(f"[{record['timestamp']}] [{record['agent']}] {record['message']}")
+    
+    def open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.written_seq:012d}.jsonl"
+        self.segment = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self.summary = {"file": name, "start": None, "end": None, "first_seq": None, "last_seq": None,
+                        "agents": {}, "levels": {}}
+    
+    def close_segment(self):
+        """Finish the current segment: write its index entry and delete the oldest segments"""
+        self.segment.close()
+        path = os.path.join(self.directory, self.summary["file"])
+        with open(f"{path}.idx", "w", encoding="utf-8") as f:
+            json.dump(self.summary, f)
+        self.segment = None
+        self.summary = None
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+        for name in segments[:-app.config['LOG_MAX_SEGMENTS']]:
+            for stale in (name, f"{name}.idx"):
+                try:
+                    os.remove(os.path.join(self.directory, stale))
+                except OSError:
+                    pass
+    
+    def flush(self, timeout=5.0):
+        """Wait until every record submitted so far is written, for at most timeout seconds; True if it was"""
+        if self.thread is None:
+            return True
+        deadline = time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+    
+    def segments(self):
+        """Index entries of the segments on disk, newest first; unfinished segments have no counts"""
+        try:
+            names = sorted((name for name in os.listdir(self.directory) if name.endswith(".jsonl")), reverse=True)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, f"{name}.idx"), encoding="utf-8") as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                entries.append({"file": name})
+        return entries
+    
+    def query(self, agent=None, level=None, start=None, end=None, limit=100):
+        """The newest records matching the filters, oldest first, reading only the segments that can match"""
+        def matches(record):
+            return ((agent is None or record.get("agent") == agent)
+                    and (level is None or record.get("level") == level)
+                    and (start is None or record.get("time", 0) >= start)
+                    and (end is None or record.get("time", 0) <= end))
+        
+        self.flush()
+        found = []
+        for entry in self.segments():
+            if "agents" in entry:
+                # Skip segments the index rules out
+                if agent is not None and agent not in entry["agents"]:
+                    continue
+                if level is not None and level not in entry["levels"]:
+                    continue
+                if start is not None and entry["end"] is not None and entry["end"] < start:
+                    continue
+                if end is not None and entry["start"] is not None and entry["start"] > end:
+                    continue
+            segment_matches = deque(maxlen=limit - len(found))
+            try:
+                with open(os.path.join(self.directory, entry["file"]), encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if matches(record):
+                            segment_matches.append(record)
+            except OSError:
+                continue
+            found = list(segment_matches) + found
+            if len(found) >= limit:
+                break
+        return found
+
+log_sink = LogSink(app.config['LOG_DIR'])
+metrics.register("autonai_log_records_dropped_total", "counter", "Log records dropped because the writer fell behind")
+atexit.register(log_sink.flush)
+log_sequence = itertools.count(1)
 
-def log_update(agent, message):
-    """Log an update from an agent to the shared memory"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def log_update(agent, message, level="info"):
+    """Log an update from an agent: kept in memory for the UI and written to the log segments in the background"""
+    now = time.time()
     update = {
-        "timestamp": timestamp,
+        "seq": next(log_sequence),
+        "time": now,
+        "timestamp": format_timestamp(now),
         "agent": agent,
+        "level": level,
         "message": message
     }
     agent_updates.append(update)
-    print(f"[{timestamp}] [{agent}] {message}")
+    log_sink.submit(update)
+
+DEFAULT_MODEL = "llama2:13b"
+
+def task_kind(description):
+    """Rough type of a task from its description, one of the duration history dimensions"""
+    desc_lower = description.lower()
+    for kind, words in (("html", ("html", "webpage", "website")), ("css", ("css", "style")),
+                        ("js", ("javascript", " js")), ("test", ("test", "qa", "verify")),
+                        ("docs", ("document", "readme", "write", "content"))):
+        if any(word in f" {desc_lower}" for word in words):
+            return kind
+    return "other"
+
+def prompt_size_bucket(chars):
+    """Power-of-two bucket of a prompt size, so similar prompts share history"""
+    return max(0, int(math.log2(max(chars, 1))) - 9)  # 0 covers anything up to 1K characters
+
+class DurationHistory:
+    """Moving averages of task durations by agent, task type, prompt size and model, persisted to disk"""
+    
+    ALPHA = 0.3  # Weight of the newest observation in the moving average
+    
+    def __init__(self, path):
+        self.path = path
+        self.averages = None  # "agent|kind|bucket|model" -> [average seconds, observations]
+        self.lock = threading.Lock()
+    
+    def load(self):
+        if self.averages is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.averages = json.load(f)
+            except (OSError, ValueError):
+                self.averages = {}
+    
+    @staticmethod
+    def keys(agent_type, kind, bucket, model):
+        # From the most specific to the most general; "*" matches any value
+        return [f"{agent_type}|{kind}|{bucket}|{model}", f"*|{kind}|{bucket}|{model}",
+                f"*|{kind}|*|{model}", f"*|*|*|{model}", "*|*|*|*"]
+    
+    def record(self, agent_type, kind, bucket, model, seconds):
+        with self.lock:
+            self.load()
+            for key in self.keys(agent_type, kind, bucket, model):
+                average = self.averages.get(key)
+                if average is None:
+                    self.averages[key] = [seconds, 1]
+                else:
+                    average[0] += self.ALPHA * (seconds - average[0])
+                    average[1] += 1
+            try:
+                with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(self.averages, f)
+                os.replace(f"{self.path}.tmp", self.path)
+            except OSError as e:
+                print(f"Could not save task duration history: {str(e)}")
+    
+    def estimate(self, agent_type, kind, bucket, model):
+        with self.lock:
+            self.load()
+            for key in self.keys(agent_type, kind, bucket, model):
+                if key in self.averages:
+                    return self.averages[key][0]
+        return app.config['DEFAULT_TASK_SECONDS']
+
+duration_history = DurationHistory(app.config['TASK_HISTORY_PATH'])
+
+def task_prompt_size(t, project):
+    """Size of a task's prompt as the duration history measures it, the same when recording and estimating"""
+    agent_type = t.agent_type or "Agent1"
+    documents = document_store.list(project["id"])
+    if t.documents is not None:
+        documents = [d for d in documents if d.id in t.documents]
+    document_chars = min(app.config['DOCUMENT_CONTEXT_CHARS'], sum(d.size for d in documents))
+    return (len(AGENT_TYPES.get(agent_type, AGENT_TYPES["Agent1"])["system_prompt"]) + len(t.description)
+            + len(project["memory"].rendered) + document_chars)
+
+def estimate_task_duration(t, project, model=None):
+    """Expected seconds for a task, from the history of similar tasks on the model it would run on"""
+    return duration_history.estimate(t.agent_type or "Agent1", task_kind(t.description),
+                                     prompt_size_bucket(task_prompt_size(t, project)),
+                                     model or ollama_pool.expected_model(DEFAULT_MODEL))
 
-def get_next_task():
-    """Get the next task to be processed with proper agent type validation"""
+def record_task_duration(task, seconds, trace):
+    """Add a completed task's duration to the history the scheduler estimates from"""
+    if task.status != "completed" or (task.semantic_cache or {}).get("outcome") == "reuse":
+        return
+    prompt_size, model = 0, DEFAULT_MODEL
+    for span in trace.to_dict()["spans"]:
+        if span["name"] == "build_prompt":
+            prompt_size = span["attrs"].get("prompt_size", prompt_size)
+        elif span["name"] == "llm_call":
+            model = span["attrs"].get("request_model") or span["attrs"].get("model", model)
+    duration_history.record(task.agent_type or "Agent1", task_kind(task.description),
+                            prompt_size_bucket(prompt_size), model, seconds)
+
+def critical_path_lengths(project, estimates):
+    """Estimated seconds from the start of each unfinished task to the end of the longest chain after it"""
+    dependents = {}
+    for t in project["tasks"]:
+        for dep_id in t.dependencies:
+            dependents.setdefault(dep_id, []).append(t)
+    lengths = {}
+    def length(t, visiting=()):
+        if t.id in lengths:
+            return lengths[t.id]
+        if t.id in visiting:
+            return 0  # Dependency cycle; the tasks on it simply never become ready
+        tail = max((length(d, visiting + (t.id,)) for d in dependents.get(t.id, []) if d.status != "completed"),
+                   default=0)
+        lengths[t.id] = estimates.get(t.id, 0) + tail
+        return lengths[t.id]
+    for t in project["tasks"]:
+        if t.status != "completed":
+            length(t)
+    return lengths
+
+def get_next_task(project):
+    """Get the next task of a project to be processed with proper agent type validation"""
     pending_tasks = []
+    tasks_by_id = {t.id: t for t in project["tasks"]}
+    update_blocked_tasks(project, tasks_by_id)
     
-    for t in project_status["tasks"]:
-        if t["status"] == "pending":
-            # Create a task with only the basic required fields
-            task = Task(
-                description=t["description"],
-                agent_type=t.get("agent_type"),
-                priority=t.get("priority", 3)
-            )
-            
+    for task in project["tasks"]:
+        # Tasks waiting on dependencies the planner has not streamed yet cannot run
+        if task.unresolved_dependencies:
+            continue
+        if task.status == "pending" or is_retry_due(task):
             # Validate agent type
             if not task.agent_type or task.agent_type not in AGENT_TYPES:
                 # Set a default agent type (Agent1)
                 task.agent_type = "Agent1"
                 log_update("System", f"Invalid agent type detected. Setting to Agent1 for task: {task.description[:50]}...")
-            
-            # Set the ID to match the stored task
-            task.id = t["id"]
-            
-            # Set dependencies if they exist
-            if "dependencies" in t:
-                task.dependencies = t["dependencies"]
                 
             pending_tasks.append(task)
     
@@ -713,84 +3267,351 @@ def get_next_task():
     if not pending_tasks:
         return None
     
-    # Sort by priority (lowest number = highest priority)
-    pending_tasks.sort(key=lambda t: t.priority)
+    # Only tasks whose dependencies are all completed may run; the others wait
+    ready_tasks = [task for task in pending_tasks if dependencies_met(task, project, tasks_by_id)]
+    if not ready_tasks:
+        return None
     
-    # Find the first task with no unmet dependencies
-    for task in pending_tasks:
-        dependencies_met = True
-        
-        # Check if all dependencies are completed
-        if task.dependencies:
-            for dep_id in task.dependencies:
-                dep_completed = False
-                for t in project_status["tasks"]:
-                    if t["id"] == dep_id and t["status"] == "completed":
-                        dep_completed = True
-                        break
-                
-                if not dep_completed:
-                    dependencies_met = False
-                    break
-        
-        if dependencies_met:
-            return task
+    policy = app.config['SCHEDULING_POLICY']
+    if policy == "priority":
+        # Sort by priority (lowest number = highest priority)
+        ready_tasks.sort(key=lambda t: t.priority)
+        return ready_tasks[0]
     
-    # If no tasks have all dependencies met, return the highest priority task
-    return pending_tasks[0]
+    model = ollama_pool.expected_model(DEFAULT_MODEL)
+    estimates = {t.id: estimate_task_duration(t, project, model) for t in project["tasks"] if t.status != "completed"}
+    if policy == "lpt":
+        # Longest processing time first, planner priority breaking ties
+        ready_tasks.sort(key=lambda t: (-estimates.get(t.id, 0), t.priority))
+    else:
+        # The task heading the longest remaining chain of work goes first: delaying it delays the whole project
+        lengths = critical_path_lengths(project, estimates)
+        ready_tasks.sort(key=lambda t: (-lengths.get(t.id, 0), -estimates.get(t.id, 0), t.priority))
+    return ready_tasks[0]
+
+def update_blocked_tasks(project, tasks_by_id):
+    """Block tasks whose dependencies can no longer complete, and unblock them when that changes"""
+    for task in project["tasks"]:
+        if task.status not in ("pending", "blocked"):
+            continue
+        dead = []
+        for dep_id in task.dependencies:
+            dep = tasks_by_id.get(dep_id)
+            if dep is None or dep.status == "cancelled" or dep.status == "blocked" or (
+                    dep.status == "failed" and dep.attempts >= TASK_MAX_ATTEMPTS):
+                dead.append(dep_id)
+        if dead and task.status == "pending":
+            task.update_status("blocked", f"Waiting on tasks that cannot complete: {', '.join(dead)}")
+        elif not dead and task.status == "blocked":
+            task.update_status("pending", "Dependencies can complete again")
+
+def is_retry_due(task):
+    """Check if a failed task has attempts left and its backoff has elapsed"""
+    return task.status == "failed" and task.retry_at is not None and task.retry_at <= time.time()
 
-def update_project_progress():
+def dependencies_met(task, project, tasks_by_id=None):
+    """Check if all dependencies of a task are completed"""
+    if tasks_by_id is None:
+        tasks_by_id = {t.id: t for t in project["tasks"]}
+    for dep_id in task.dependencies:
+        dep = tasks_by_id.get(dep_id)
+        if dep is None or dep.status != "completed":
+            return False
+    return True
+
+def is_small_task(task):
+    """Check if a task is short enough to share an LLM call with others"""
+    return not task.batch_excluded and len(task.description) <= app.config['BATCH_MAX_DESCRIPTION_CHARS']
+
+def get_batch_companions(task, project):
+    """Find other small, ready tasks for the same agent that can run in the same LLM call"""
+    companions = []
+    tasks_by_id = {t.id: t for t in project["tasks"]}
+    for t in project["tasks"]:
+        if len(companions) >= app.config['BATCH_MAX_TASKS'] - 1:
+            break
+        if (t.id == task.id or t.status != "pending" or t.unresolved_dependencies
+                or t.agent_type != task.agent_type or not is_small_task(t)):
+            continue
+        if dependencies_met(t, project, tasks_by_id):
+            # Claim the companion so no other worker picks it up
+            t.status = "in_progress"
+            companions.append(t)
+    return companions
+
+def update_project_progress(project):
     """Update the project progress percentage"""
-    total_tasks = len(project_status["tasks"])
+    total_tasks = len(project["tasks"])
     if total_tasks == 0:
-        project_status["progress"] = 0
+        project["progress"] = 0
         return
     
-    completed_tasks = sum(1 for t in project_status["tasks"] if t["status"] == "completed")
-    project_status["progress"] = int((completed_tasks / total_tasks) * 100)
-    project_status["last_update"] = datetime.now()
+    completed_tasks = sum(1 for t in project["tasks"] if t.status == "completed")
+    project["progress"] = int((completed_tasks / total_tasks) * 100)
+    project["last_update"] = datetime.now()
+
+class FairScheduler:
+    """Deficit round-robin over running projects, honouring per-project concurrency limits"""
+    
+    def __init__(self, quantum=1.0):
+        self.quantum = quantum
+        self.order = []  # Project ids in round-robin order
+        self.position = 0
+        self.condition = threading.Condition(projects_lock)
+    
+    def add_project(self, project):
+        with self.condition:
+            projects[project["id"]] = project
+            self.order.append(project["id"])
+            self.condition.notify_all()
+    
+    def remove_project(self, project_id):
+        with self.condition:
+            projects.pop(project_id, None)
+            if project_id in self.order:
+                index = self.order.index(project_id)
+                self.order.remove(project_id)
+                if index < self.position:
+                    self.position -= 1
+            if self.position >= len(self.order):
+                self.position = 0
+    
+    def notify(self):
+        """Wake idle workers because new work may be ready"""
+        with self.condition:
+            self.condition.notify_all()
+    
+    def next_task(self, timeout=1.0, limit=True):
+        """Claim the next task to run, or return (None, None) after waiting up to timeout"""
+        with self.condition:
+            claimed = self.claim(limit)
+            if claimed[0] is None and timeout:
+                self.condition.wait(timeout)
+                claimed = self.claim(limit)
+            return claimed
+    
+    def claim(self, limit=True):
+        # limit=False ignores max_concurrency, which sizes local threads, not distributed workers
+        # Visit each project at most twice: once to spend remaining deficit, once after a new quantum
+        for _ in range(2 * len(self.order)):
+            if not self.order:
+                break
+            project = projects.get(self.order[self.position])
+            if project is None or not project["running"] or (limit and project["in_flight"] >= project["max_concurrency"]):
+                self.advance()
+                continue
+            
+            task = get_next_task(project)
+            if task is None:
+                # An idle project does not bank credit for later
+                project["deficit"] = 0.0
+                self.advance()
+                continue
+            
+            cost = 1.0
+            if project["deficit"] < cost:
+                self.advance()
+                continue
+            
+            project["deficit"] -= cost
+            project["in_flight"] += 1
+            task.status = "in_progress"
+            return project, task
+        return None, None
+    
+    def advance(self):
+        """Move to the next project and give it its quantum"""
+        self.position = (self.position + 1) % len(self.order)
+        project = projects.get(self.order[self.position])
+        if project is not None:
+            project["deficit"] += self.quantum * project["weight"]
+    
+    def task_done(self, project):
+        with self.condition:
+            project["in_flight"] = max(0, project["in_flight"] - 1)
+            self.condition.notify_all()
+
+scheduler = FairScheduler()
 
 # Add this to your worker_thread function to catch and handle errors better
 
+class StageMonitor:
+    """Busy time of the task pipeline's stages, to show whether generation is kept saturated"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervals = {}  # stage -> deque of finished (start, end) busy intervals, oldest first
+        self.active = {}  # stage -> {token: start} for work still running
+    
+    @contextmanager
+    def busy(self, stage):
+        token = object()
+        start = time.time()
+        with self.lock:
+            self.active.setdefault(stage, {})[token] = start
+        try:
+            yield
+        finally:
+            end = time.time()
+            with self.lock:
+                del self.active[stage][token]
+                self.intervals.setdefault(stage, deque()).append((start, end))
+            metrics.inc("autonai_stage_busy_seconds_total", {"stage": stage}, end - start)
+    
+    def utilization(self, stage, threads):
+        """Fraction of the recent window the stage's threads spent busy"""
+        window = app.config['STAGE_UTILIZATION_WINDOW']
+        now = time.time()
+        since = now - window
+        with self.lock:
+            intervals = self.intervals.get(stage, deque())
+            while intervals and intervals[0][1] < since:
+                intervals.popleft()
+            busy = sum(end - max(start, since) for start, end in intervals)
+            busy += sum(now - max(start, since) for start in self.active.get(stage, {}).values())
+        return min(1.0, busy / (window * max(1, threads)))
+    
+    def collect_metrics(self):
+        threads = {"generation": app.config['WORKER_THREADS'], "postprocess": app.config['POSTPROCESS_THREADS']}
+        for stage, count in threads.items():
+            metrics.set("autonai_stage_utilization", {"stage": stage}, round(self.utilization(stage, count), 4))
+        metrics.set("autonai_postprocess_queue_depth", value=postprocess_queue.qsize() if postprocess_queue else 0)
+
+stage_monitor = StageMonitor()
+metrics.register("autonai_stage_busy_seconds_total", "counter", "Seconds the task pipeline's threads spent busy by stage")
+metrics.register("autonai_stage_utilization", "gauge", "Share of the recent window each pipeline stage was busy, per thread")
+metrics.register("autonai_postprocess_queue_depth", "gauge", "Generated results waiting for post-processing")
+metrics.register("autonai_postprocess_queue_wait_seconds", "histogram", "Time generated results waited for a post-processing thread")
+metrics.register("autonai_postprocess_handoff_blocked_seconds_total", "counter", "Seconds workers waited for room in the post-processing queue")
+metrics.add_collector(stage_monitor.collect_metrics)
+
+# Bounded hand-off between the generation workers and the post-processing threads
+postprocess_queue = None
+postprocessors = []
+
+def handoff_postprocess(project, batch, results, task_start, generation_seconds):
+    """Queue generated results for post-processing, blocking while the queue is full"""
+    job = (project, batch, results, task_start, generation_seconds, time.time())
+    if not postprocessors:
+        postprocess_results(*job)
+        return
+    postprocess_queue.put(job)
+    blocked = time.time() - job[-1]
+    if blocked > 0.001:
+        metrics.inc("autonai_postprocess_handoff_blocked_seconds_total", value=blocked)
+
+def postprocess_results(project, batch, results, task_start, generation_seconds, queued_at):
+    """Store generated results, save their files and update the task history and project progress"""
+    dequeued = time.time()
+    metrics.observe("autonai_postprocess_queue_wait_seconds", dequeued - queued_at)
+    for item in batch:
+        trace = get_task_trace(item.id, item.agent_type)
+        response = results.get(item.id)
+        if response is not None:
+            trace.add_span("postprocess_queued", queued_at, dequeued)
+            store_task_result(item, item.agent_type or "Agent1", response, trace, project, len(batch))
+    
+    for item in batch:
+        trace = get_task_trace(item.id, item.agent_type)
+        metrics.observe("autonai_task_duration_seconds", (time.time() - task_start) / len(batch), {"agent": item.agent_type})
+        # The scheduler's estimates are about how long a task occupies a worker
+        record_task_duration(item, generation_seconds / len(batch), trace)
+        if item.status == "completed":
+            trace.finished = time.time()
+    
+    # Update project progress and wake workers for the tasks this unblocked
+    update_project_progress(project)
+    scheduler.notify()
+
+def postprocess_thread():
+    """Post-processing thread: takes generated results off the queue until the process exits"""
+    while True:
+        job = postprocess_queue.get()
+        try:
+            with stage_monitor.busy("postprocess"):
+                postprocess_results(*job)
+        except Exception as e:
+            # Return the tasks to the queue rather than leaving them in progress forever
+            for item in job[1]:
+                if item.status == "in_progress":
+                    item.status = "pending"
+            log_update("System", f"Error in post-processing thread: {str(e)}", level="error")
+        finally:
+            postprocess_queue.task_done()
+
+def start_postprocessors():
+    """Start the post-processing threads once; they keep draining the queue across worker restarts"""
+    global postprocess_queue
+    if postprocessors or app.config['POSTPROCESS_THREADS'] <= 0:
+        return
+    postprocess_queue = queue.Queue(maxsize=max(1, app.config['POSTPROCESS_QUEUE_SIZE']))
+    for _ in range(app.config['POSTPROCESS_THREADS']):
+        thread = threading.Thread(target=postprocess_thread)
+        thread.daemon = True
+        thread.start()
+        postprocessors.append(thread)
+
+def wait_for_postprocessing(timeout=10):
+    """Wait until every queued result has been stored, or the timeout passes"""
+    deadline = time.time() + timeout
+    while postprocess_queue is not None and postprocess_queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.05)
+
 def worker_thread():
     """Background worker thread that processes tasks with better error handling"""
     global system_running
     
     while system_running:
         try:
-            # If there are no tasks in the queue, check if we need to get a new one
-            if task_queue.empty():
-                next_task = get_next_task()
-                if next_task:
-                    task_queue.put(next_task)
+            # Ask the scheduler for the next task of whichever project's turn it is
+            project, task = scheduler.next_task()
+            if task is None:
+                continue
             
-            # Try to get a task with a 5-second timeout
+            batch = [task]
             try:
-                task = task_queue.get(timeout=5)
-                
                 # Verify the agent type exists before processing
                 if not task.agent_type or task.agent_type not in AGENT_TYPES:
                     log_update("System", f"Invalid agent type: {task.agent_type}. Using Agent1 instead.")
                     task.agent_type = "Agent1"  # Default to Agent1
                 
-                # Process the task
-                process_task(task)
+                # Optionally pack small ready tasks for the same agent into one LLM call
+                batch = [task]
+                if app.config['BATCH_SMALL_TASKS']:
+                    if is_small_task(task):
+                        with projects_lock:
+                            batch += get_batch_companions(task, project)
                 
-                # Update the corresponding task in project_status
-                for i, t in enumerate(project_status["tasks"]):
-                    if t["id"] == task.id:
-                        project_status["tasks"][i] = task.to_dict()
-                        break
+                # Record how long each task waited since it became ready
+                task_start = time.time()
+                for item in batch:
+                    trace = get_task_trace(item.id, item.agent_type, project["id"])
+                    ready_at = trace.created
+                    for dep_id in item.dependencies:
+                        dep_trace = task_traces.get(dep_id)
+                        if dep_trace and dep_trace.finished:
+                            ready_at = max(ready_at, dep_trace.finished)
+                    trace.add_span("queued", ready_at, task_start)
                 
-                # Update project progress
-                update_project_progress()
+                # Generate; storing the results is left to the post-processing stage
+                with stage_monitor.busy("generation"):
+                    if len(batch) > 1:
+                        results = generate_task_batch(batch, project)
+                    else:
+                        response = generate_task(task, project)
+                        results = {task.id: response} if response is not None else {}
                 
-                # Mark task as done
-                task_queue.task_done()
+                handoff_postprocess(project, batch, results, task_start, time.time() - task_start)
                 
-            except queue.Empty:
-                # No tasks in queue, sleep briefly
-                time.sleep(1)
+            except Exception:
+                # Release claimed tasks so they are not stuck in progress forever
+                for item in batch:
+                    if item.status == "in_progress":
+                        item.status = "pending"
+                raise
+            finally:
+                # Free the project's concurrency slot
+                scheduler.task_done(project)
                 
         except Exception as e:
             # Get detailed error information
@@ -798,21 +3619,534 @@ def worker_thread():
             error_details = traceback.format_exc()
             
             # Log the specific error with details
-            log_update("System", f"Error in worker thread: {str(e)}")
+            log_update("System", f"Error in worker thread: {str(e)}", level="error")
             print(f"Detailed error: {error_details}")
             
             # Sleep longer after an error to avoid rapid error loops
             time.sleep(5)
 
+def start_workers():
+    """Start the shared pool of worker threads if it is not running yet"""
+    global system_running, workers
+    system_running = True
+    workers = [w for w in workers if w.is_alive()]
+    if app.config['TASK_QUEUE_PATH']:
+        # Distributed mode: one dispatcher feeds the shared queue that remote workers lease from
+        if not workers:
+            worker = threading.Thread(target=queue_dispatcher_thread)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        return
+    start_postprocessors()
+    while len(workers) < app.config['WORKER_THREADS']:
+        worker = threading.Thread(target=worker_thread)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+def stop_workers():
+    """Stop the worker pool, cancelling in-flight generations so Ollama is free right away"""
+    global system_running, workers
+    system_running = False
+    cancelled = cancel_all_generations()
+    scheduler.notify()
+    for worker in workers:
+        if worker.is_alive() and worker is not threading.current_thread():
+            worker.join(timeout=10)
+    workers = []
+    wait_for_postprocessing()
+    return cancelled
+
+def start_project(description, weight=1, max_concurrency=1):
+    """Register a new project alongside the running ones and make sure workers are available"""
+    global current_project_id
+    project = new_project(description, weight, max_concurrency)
+    scheduler.add_project(project)
+    current_project_id = project["id"]
+    start_workers()
+    return project
+
+def stop_project(project, reset_status="pending"):
+    """Stop scheduling a project's tasks and cancel its generations in flight"""
+    project["running"] = False
+    cancelled = 0
+    if cancel_generation(f"planner:{project['id']}", reset_status):
+        cancelled += 1
+    for t in list(project["tasks"]):
+        if t.status == "in_progress" and cancel_generation(t.id, reset_status):
+            cancelled += 1
+    return cancelled
+
+class SharedTaskQueue:
+    """Durable task queue in an SQLite file that several processes or hosts can lease from"""
+    
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    project_id TEXT,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    enqueued_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, enqueued_at)")
+    
+    @contextmanager
+    def connect(self):
+        # The default rollback journal is used on purpose: WAL does not work on network filesystems
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def enqueue(self, task_id, project_id, payload):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (id, project_id, payload, state, attempts, enqueued_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?)",
+                (task_id, project_id, json.dumps(payload), now, now))
+    
+    def lease(self, owner, timeout):
+        """Lease the oldest available task; leases whose holder stopped heartbeating are taken over"""
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Tasks whose leases keep expiring are given up instead of being leased forever
+                conn.execute(
+                    "UPDATE tasks SET state = 'done', result = ?, updated_at = ? "
+                    "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (json.dumps({"error": f"Lease expired {TASK_MAX_ATTEMPTS} times"}), now, now, TASK_MAX_ATTEMPTS))
+                row = conn.execute(
+                    "SELECT id, project_id, payload, attempts FROM tasks "
+                    "WHERE state = 'queued' OR (state = 'leased' AND lease_expires < ?) "
+                    "ORDER BY enqueued_at LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE tasks SET state = 'leased', lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (owner, now + timeout, now, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return {"id": row[0], "project_id": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+    
+    def heartbeat(self, task_id, owner, timeout):
+        """Extend a lease; False means it was lost to another worker or the task was cancelled"""
+        now = time.time()
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (now + timeout, now, task_id, owner))
+            return cursor.rowcount == 1
+    
+    def complete(self, task_id, owner, result):
+        """Report the result of a leased task back to the API process"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET state = 'done', result = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (json.dumps(result), time.time(), task_id, owner))
+            return cursor.rowcount == 1
+    
+    def release(self, task_id, owner):
+        """Give a lease back without a result, e.g. when a worker shuts down"""
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = 'queued', lease_owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (time.time(), task_id, owner))
+    
+    def remove(self, task_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+    
+    def collect(self):
+        """Take the finished tasks off the queue"""
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, result, attempts, lease_owner FROM tasks WHERE state = 'done'").fetchall()
+            conn.executemany("DELETE FROM tasks WHERE id = ?", [(row[0],) for row in rows])
+            conn.execute("COMMIT")
+        return [{"id": row[0], "result": json.loads(row[1] or "{}"), "attempts": row[2], "worker": row[3]} for row in rows]
+    
+    def counts(self):
+        with self.connect() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+shared_queue = None
+
+def get_shared_queue():
+    """Open the shared task queue configured for this process"""
+    global shared_queue
+    if shared_queue is None or shared_queue.path != app.config['TASK_QUEUE_PATH']:
+        shared_queue = SharedTaskQueue(app.config['TASK_QUEUE_PATH'])
+    return shared_queue
+
+def collect_shared_queue_metrics():
+    if shared_queue is None:
+        return
+    try:
+        counts = shared_queue.counts()
+    except sqlite3.Error:
+        return
+    for state in ("queued", "leased", "done"):
+        metrics.set("autonai_shared_queue_tasks", {"state": state}, counts.get(state, 0))
+
+metrics.register("autonai_shared_queue_tasks", "gauge", "Tasks in the shared distributed queue by state")
+metrics.add_collector(collect_shared_queue_metrics)
+
+def queue_dispatcher_thread():
+    """Move ready tasks onto the shared queue and apply the results distributed workers report back"""
+    global system_running
+    dispatched = {}  # task id -> (project, task, cancel token)
+    
+    while system_running:
+        try:
+            tasks_queue = get_shared_queue()
+            
+            # Hand every ready task to the distributed workers until the queue holds enough unleased work;
+            # the scheduler keeps projects fair, but their local concurrency limits do not apply here
+            room = app.config['DISPATCH_QUEUE_DEPTH'] - tasks_queue.counts().get("queued", 0)
+            timeout = 0.5
+            while room > 0:
+                project, task = scheduler.next_task(timeout=timeout, limit=False)
+                if task is None:
+                    break
+                timeout = 0
+                if dispatch_task(tasks_queue, project, task, dispatched):
+                    room -= 1
+            if room <= 0:
+                time.sleep(0.5)
+            
+            # Cancelled tasks are pulled off the queue; a worker holding one loses its lease
+            for task_id, (project, task, cancel_token) in list(dispatched.items()):
+                if cancel_token.is_set():
+                    tasks_queue.remove(task_id)
+                    del dispatched[task_id]
+                    unregister_generation(task_id, cancel_token)
+                    reset_cancelled_task(task, task.agent_type, cancel_token)
+                    update_project_progress(project)
+                    scheduler.task_done(project)
+            
+            for item in tasks_queue.collect():
+                if item["id"] not in dispatched:
+                    continue
+                project, task, cancel_token = dispatched.pop(item["id"])
+                unregister_generation(task.id, cancel_token)
+                apply_remote_result(task, project, item)
+                scheduler.task_done(project)
+        
+        except Exception as e:
+            import traceback
+            log_update("System", f"Error in queue dispatcher: {str(e)}", level="error")
+            print(f"Detailed error: {traceback.format_exc()}")
+            time.sleep(5)
+    
+    # Tasks still out with the workers go back to pending when the system stops
+    for task_id, (project, task, cancel_token) in dispatched.items():
+        unregister_generation(task_id, cancel_token)
+        try:
+            get_shared_queue().remove(task_id)
+        except sqlite3.Error:
+            pass
+        task.update_status("pending", "Distributed mode stopped before the task finished")
+        scheduler.task_done(project)
+
+def dispatch_task(tasks_queue, project, task, dispatched):
+    """Put a claimed task on the shared queue; returns False if it was completed from the semantic cache instead"""
+    try:
+        if not task.agent_type or task.agent_type not in AGENT_TYPES:
+            task.agent_type = "Agent1"
+        trace = get_task_trace(task.id, task.agent_type, project["id"])
+        with trace.span("build_prompt") as span:
+            messages = build_task_messages(task, task.agent_type, project)
+            span["prompt_chars"] = len(messages[0]["content"])
+            span["prompt_size"] = task_prompt_size(task, project)
+        cached = consult_semantic_cache(task, task.agent_type, messages, trace, project)
+        if cached is not None:
+            reuse_cached_result(task, task.agent_type, cached, trace, project)
+            trace.finished = time.time()
+            update_project_progress(project)
+            scheduler.task_done(project)
+            return False
+        tasks_queue.enqueue(task.id, project["id"], {
+            "task": task.to_dict(),
+            "agent_type": task.agent_type,
+            "messages": messages,
+            "enqueued_at": time.time()
+        })
+    except Exception:
+        if task.status == "in_progress":
+            task.status = "pending"
+        scheduler.task_done(project)
+        raise
+    task.update_status("in_progress", f"Queued for a distributed {task.agent_type} worker")
+    dispatched[task.id] = (project, task, register_generation(task.id))
+    log_update("System", f"Queued task for distributed workers: {task.description[:50]}")
+    return True
+
+def apply_remote_result(task, project, item):
+    """Record the result a distributed worker reported for a task"""
+    result = item["result"]
+    agent_type = task.agent_type
+    trace = get_task_trace(task.id, agent_type, project["id"])
+    stats = result.get("stats") or {}
+    if result.get("started"):
+        trace.add_span("queued", result.get("enqueued_at", trace.created), result["started"], worker=item["worker"])
+        trace.add_span("llm_call", result["started"], result["finished"], worker=item["worker"],
+                       response_chars=len(result.get("response") or ""), **stats)
+        metrics.observe("autonai_task_duration_seconds", result["finished"] - result["started"], {"agent": agent_type})
+    
+    if result.get("error"):
+        error_type = LLMUnavailableError if result.get("retry_after") is not None else LLMError
+        fail_task(task, agent_type, error_type(f"{result['error']} (worker {item['worker']})"), result.get("retry_after"))
+    else:
+        with trace.span("store_result"):
+            task.result = result.get("response", "")
+            task.tool_calls = result.get("tool_calls") or task.tool_calls
+            task.update_status("completed", f"Task completed by {agent_type} on worker {item['worker']}")
+            log_update(agent_type, f"Completed task: {task.description}")
+        if result.get("started"):
+            record_task_duration(task, result["finished"] - result["started"], trace)
+        # Artifacts are extracted from the reported response on the API side, next to the other outputs
+        save_task_outputs(task, agent_type, trace, project)
+        remember_task_result(task, agent_type, project)
+        trace.finished = time.time()
+    
+    update_project_progress(project)
+
+def run_distributed_worker(queue_path, worker_id=None, lease_timeout=None, poll_interval=1.0):
+    """Lease tasks from the shared queue, run them against the local Ollama and report the results"""
+    tasks_queue = SharedTaskQueue(queue_path)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    lease_timeout = lease_timeout or app.config['TASK_LEASE_TIMEOUT']
+    print(f"Worker {worker_id} leasing tasks from {queue_path}")
+    start_warmup()
+    
+    while True:
+        lease = tasks_queue.lease(worker_id, lease_timeout)
+        if lease is None:
+            time.sleep(poll_interval)
+            continue
+        
+        payload = lease["payload"]
+        agent_type = payload["agent_type"]
+        print(f"[{worker_id}] {agent_type} working on: {payload['task']['description'][:60]} (attempt {lease['attempts']})")
+        
+        # Keep the lease alive while generating; losing it means another worker or a cancel took over
+        cancel_token = CancelToken()
+        done = threading.Event()
+        def heartbeat():
+            while not done.wait(lease_timeout / 3):
+                try:
+                    if not tasks_queue.heartbeat(lease["id"], worker_id, lease_timeout):
+                        cancel_token.cancel()
+                        return
+                except sqlite3.Error as e:
+                    print(f"[{worker_id}] Heartbeat failed: {e}")
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        
+        stats = {}
+        started = time.time()
+        try:
+            tool_calls = list(payload["task"].get("tool_calls") or [])
+            response = generate_with_tools(payload["messages"], agent_type, tool_calls, cancel_token, stats=stats)
+            result = {"response": response, "tool_calls": tool_calls}
+        except LLMCancelledError:
+            print(f"[{worker_id}] Lease on {lease['id']} lost; dropping the result")
+            continue
+        except LLMUnavailableError as e:
+            result = {"error": str(e), "retry_after": ollama_pool.retry_after()}
+        except LLMError as e:
+            result = {"error": str(e)}
+        except KeyboardInterrupt:
+            tasks_queue.release(lease["id"], worker_id)
+            raise
+        finally:
+            done.set()
+            heartbeat_thread.join()
+        
+        result.update({"stats": stats, "enqueued_at": payload.get("enqueued_at"), "started": started, "finished": time.time()})
+        if not tasks_queue.complete(lease["id"], worker_id, result):
+            print(f"[{worker_id}] Lease on {lease['id']} expired before the result was reported")
+
+# Task fields of status listings; the result, notes and tool calls are fetched per task from /api/tasks/<id>
+STATUS_TASK_FIELDS = ("id", "description", "agent_type", "priority", "status", "created_at", "updated_at",
+                      "completed_at", "dependencies", "attempts", "last_error", "retry_at", "documents",
+                      "plan_ref", "unresolved_dependencies")
+
+def task_fields_arg(default=None):
+    """Task fields requested with ?fields=a,b (or * for all); the default drops the heavy ones"""
+    value = request.args.get('fields')
+    if value is None:
+        return default
+    if value.strip() == "*":
+        return None
+    return [f.strip() for f in value.split(",") if f.strip()]
+
+def task_view(task, fields=None):
+    """A task's serialized form, limited to the given fields"""
+    serialized = task.to_dict()
+    if fields is None:
+        return serialized
+    return {f: serialized[f] for f in fields if f in serialized}
+
+def list_tasks_view(project):
+    """Tasks of a project for status responses, honouring ?fields= and ?since=<cursor>"""
+    fields = task_fields_arg(STATUS_TASK_FIELDS)
+    since = request.args.get('since', type=int)
+    tasks = list(project["tasks"])
+    cursor = max([t.version for t in tasks] + [since or 0])
+    if since is not None:
+        # Delta mode: only the tasks that changed after the cursor of an earlier response
+        tasks = [t for t in tasks if t.version > since]
+    return [task_view(t, fields) for t in tasks], cursor
+
+def updates_since_arg(default_count):
+    """Agent updates after ?updates_since=<cursor>, or the last few; returns (updates, cursor)"""
+    since = request.args.get('updates_since', type=int)
+    updates = list(agent_updates)
+    cursor = updates[-1]["seq"] if updates else (since or 0)
+    if since is None:
+        return updates[-default_count:], cursor
+    return [u for u in updates if u["seq"] > since], cursor
+
+def project_summary(project):
+    """Compact description of a project for API responses"""
+    return {
+        'id': project["id"],
+        'description': project["description"],
+        'progress': project["progress"],
+        'tasks_completed': sum(1 for t in project["tasks"] if t.status == "completed"),
+        'tasks_total': len(project["tasks"]),
+        'running': project["running"],
+        'planning': project["planning"],
+        'weight': project["weight"],
+        'max_concurrency': project["max_concurrency"],
+        'in_flight': project["in_flight"],
+        'start_time': project["start_time"].strftime("%Y-%m-%d %H:%M:%S") if project["start_time"] else None,
+        'last_update': project["last_update"].strftime("%Y-%m-%d %H:%M:%S") if project["last_update"] else None
+    }
+
+
+
 # Flask routes
+@app.before_request
+def start_request_timer():
+    g.request_start = time.time()
+
+@app.before_request
+def warm_up_serving_process():
+    # Whatever server runs the app (debug reloader, plain python agent.py or WSGI), the process
+    # that serves requests loads the models; a reloader's watcher process never gets here
+    start_warmup()
+
+@app.after_request
+def record_request_latency(response):
+    if hasattr(g, 'request_start'):
+        # Use the route template so per-task URLs do not explode the label set
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("autonai_http_request_duration_seconds", time.time() - g.request_start, {
+            "endpoint": endpoint,
+            "method": request.method,
+            "status": str(response.status_code)
+        })
+    return response
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/css", "application/javascript", "text/javascript"}
+
+def accepted_encodings(header):
+    """Content codings a client accepts, from its Accept-Encoding header"""
+    accepted = set()
+    for part in header.lower().split(","):
+        coding, _, params = part.partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    return accepted
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code >= 300 or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_BYTES']:
+        return response
+    accepted = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    if "br" in accepted:
+        try:
+            import brotli  # Optional; gzip is used without it
+            response.set_data(brotli.compress(data, quality=5))
+            response.headers["Content-Encoding"] = "br"
+            return response
+        except ImportError:
+            pass
+    if "gzip" in accepted:
+        response.set_data(gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL']))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+@app.errorhandler(LLMError)
+def handle_llm_error(error):
+    """Report LLM outages to API clients instead of returning an apology as if it were an answer"""
+    if isinstance(error, LLMOverloadedError):
+        # Saturated, not broken: tell the client when to come back instead of making it wait
+        response = jsonify({
+            'error': str(error),
+            'response': "[System] The agents are busy right now. Please try again shortly."
+        })
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+    log_update("System", f"LLM unavailable: {str(error)}", level="error")
+    status = 503
+    response = jsonify({
+        'error': str(error),
+        'response': f"[System] The language model is currently unavailable: {str(error)}"
+    })
+    if isinstance(error, LLMUnavailableError):
+        response.headers['Retry-After'] = str(ollama_pool.retry_after())
+    return response, status
+
 @app.route('/')
 def home():
     return jsonify({"status": "Async Multi-Agent System is running"})
 
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the models are loaded on a healthy backend, 503 while still warming up"""
+    state = readiness()
+    return jsonify(state), 200 if state["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose runtime metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Names users address in chat, mapped to the agent whose prompt answers; Agent1 is the coordinator
+CHAT_PERSONAS = {"ProjectManager": "Agent1", "FrontendDev": "Agent2", "BackendDev": "Agent3", "ContentWriter": "Agent4"}
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    global system_running, project_status
-    
     data = request.json
     user_message = data.get('message', '')
     
@@ -827,18 +4161,9 @@ def chat():
         # Extract project description
         project_description = user_message.split(":", 1)[1].strip()
         
-        # Stop any existing project
-        system_running = False
-        time.sleep(1)  # Give worker thread time to clean up
-        
-        # Create a new project plan
-        tasks = create_project_plan(project_description)
-        
-        # Start the worker thread if not already running
-        system_running = True
-        worker = threading.Thread(target=worker_thread)
-        worker.daemon = True
-        worker.start()
+        # Run the new project next to the others; workers pick tasks as soon as they are streamed
+        project = start_project(project_description)
+        tasks = create_project_plan(project)
         
         # Response for the user
         task_list = "\n".join([f"- {task.description} → {task.agent_type}" for task in tasks])
@@ -849,22 +4174,30 @@ def chat():
 The team is now working on these tasks. You can check progress by asking for a status update."""
 
     elif user_message.lower().startswith("stop") or user_message.lower() == "stop":
-        # Stop the worker thread
-        system_running = False
+        # Stop the current project and abort the generations it is waiting on
+        project = get_project()
+        cancelled = stop_project(project) if project else 0
         response = "[System] Project has been stopped. All agents have ceased working."
+        if cancelled:
+            response += f" {cancelled} in-flight generation(s) were cancelled and their tasks reset to pending."
+    
+    elif ("status" in user_message.lower() or "progress" in user_message.lower()) and get_project() is None:
+        response = "[ProjectManager] No project has been started yet. Type \"start project: [your project description]\" to begin."
     
     elif "status" in user_message.lower() or "progress" in user_message.lower():
         # Provide a status update
-        update_project_progress()
+        project = get_project()
+        update_project_progress(project)
         
-        completed = sum(1 for t in project_status["tasks"] if t["status"] == "completed")
-        in_progress = sum(1 for t in project_status["tasks"] if t["status"] == "in_progress")
-        pending = sum(1 for t in project_status["tasks"] if t["status"] == "pending")
-        total = len(project_status["tasks"])
+        completed = sum(1 for t in project["tasks"] if t.status == "completed")
+        in_progress = sum(1 for t in project["tasks"] if t.status == "in_progress")
+        pending = sum(1 for t in project["tasks"] if t.status == "pending")
+        failed = sum(1 for t in project["tasks"] if t.status == "failed")
+        total = len(project["tasks"])
         
         # Get the most recent updates from each agent
         recent_updates = {}
-        for update in reversed(agent_updates[-20:]):  # Look through the last 20 updates
+        for update in reversed(list(agent_updates)[-20:]):  # Look through the last 20 updates
             agent = update["agent"]
             if agent not in recent_updates and agent != "User" and agent != "System":
                 recent_updates[agent] = update
@@ -872,8 +4205,8 @@ The team is now working on these tasks. You can check progress by asking for a s
                 break
         
         status_msg = f"""[ProjectManager] Project Status:
-- Progress: {project_status["progress"]}% complete
-- Tasks: {completed}/{total} completed, {in_progress} in progress, {pending} pending
+- Progress: {project["progress"]}% complete
+- Tasks: {completed}/{total} completed, {in_progress} in progress, {pending} pending, {failed} failed
 
 Recent agent activities:
 """
@@ -882,40 +4215,47 @@ Recent agent activities:
         
         if in_progress > 0:
             status_msg += "\nCurrently working on:\n"
-            for task in project_status["tasks"]:
-                if task["status"] == "in_progress":
-                    status_msg += f"- {task['description']} (Assigned to: {task['agent_type']})\n"
+            for task in project["tasks"]:
+                if task.status == "in_progress":
+                    status_msg += f"- {task.description} (Assigned to: {task.agent_type})\n"
+        
+        other_projects = [p for p in list(projects.values()) if p["id"] != project["id"] and p["running"]]
+        if other_projects:
+            status_msg += f"\n{len(other_projects)} other project(s) are running alongside this one.\n"
         
         response = status_msg
     
     elif any(agent in user_message.lower() for agent in ["projectmanager", "frontenddev", "backenddev", "contentwriter"]):
+        project_description = get_project()["description"] if get_project() else ""
         # Direct question to a specific agent
         for agent_type in ["ProjectManager", "FrontendDev", "BackendDev", "ContentWriter"]:
             if agent_type.lower() in user_message.lower():
                 # Create a prompt for this agent
-                system_prompt = AGENT_TYPES[agent_type]["system_prompt"]
+                system_prompt = AGENT_TYPES[CHAT_PERSONAS[agent_type]]["system_prompt"]
                 prompt = f"""
 {system_prompt}
 
 Project Context:
-{project_status["description"]}
+{project_description}
 
 The user is asking you directly: {user_message}
 
 Respond as {agent_type} with your expertise. Focus on giving a helpful, informative response.
 """
                 # Call the LLM
-                agent_response = call_llm([{"role": "system", "content": prompt}])
+                agent_response = call_llm([{"role": "system", "content": prompt}], agent=CHAT_PERSONAS[agent_type],
+                                          priority="interactive")
                 response = f"[{agent_type}] {agent_response}"
                 break
     else:
         # General question or instruction - route to Project Manager
-        system_prompt = AGENT_TYPES["ProjectManager"]["system_prompt"]
+        project_description = get_project()["description"] if get_project() else ""
+        system_prompt = AGENT_TYPES[CHAT_PERSONAS["ProjectManager"]]["system_prompt"]
         prompt = f"""
 {system_prompt}
 
 Current Project Context:
-{project_status["description"]}
+{project_description}
 
 The user says: {user_message}
 
@@ -923,27 +4263,38 @@ Respond as the Project Manager. If this is a new instruction, explain how you'll
 If it's a question, provide a helpful response based on the current project state.
 """
         # Call the LLM
-        agent_response = call_llm([{"role": "system", "content": prompt}])
+        agent_response = call_llm([{"role": "system", "content": prompt}], agent=CHAT_PERSONAS["ProjectManager"],
+                                  priority="interactive")
         response = f"[ProjectManager] {agent_response}"
     
-    # Log the response
-    log_update("System", response)
+    # Log the response; the whole reply already goes back to the user, the log only keeps its start
+    limit = app.config['LOG_MESSAGE_CHARS']
+    log_update("System", response if len(response) <= limit else f"{response[:limit]}... ({len(response)} characters)")
     
-    return jsonify({
+    project = get_project()
+    result = {
         'response': response,
-        'updates': agent_updates[-10:],  # Return the last 10 updates
-        'project_status': {
-            'description': project_status["description"],
-            'progress': project_status["progress"],
-            'tasks_completed': sum(1 for t in project_status["tasks"] if t["status"] == "completed"),
-            'tasks_total': len(project_status["tasks"])
+        'project_status': project_summary(project) if project else {
+            'description': "",
+            'progress': 0,
+            'tasks_completed': 0,
+            'tasks_total': 0
         }
-    })
+    }
+    # Updates are only attached for clients that track them with a cursor
+    if 'updates_since' in request.args:
+        result['updates'], result['updates_cursor'] = updates_since_arg(10)
+    return jsonify(result)
+
+@app.route('/api/backends', methods=['GET'])
+def list_backends():
+    """Health, inventory and load of every configured Ollama endpoint"""
+    ollama_pool.sync()
+    return jsonify({'endpoints': [e.to_dict() for e in list(ollama_pool.endpoints)]})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    global document_context
-    
+    """Add a document to the store; the 'project' form field scopes it, otherwise every project sees it"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -952,46 +4303,89 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
+    project_id = request.form.get('project') or None
+    if project_id and get_project(project_id) is None:
+        return jsonify({'error': 'Project not found'}), 404
+    
     file_data = file.read()
     file_type = file.filename
     
     try:
-        extracted_text = DocumentProcessor.process_document(file_data, file_type)
-        
-        # Truncate if too long
-        max_length = 5000
-        if len(extracted_text) > max_length:
-            extracted_text = extracted_text[:max_length] + f"\n[Note: Document truncated from {len(extracted_text)} characters to {max_length} characters]"
+        document = extract_document(file_data, file_type)
+        extracted_text = document["text"]
         
-        document_context = extracted_text
-        log_update("System", f"Document uploaded: {file.filename} ({len(extracted_text)} characters)")
+        # The text goes to disk; prompts read it back within their own budget
+        stored, created = document_store.add(file.filename, document["chunks"], document["hash"], project_id)
+        log_update("System", f"Document uploaded: {file.filename} ({len(extracted_text)} characters{', cached' if document['cache_hit'] else ''})")
         
         return jsonify({
             'success': True,
             'message': f'Successfully processed {file.filename}',
-            'textLength': len(extracted_text)
+            'documentId': stored.id,
+            'duplicate': not created,
+            'textLength': len(extracted_text),
+            'chunks': len(document["chunks"]),
+            'contentHash': document["hash"],
+            'cacheHit': document["cache_hit"]
         })
     except Exception as e:
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
+@app.route('/api/documents', methods=['GET'])
+def list_documents():
+    """Documents visible to a project (?project=<id>), or every stored document"""
+    project_id = request.args.get('project')
+    return jsonify({'documents': [d.to_dict() for d in document_store.list(project_id)]})
+
+@app.route('/api/documents/<doc_id>', methods=['GET'])
+def get_document(doc_id):
+    """Metadata of a document, with its text when ?text=1"""
+    document = document_store.get(doc_id)
+    if document is None:
+        return jsonify({'error': 'Document not found'}), 404
+    result = document.to_dict()
+    if request.args.get('text'):
+        result['text'] = document.read()
+    return jsonify(result)
+
+@app.route('/api/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    if not document_store.remove(doc_id):
+        return jsonify({'error': 'Document not found'}), 404
+    log_update("System", f"Document {doc_id} removed")
+    return jsonify({'success': True})
+
+@app.route('/api/tasks/<task_id>/documents', methods=['PUT'])
+def select_task_documents(task_id):
+    """Choose the documents a task's prompt includes; null restores the default of all project documents"""
+    project, task = find_task(task_id)
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    selection = (request.json or {}).get('documents')
+    if selection is not None:
+        if not isinstance(selection, list):
+            return jsonify({'error': 'documents must be a list of document ids or null'}), 400
+        visible = {d.id for d in document_store.list(project["id"])}
+        unknown = [doc_id for doc_id in selection if doc_id not in visible]
+        if unknown:
+            return jsonify({'error': f'Unknown documents for this project: {", ".join(map(str, unknown))}'}), 400
+    task.documents = selection
+    return jsonify({'success': True, 'task_id': task_id, 'documents': selection})
+
 @app.route('/api/clear', methods=['POST'])
 def clear_conversation():
-    global system_running, agent_updates, project_status, document_context
+    global current_project_id
     
-    # Stop the worker thread
-    system_running = False
-    time.sleep(1)  # Give worker thread time to clean up
+    # Stop the workers and abort any generation in flight
+    stop_workers()
     
     # Clear all data
-    agent_updates = []
-    document_context = ""
-    project_status = {
-        "description": "",
-        "tasks": [],
-        "progress": 0,
-        "start_time": None,
-        "last_update": None
-    }
+    for project_id in list(projects.keys()):
+        scheduler.remove_project(project_id)
+    current_project_id = None
+    agent_updates.clear()
+    task_traces.clear()
+    document_store.clear()
     
     log_update("System", "System has been reset. All progress has been cleared.")
     
@@ -999,37 +4393,345 @@ def clear_conversation():
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    update_project_progress()
+    """Status of a project (?project=<id>), defaulting to the current one"""
+    project = get_project(request.args.get('project'))
+    updates, updates_cursor = updates_since_arg(20)  # The last 20 updates without a cursor
+    if project is None:
+        return jsonify({
+            'project': {
+                'description': "",
+                'progress': 0,
+                'tasks_completed': 0,
+                'tasks_total': 0,
+                'start_time': None,
+                'last_update': None,
+            },
+            'tasks': [],
+            'cursor': request.args.get('since', 0, type=int),
+            'updates': updates,
+            'updates_cursor': updates_cursor,
+            'running': False
+        })
+    
+    update_project_progress(project)
+    tasks, cursor = list_tasks_view(project)
     
     return jsonify({
-        'project': {
-            'description': project_status["description"],
-            'progress': project_status["progress"],
-            'tasks_completed': sum(1 for t in project_status["tasks"] if t["status"] == "completed"),
-            'tasks_total': len(project_status["tasks"]),
-            'start_time': project_status["start_time"].strftime("%Y-%m-%d %H:%M:%S") if project_status["start_time"] else None,
-            'last_update': project_status["last_update"].strftime("%Y-%m-%d %H:%M:%S") if project_status["last_update"] else None,
-        },
-        'tasks': project_status["tasks"],
-        'updates': agent_updates[-20:],  # Return the last 20 updates
-        'running': system_running
+        'project': project_summary(project),
+        'tasks': tasks,
+        'cursor': cursor,  # Pass back as ?since= to get only the tasks that changed
+        'updates': updates,
+        'updates_cursor': updates_cursor,
+        'running': system_running and project["running"]
     })
 
-@app.route('/api/logs', methods=['GET'])
-def get_logs():
-    """Get the console logs for display in the web UI"""
-    # Get the last 100 logs
-    logs = agent_updates[-100:] if agent_updates else []
-    
+@app.route('/api/projects', methods=['GET'])
+def list_projects():
+    """List every project with its progress and scheduling settings"""
     return jsonify({
-        'logs': logs,
-        'total_logs': len(agent_updates)
+        'projects': [project_summary(p) for p in list(projects.values())],
+        'current_project': current_project_id
     })
+
+@app.route('/api/projects', methods=['POST'])
+def create_project():
+    """Start a project next to the running ones; planning happens in the background"""
+    data = request.json or {}
+    description = data.get('description', '').strip()
+    if not description:
+        return jsonify({'error': 'No description provided'}), 400
     
-if __name__ == '__main__':
-    print("Starting Asynchronous Multi-Agent System on http://127.0.0.1:5001")
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    try:
+        weight = float(data.get('weight', 1))
+        max_concurrency = int(data.get('max_concurrency', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'weight and max_concurrency must be numbers'}), 400
+    if weight <= 0 or max_concurrency < 1:
+        return jsonify({'error': 'weight must be positive and max_concurrency at least 1'}), 400
+    
+    project = start_project(description, weight, max_concurrency)
+    log_update("System", f"Project {project['id']} created: {description[:80]}")
+    
+    def plan():
+        try:
+            create_project_plan(project)
+        except LLMError as e:
+            log_update("System", f"Planning failed for project {project['id']}: {str(e)}", level="error")
+    threading.Thread(target=plan, daemon=True).start()
+    
+    return jsonify({'success': True, 'project': project_summary(project)}), 202
+
+@app.route('/api/projects/<project_id>', methods=['GET'])
+def get_project_status(project_id):
+    """Status of one project"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    update_project_progress(project)
+    tasks, cursor = list_tasks_view(project)
+    return jsonify({'project': project_summary(project), 'tasks': tasks, 'cursor': cursor})
+
+@app.route('/api/projects/<project_id>/memory', methods=['GET'])
+def get_project_memory(project_id):
+    """Shared memory the agents of a project read: rolling summary and key artifacts"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify(project["memory"].to_dict())
+
+@app.route('/api/projects/<project_id>/sessions', methods=['GET'])
+def get_project_sessions(project_id):
+    """Agent sessions of a project: how many tasks and context tokens each one carries"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify({'sessions': [s.to_dict() for s in list(project["sessions"].values())]})
+
+@app.route('/api/projects/<project_id>/sessions', methods=['DELETE'])
+def reset_project_sessions(project_id):
+    """Make every agent of a project start its next task from the full prompt"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify({'success': True, 'reset': reset_sessions(project)})
+
+@app.route('/api/projects/<project_id>', methods=['PATCH'])
+def update_project_settings(project_id):
+    """Change a project's scheduling weight or concurrency limit"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    data = request.json or {}
+    try:
+        if 'weight' in data:
+            project["weight"] = max(0.01, float(data['weight']))
+        if 'max_concurrency' in data:
+            project["max_concurrency"] = max(1, int(data['max_concurrency']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'weight and max_concurrency must be numbers'}), 400
+    scheduler.notify()
+    return jsonify({'success': True, 'project': project_summary(project)})
+
+@app.route('/api/projects/<project_id>/cancel', methods=['POST'])
+def cancel_project(project_id):
+    """Stop a project and cancel all of its in-flight generations"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    cancelled = stop_project(project)
+    log_update("System", f"Project {project['id']} cancelled; {cancelled} in-flight generation(s) aborted")
+    return jsonify({'success': True, 'cancelled_generations': cancelled})
+
+@app.route('/api/projects/<project_id>/resume', methods=['POST'])
+def resume_project(project_id):
+    """Resume scheduling a stopped project"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    project["running"] = True
+    start_workers()
+    scheduler.notify()
+    return jsonify({'success': True, 'project': project_summary(project)})
+
+@app.route('/api/projects/<project_id>', methods=['DELETE'])
+def delete_project(project_id):
+    """Cancel a project and drop its state"""
+    global current_project_id
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    stop_project(project)
+    scheduler.remove_project(project_id)
+    metrics.remove("autonai_project_in_flight", {"project": project_id})
+    for t in project["tasks"]:
+        task_traces.pop(t.id, None)
+    document_store.clear(project_id)
+    if current_project_id == project_id:
+        current_project_id = None
+    return jsonify({'success': True})
+
+class ZipStreamBuffer:
+    """Unseekable file object that zipfile writes the archive into, drained chunk by chunk into the response"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_entries(project, agents=None, types=None):
+    """Files of a project's tasks to export, with their archive paths, optionally limited by agent and file type"""
+    entries = []
+    for task in list(project["tasks"]):
+        for info in task.files:
+            if agents and info['agent'] not in agents or types and info['type'] not in types:
+                continue
+            entries.append(dict(info, task_id=task.id, archive_path=f"{info['agent']}/{info['name']}",
+                                missing=not os.path.isfile(info['path'])))
+    return entries
+
+def stream_project_zip(project, entries, chunk_size=64 * 1024):
+    """Yield a ZIP of the entries and a manifest as it is built, holding at most about one chunk in memory"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        exported = {e['task_id'] for e in entries}
+        manifest = {
+            "project": project_summary(project),
+            "exported_at": format_timestamp(time.time()),
+            "tasks": [{
+                "id": task.id,
+                "description": task.description,
+                "agent_type": task.agent_type,
+                "status": task.status,
+                "completed_at": format_timestamp(task.completed_at),
+                "files": [e['archive_path'] for e in entries if e['task_id'] == task.id and not e['missing']]
+            } for task in list(project["tasks"]) if task.id in exported],
+            "artifacts": [{
+                "path": e['archive_path'],
+                "task_id": e['task_id'],
+                "agent": e['agent'],
+                "type": e['type'],
+                "size": e['size'],
+                "missing": e['missing']
+            } for e in entries]
+        }
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        yield buffer.drain()
+        
+        for entry in entries:
+            if entry['missing']:
+                continue
+            try:
+                info = zipfile.ZipInfo.from_file(entry['path'], entry['archive_path'])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(entry['path'], "rb") as source, archive.open(info, "w") as target:
+                    while True:
+                        chunk = source.read(chunk_size)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        yield buffer.drain()
+            except OSError as e:
+                log_update("System", f"Skipping {entry['archive_path']} in the export: {str(e)}", level="warning")
+            yield buffer.drain()
+    # Closing the archive writes the central directory
+    yield buffer.drain()
+
+@app.route('/api/projects/<project_id>/export', methods=['GET'])
+def export_project(project_id):
+    """Download a project's artifacts as a ZIP streamed while it is built; ?agent= and ?type= filter (comma-separated)"""
+    project = get_project(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    agents, types = ({v.strip() for v in request.args.get(key, '').split(',') if v.strip()} for key in ('agent', 'type'))
+    entries = export_entries(project, agents, types)
+    response = Response((chunk for chunk in stream_project_zip(project, entries) if chunk), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=project_{project_id}.zip'
+    return response
+
+@app.route('/api/project/cancel', methods=['POST'])
+def cancel_current_project():
+    """Stop the current project and cancel all of its in-flight generations"""
+    project = get_project()
+    if project is None:
+        return jsonify({'error': 'No project is running'}), 404
+    return cancel_project(project["id"])
+
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """Full task including its result and notes, or only the ?fields= asked for"""
+    project, task = find_task(task_id)
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(task_view(task, task_fields_arg()))
+
+@app.route('/api/tasks/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """Cancel a task, aborting its generation if it is running"""
+    project, task = find_task(task_id)
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    if cancel_generation(task_id, reset_status="cancelled"):
+        # The worker resets the task once the generation has stopped
+        log_update("System", f"Cancelling running task: {task.description[:50]}")
+        return jsonify({'success': True, 'task_id': task_id, 'state': 'cancelling'})
+    
+    if task.status in ("pending", "failed", "blocked"):
+        task.retry_at = None
+        task.update_status("cancelled", "Cancelled before it started")
+        log_update("System", f"Cancelled task: {task.description[:50]}")
+        return jsonify({'success': True, 'task_id': task_id, 'state': 'cancelled'})
+    
+    return jsonify({'error': f'Task is already {task.status}'}), 409
+
+@app.route('/api/tasks/<task_id>/requeue', methods=['POST'])
+def requeue_task(task_id):
+    """Put a cancelled or failed task back in the queue"""
+    project, task = find_task(task_id)
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    if task.status not in ("cancelled", "failed"):
+        return jsonify({'error': f'Task is {task.status}'}), 409
+    
+    task.attempts = 0
+    task.retry_at = None
+    task.update_status("pending", "Requeued by user")
+    scheduler.notify()
+    return jsonify({'success': True, 'task_id': task_id})
+
+@app.route('/api/tasks/<task_id>/trace', methods=['GET'])
+def get_task_trace_endpoint(task_id):
+    """Get the phase timings of a task, or download them as a Chrome trace file with ?format=chrome"""
+    trace = task_traces.get(task_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    
+    if request.args.get('format') == 'chrome':
+        response = jsonify(build_trace_file([trace]))
+        response.headers['Content-Disposition'] = f'attachment; filename=trace_{task_id}.json'
+        return response
+    
+    return jsonify(trace.to_dict())
 
+@app.route('/api/traces/export', methods=['GET'])
+def export_traces():
+    """Download the traces of a project (?project=<id>, default current) as one Chrome/Perfetto trace file"""
+    project_id = request.args.get('project') or current_project_id
+    traces = [t for t in list(task_traces.values()) if t.project_id == project_id]
+    response = jsonify(build_trace_file(traces))
+    response.headers['Content-Disposition'] = f'attachment; filename=project_{project_id}_trace.json'
+    return response
+
+@app.route('/api/logs', methods=['GET'])
+def get_logs():
+    """Console logs for the web UI, or a query of the log history with ?agent=, ?level=, ?start=, ?end= and ?limit="""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 10000))
+    filters = {key: request.args.get(key) for key in ('agent', 'level')}
+    start, end = request.args.get('start'), request.args.get('end')
+    if not any(filters.values()) and start is None and end is None:
+        # The UI console only needs the most recent records, which are in memory
+        logs = list(agent_updates)[-limit:]
+        return jsonify({'logs': logs, 'total_logs': logs[-1]["seq"] if logs else 0})
+    
+    try:
+        # Times are epoch seconds or "YYYY-MM-DD HH:MM:SS"
+        start, end = (None if value is None else float(value) if re.fullmatch(r"[\d.]+", value)
+                      else time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S")) for value in (start, end))
+    except ValueError:
+        return jsonify({'error': 'start and end must be epoch seconds or YYYY-MM-DD HH:MM:SS'}), 400
+    logs = log_sink.query(filters['agent'], filters['level'], start, end, limit)
+    return jsonify({'logs': logs, 'count': len(logs)})
+    
 @app.route('/api/files', methods=['GET'])
 def list_files():
     """List all output files created by agents"""
@@ -1098,4 +4800,32 @@ def debug_endpoints():
         'routes': routes,
         'output_dir_exists': output_dir_exists,
         'output_dir_files': output_dir_files
-    })
\ No newline at end of file
+    })
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Asynchronous Multi-Agent System")
+    subcommands = parser.add_subparsers(dest="command")
+    worker_parser = subcommands.add_parser("worker", help="Run a distributed worker that leases tasks from the shared queue")
+    worker_parser.add_argument("--queue", default=app.config['TASK_QUEUE_PATH'], help="Path of the shared SQLite task queue")
+    worker_parser.add_argument("--id", help="Worker name shown in task notes (default: host-pid)")
+    worker_parser.add_argument("--lease-timeout", type=float, default=app.config['TASK_LEASE_TIMEOUT'])
+    worker_parser.add_argument("--ollama", action="append", help="Ollama endpoint URL for this worker (repeatable)")
+    args = parser.parse_args()
+    
+    if args.command == "worker":
+        if not args.queue:
+            parser.error("worker needs --queue or AUTONAI_TASK_QUEUE")
+        if args.ollama:
+            app.config['OLLAMA_ENDPOINTS'] = args.ollama
+        try:
+            run_distributed_worker(args.queue, args.id, args.lease_timeout)
+        except KeyboardInterrupt:
+            print("Worker stopped")
+    else:
+        print("Starting Asynchronous Multi-Agent System on http://127.0.0.1:5001")
+        # Load the models while the server starts; /api/ready reports when they are in memory.
+        # With the debug reloader this block also runs in the watcher process, which serves nothing
+        from werkzeug.serving import is_running_from_reloader
+        if not app.config['DEBUG_RELOADER'] or is_running_from_reloader():
+            start_warmup()
+        app.run(debug=True, use_reloader=app.config['DEBUG_RELOADER'], host='0.0.0.0', port=5001)
@@ -0,0 +1,181 @@
+import requests
+import time
+import json
+import argparse
+import itertools
+import socket
+import sys
+import os
+from datetime import datetime
+
+from dl_llama3 import DEFAULT_HOSTS, format_size
+
+# Profile agent.py reads to pick Ollama options per endpoint (same default as its RUNTIME_PROFILE_PATH)
+DEFAULT_PROFILE = os.environ.get('AUTONAI_RUNTIME_PROFILE', 'runtime_profile.json')
+DEFAULT_MODEL = 'llama2:13b'
+
+# Fixed prompt set, shaped like the agents' real work: a plan, a page and a stylesheet
+BENCHMARK_PROMPTS = [
+    "You are a project manager. Break down the creation of a small bakery website into 4 tasks and answer "
+    "with a JSON object {\"tasks\": [{\"id\": 1, \"description\": \"...\", \"agent_type\": \"Agent2\"}]}.",
+    "You are a frontend developer. Write the HTML for a landing page with a header, a hero section, three "
+    "feature cards and a footer. Answer with a single ```html code block.",
+    "You are a designer. Write a CSS stylesheet for a landing page with a header, a hero section, feature "
+    "cards and a footer, using a warm colour palette. Answer with a single ```css code block.",
+]
+
+def parse_grid(value, cast=int):
+    """Comma-separated candidate values; 'default' leaves the option to Ollama"""
+    values = []
+    for part in value.split(','):
+        part = part.strip()
+        if part:
+            values.append(None if part == 'default' else cast(part))
+    return values or [None]
+
+def option_grid(num_ctx, num_thread, num_gpu, num_batch):
+    """Every combination of the candidate values, as Ollama options dicts"""
+    names = ('num_ctx', 'num_thread', 'num_gpu', 'num_batch')
+    for values in itertools.product(num_ctx, num_thread, num_gpu, num_batch):
+        yield {name: value for name, value in zip(names, values) if value is not None}
+
+def loaded_model_memory(host, model):
+    """Memory and VRAM used by a loaded model according to /api/ps, or (None, None) if unknown"""
+    try:
+        response = requests.get(f'{host}/api/ps', timeout=10)
+        response.raise_for_status()
+        for loaded in response.json().get('models', []):
+            if loaded.get('name') == model or loaded.get('model') == model or loaded.get('name') == f'{model}:latest':
+                return loaded.get('size'), loaded.get('size_vram')
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    return None, None
+
+def unload_model(host, model):
+    """Unload a model so the next trial measures a cold load with its own options"""
+    try:
+        requests.post(f'{host}/api/generate', json={'model': model, 'keep_alive': 0}, timeout=60)
+    except requests.exceptions.RequestException:
+        pass
+
+def run_trial(host, model, options, num_predict, repeat, timeout):
+    """Run the benchmark prompts with one set of options and return the measurements"""
+    unload_model(host, model)
+    eval_tokens = eval_seconds = prompt_tokens = prompt_seconds = 0
+    load_seconds = None
+    start = time.time()
+    for prompt in BENCHMARK_PROMPTS * repeat:
+        response = requests.post(f'{host}/api/generate', json={
+            'model': model,
+            'prompt': prompt,
+            'stream': False,
+            'options': dict(options, num_predict=num_predict, temperature=0)
+        }, timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        result = response.json()
+        if result.get('error'):
+            raise RuntimeError(result['error'])
+        # Durations are reported in nanoseconds
+        if load_seconds is None:
+            load_seconds = result.get('load_duration', 0) / 1e9
+        eval_tokens += result.get('eval_count', 0)
+        eval_seconds += result.get('eval_duration', 0) / 1e9
+        prompt_tokens += result.get('prompt_eval_count', 0)
+        prompt_seconds += result.get('prompt_eval_duration', 0) / 1e9
+    memory, vram = loaded_model_memory(host, model)
+    return {
+        'tokens_per_second': round(eval_tokens / eval_seconds, 2) if eval_seconds else None,
+        'prompt_tokens_per_second': round(prompt_tokens / prompt_seconds, 2) if prompt_seconds else None,
+        'load_seconds': round(load_seconds or 0, 3),
+        'memory_bytes': memory,
+        'vram_bytes': vram,
+        'wall_seconds': round(time.time() - start, 3)
+    }
+
+def trial_score(trial):
+    """Generation speed first, prompt evaluation speed to break ties"""
+    return (trial['tokens_per_second'] or 0, trial['prompt_tokens_per_second'] or 0)
+
+def autotune_host(host, candidates, grid, num_predict, repeat, timeout, min_ctx):
+    """Benchmark every candidate model and option set on one host; returns the trials and the best one"""
+    trials = []
+    for model in candidates:
+        for options in grid:
+            label = f"{model} {json.dumps(options, sort_keys=True)}"
+            try:
+                measured = run_trial(host, model, options, num_predict, repeat, timeout)
+            except (requests.exceptions.RequestException, ValueError, RuntimeError) as e:
+                print(f"  FAILED {label}: {str(e)[:120]}")
+                trials.append({'model': model, 'options': options, 'error': str(e)[:200]})
+                continue
+            memory = format_size(measured['memory_bytes']) if measured['memory_bytes'] else 'n/a'
+            vram = format_size(measured['vram_bytes']) if measured['vram_bytes'] else 'n/a'
+            print(f"  {label}: {measured['tokens_per_second']} tok/s, prompt {measured['prompt_tokens_per_second']} tok/s, "
+                  f"load {measured['load_seconds']}s, memory {memory} (VRAM {vram})")
+            trials.append(dict(measured, model=model, options=options))
+
+    # Smaller contexts are faster but truncate the agents' prompts; only settings that fit them qualify
+    eligible = [t for t in trials if 'error' not in t and t['tokens_per_second']
+                and t['options'].get('num_ctx', min_ctx) >= min_ctx]
+    best = max(eligible, key=trial_score) if eligible else None
+    return trials, best
+
+def write_profile(path, host, target, best, trials):
+    """Merge one host's result into the profile, keeping the other hosts' entries"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        profile = {}
+    entry = profile.setdefault('endpoints', {}).setdefault(host, {})
+    entry['hostname'] = socket.gethostname()
+    entry['tuned_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    entry.setdefault('models', {})[target] = {
+        'model': best['model'],
+        'options': best['options'],
+        'measured': {k: best[k] for k in ('tokens_per_second', 'prompt_tokens_per_second', 'load_seconds',
+                                           'memory_bytes', 'vram_bytes')},
+        'trials': trials
+    }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temp_path, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark models and Ollama options on each host and write the runtime profile agent.py uses")
+    parser.add_argument("--host", action="append", help="Ollama endpoint (repeatable, default: OLLAMA_ENDPOINTS or http://localhost:11434)")
+    parser.add_argument("--target", default=DEFAULT_MODEL, help=f"Model the agents request (default: {DEFAULT_MODEL})")
+    parser.add_argument("--model", action="append", help="Candidate to serve the target, e.g. another quantization (repeatable, default: the target)")
+    parser.add_argument("--num-ctx", default="4096,8192", help="Context sizes to try, at least --min-ctx (default: 4096,8192)")
+    parser.add_argument("--num-thread", default=f"default,{os.cpu_count() or 1},{max(1, (os.cpu_count() or 2) // 2)}",
+                        help="CPU thread counts to try (default: default, all cores, half the cores)")
+    parser.add_argument("--num-gpu", default="default", help="GPU layer counts to try, 0 for CPU only (default: default)")
+    parser.add_argument("--num-batch", default="default,256,512", help="Prompt batch sizes to try (default: default,256,512)")
+    parser.add_argument("--min-ctx", type=int, default=4096, help="Smallest context the chosen settings may use (default: 4096)")
+    parser.add_argument("--num-predict", type=int, default=128, help="Tokens generated per benchmark prompt (default: 128)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of the prompt set per trial (default: 1)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed per benchmark request (default: 600)")
+    parser.add_argument("--output", default=DEFAULT_PROFILE, help=f"Profile file to update (default: {DEFAULT_PROFILE})")
+    args = parser.parse_args()
+
+    hosts = [h.rstrip('/') for h in (args.host or DEFAULT_HOSTS)]
+    candidates = args.model or [args.target]
+    grid = list(option_grid(parse_grid(args.num_ctx), parse_grid(args.num_thread),
+                            parse_grid(args.num_gpu), parse_grid(args.num_batch)))
+    print(f"{len(candidates)} model(s) x {len(grid)} option set(s) on {len(hosts)} host(s)")
+
+    success = True
+    for host in hosts:
+        print(f"{host}:")
+        trials, best = autotune_host(host, candidates, grid, args.num_predict, args.repeat,
+                                     args.timeout, args.min_ctx)
+        if best is None:
+            print(f"No working settings for {args.target} on {host}; profile not changed")
+            success = False
+            continue
+        write_profile(args.output, host, args.target, best, trials)
+        print(f"Best for {args.target} on {host}: {best['model']} {json.dumps(best['options'], sort_keys=True)} "
+              f"({best['tokens_per_second']} tok/s) -> {args.output}")
+    sys.exit(0 if success else 1)
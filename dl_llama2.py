@@ -1,14 +1,18 @@
 import requests
 import time
 import json
+import os
 
-def download_model(model_name):
-    print(f"Attempting to download model: {model_name}")
+# Same endpoint list as agent.py (comma-separated URLs in OLLAMA_ENDPOINTS)
+HOSTS = [url.strip().rstrip('/') for url in os.environ.get('OLLAMA_ENDPOINTS', 'http://localhost:11434').split(',') if url.strip()]
+
+def download_model(model_name, host=HOSTS[0]):
+    print(f"Attempting to download model: {model_name} on {host}")
     
     try:
         # The pull endpoint downloads a model
         response = requests.post(
-            'http://localhost:11434/api/pull',
+            f'{host}/api/pull',
             json={'name': model_name},
             stream=True  # Important for streaming the download progress
         )
@@ -40,6 +44,7 @@ def download_model(model_name):
 
 if __name__ == "__main__":
     model = "llama2:13b"
-    print(f"Starting download of {model}...")
-    download_model(model)
+    for host in HOSTS:
+        print(f"Starting download of {model} on {host}...")
+        download_model(model, host)
     print("If download was successful, you can now use this model with your agent")
\ No newline at end of file
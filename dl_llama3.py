@@ -3,14 +3,18 @@ import time
 import json
 import argparse
 import sys
+import os
 
-def download_model(model_name, show_progress=True):
-    print(f"Attempting to download model: {model_name}")
+# Same endpoint list as agent.py (comma-separated URLs in OLLAMA_ENDPOINTS)
+DEFAULT_HOSTS = [url.strip().rstrip('/') for url in os.environ.get('OLLAMA_ENDPOINTS', 'http://localhost:11434').split(',') if url.strip()]
+
+def download_model(model_name, show_progress=True, host=DEFAULT_HOSTS[0]):
+    print(f"Attempting to download model: {model_name} on {host}")
     
     try:
         # The pull endpoint downloads a model
         response = requests.post(
-            'http://localhost:11434/api/pull',
+            f'{host}/api/pull',
             json={'name': model_name},
             stream=True  # Important for streaming the download progress
         )
@@ -66,7 +70,7 @@ def download_model(model_name, show_progress=True):
             return False
             
     except requests.exceptions.ConnectionError:
-        print("Error: Could not connect to Ollama. Make sure Ollama is running at http://localhost:11434")
+        print(f"Error: Could not connect to Ollama. Make sure Ollama is running at {host}")
         return False
     except Exception as e:
         print(f"Error during download: {str(e)}")
@@ -79,10 +83,10 @@ def format_size(size_bytes):
             return f"{size_bytes:.2f} {unit}"
         size_bytes /= 1024
 
-def check_model_exists(model_name):
+def check_model_exists(model_name, host=DEFAULT_HOSTS[0]):
     """Check if model already exists in Ollama"""
     try:
-        response = requests.get('http://localhost:11434/api/tags')
+        response = requests.get(f'{host}/api/tags')
         if response.status_code == 200:
             models = response.json().get('models', [])
             for model in models:
@@ -95,32 +99,37 @@ def check_model_exists(model_name):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download Llama 3 70B model for Ollama")
     parser.add_argument("--model", default="llama3:70b", help="Model name to download (default: llama3:70b)")
+    parser.add_argument("--host", action="append", help="Ollama endpoint to download to (repeatable, default: OLLAMA_ENDPOINTS or http://localhost:11434)")
     args = parser.parse_args()
     
     model = args.model
+    hosts = [host.rstrip('/') for host in args.host] if args.host else DEFAULT_HOSTS
     
-    # Check if Ollama is running
-    try:
-        requests.get('http://localhost:11434/api/version')
-    except requests.exceptions.ConnectionError:
-        print("Error: Could not connect to Ollama. Make sure Ollama is running at http://localhost:11434")
-        sys.exit(1)
-    
-    # Check if model already exists
-    if check_model_exists(model):
-        print(f"Model {model} is already downloaded.")
-        user_input = input("Do you want to download it again? (y/n): ")
-        if user_input.lower() != 'y':
-            print("Download canceled.")
-            sys.exit(0)
-    
-    print(f"Starting download of {model}...")
-    success = download_model(model)
+    success = True
+    for host in hosts:
+        # Check if Ollama is running
+        try:
+            requests.get(f'{host}/api/version')
+        except requests.exceptions.ConnectionError:
+            print(f"Error: Could not connect to Ollama. Make sure Ollama is running at {host}")
+            success = False
+            continue
+        
+        # Check if model already exists
+        if check_model_exists(model, host):
+            print(f"Model {model} is already downloaded on {host}.")
+            user_input = input("Do you want to download it again? (y/n): ")
+            if user_input.lower() != 'y':
+                print("Download canceled.")
+                continue
+        
+        print(f"Starting download of {model} on {host}...")
+        success = download_model(model, host=host) and success
     
     if success:
         print(f"\nModel {model} has been successfully downloaded.")
         print("You can now update your agent.py to use this model by changing:")
-        print('call_llm(messages, model="llama3:70b", timeout=300)')
+        print('call_llm(messages, model="llama3:70b")')
         print("\nNote: This model requires more VRAM than llama2:13b. Make sure your system has adequate resources.")
     else:
         print(f"\nFailed to download {model}. Please check your connection and try again.")
\ No newline at end of file
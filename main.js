@@ -31,6 +31,8 @@ const MAX_CONSECUTIVE_ERRORS = 3;
 // App state
 let isProjectRunning = false;
 let statusPollingInterval = null;
+let statusCursor = null; // Task and update cursors from the last status poll, so only changes are sent
+let updatesCursor = null;
 let consoleVisible = false;
 let consolePollingInterval = null;
 let lastSeenLogTimestamp = null;
@@ -670,9 +672,16 @@ function startStatusPolling() {
     
     // Start new interval
     statusPollingInterval = setInterval(() => {
-        fetch(`${API_BASE_URL}/api/status`)
+        // The progress bar needs no task details, so only changed task ids and statuses are requested
+        let url = `${API_BASE_URL}/api/status?fields=id,status`;
+        if (statusCursor !== null) url += `&since=${statusCursor}`;
+        if (updatesCursor !== null) url += `&updates_since=${updatesCursor}`;
+        fetch(url)
             .then(response => response.json())
             .then(data => {
+                statusCursor = data.cursor;
+                updatesCursor = data.updates_cursor;
+                
                 // Update progress
                 updateProjectStatus(data.project);
                 
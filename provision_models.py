@@ -0,0 +1,175 @@
+import requests
+import time
+import json
+import argparse
+import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dl_llama3 import DEFAULT_HOSTS, format_size
+
+# Models agent.py needs out of the box: the task model and the semantic cache's embedding model
+DEFAULT_MANIFEST = 'models.json'
+
+def load_manifest(path):
+    """Read the models (and optionally hosts) to provision from a JSON manifest"""
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'models': manifest}
+    models = [m['name'] if isinstance(m, dict) else m for m in manifest.get('models', [])]
+    return models, manifest.get('hosts') or []
+
+def installed_models(host):
+    """Names of the models on a host, from a single /api/tags call"""
+    response = requests.get(f'{host}/api/tags', timeout=10)
+    response.raise_for_status()
+    names = set()
+    for model in response.json().get('models', []):
+        name = model.get('name', '')
+        names.add(name)
+        if name.endswith(':latest'):
+            names.add(name[:-len(':latest')])
+    return names
+
+class PullProgress:
+    """Progress of every pull, printed as one summary at a fixed interval instead of per line"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pulls = {}  # (host, model) -> {"status", "layers": {digest: (completed, total)}}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def update(self, host, model, status=None, digest=None, completed=None, total=None):
+        with self.lock:
+            pull = self.pulls.setdefault((host, model), {'status': 'waiting', 'layers': {}})
+            if status:
+                pull['status'] = status
+            if digest and total:
+                pull['layers'][digest] = (completed or 0, total)
+
+    def render(self):
+        parts = []
+        with self.lock:
+            for (host, model), pull in self.pulls.items():
+                completed = sum(c for c, _ in pull['layers'].values())
+                total = sum(t for _, t in pull['layers'].values())
+                if total and pull['status'] not in ('success', 'failed'):
+                    parts.append(f"{model}@{host}: {completed / total * 100:.1f}% ({format_size(completed)}/{format_size(total)})")
+                else:
+                    parts.append(f"{model}@{host}: {pull['status']}")
+        return " | ".join(parts)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            line = self.render()
+            if sys.stdout.isatty():
+                sys.stdout.write(f"\r{line[:200]}\033[K")
+                sys.stdout.flush()
+            else:
+                print(line)
+
+def pull_model(host, model, progress, retries=5):
+    """Pull a model, retrying interrupted downloads; Ollama keeps partial layers, so a retry resumes them"""
+    for attempt in range(retries):
+        try:
+            response = requests.post(f'{host}/api/pull', json={'name': model, 'stream': True},
+                                     stream=True, timeout=(10, 300))
+            if response.status_code != 200:
+                progress.update(host, model, status=f"HTTP {response.status_code}")
+                if response.status_code < 500:
+                    break
+            else:
+                with response:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        update = json.loads(line)
+                        if update.get('error'):
+                            raise RuntimeError(update['error'])
+                        progress.update(host, model, status=update.get('status'), digest=update.get('digest'),
+                                        completed=update.get('completed'), total=update.get('total'))
+                        if update.get('status') == 'success':
+                            return True
+                progress.update(host, model, status='interrupted')
+        except (requests.exceptions.RequestException, ValueError, RuntimeError) as e:
+            progress.update(host, model, status=f"retrying ({str(e)[:60]})")
+        if attempt < retries - 1:
+            time.sleep(min(60, 2 ** attempt))
+    progress.update(host, model, status='failed')
+    return False
+
+def provision(models, hosts, parallel=2, force=False, interactive=True, interval=2.0, retries=5):
+    """Pull the models missing on each host concurrently; returns True if every host ends up with every model"""
+    pulls = []
+    reachable = True
+    for host in hosts:
+        try:
+            installed = set() if force else installed_models(host)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error: Could not list models on {host}: {str(e)}")
+            reachable = False
+            continue
+        missing = [m for m in models if m not in installed]
+        present = [m for m in models if m in installed]
+        if present:
+            print(f"{host}: already has {', '.join(present)}")
+        pulls += [(host, m) for m in missing]
+
+    if not pulls:
+        print("All models are already provisioned.")
+        return reachable
+
+    print(f"Models to pull: {', '.join(f'{m}@{h}' for h, m in pulls)}")
+    if interactive:
+        user_input = input(f"Pull {len(pulls)} model(s) now? (y/n): ")
+        if user_input.lower() != 'y':
+            print("Provisioning canceled.")
+            return False
+
+    progress = PullProgress(interval)
+    for host, model in pulls:
+        progress.update(host, model)
+    printer = threading.Thread(target=progress.run, daemon=True)
+    printer.start()
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        results = list(executor.map(lambda pull: pull_model(pull[0], pull[1], progress, retries), pulls))
+
+    progress.done.set()
+    printer.join()
+    print()
+    for (host, model), ok in zip(pulls, results):
+        print(f"{'OK    ' if ok else 'FAILED'} {model} on {host}")
+    return reachable and all(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull the models agent.py needs onto one or more Ollama hosts")
+    parser.add_argument("--manifest", help=f"JSON manifest: a list of models or {{\"models\": [...], \"hosts\": [...]}} (default: {DEFAULT_MANIFEST})")
+    parser.add_argument("--model", action="append", help="Model to provision in addition to the manifest (repeatable)")
+    parser.add_argument("--host", action="append", help="Ollama endpoint (repeatable, default: manifest hosts, OLLAMA_ENDPOINTS or http://localhost:11434)")
+    parser.add_argument("--parallel", type=int, default=2, help="Pulls running at the same time (default: 2)")
+    parser.add_argument("--force", action="store_true", help="Pull even models that are already present")
+    parser.add_argument("--yes", "--non-interactive", dest="yes", action="store_true", help="Never prompt; for automation")
+    parser.add_argument("--progress-interval", type=float, default=2.0, help="Seconds between progress updates (default: 2)")
+    parser.add_argument("--retries", type=int, default=5, help="Attempts per model before giving up (default: 5)")
+    args = parser.parse_args()
+
+    models, manifest_hosts = [], []
+    manifest_path = args.manifest or (DEFAULT_MANIFEST if os.path.exists(DEFAULT_MANIFEST) else None)
+    if manifest_path:
+        try:
+            models, manifest_hosts = load_manifest(manifest_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: Could not read manifest {manifest_path}: {str(e)}")
+            sys.exit(1)
+    models += [m for m in args.model or [] if m not in models]
+    if not models:
+        parser.error("no models given; use --manifest or --model")
+    hosts = [h.rstrip('/') for h in (args.host or manifest_hosts or DEFAULT_HOSTS)]
+
+    interactive = not args.yes and sys.stdin.isatty()
+    success = provision(models, hosts, args.parallel, args.force, interactive, args.progress_interval, args.retries)
+    sys.exit(0 if success else 1)
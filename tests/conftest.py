@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# agent.py creates its output directories in the working directory on import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="autonai-tests-"))
+
+import agent as agent_module
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    """The agent module, working in a fresh directory and without reaching a real Ollama"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(agent_module.ollama_pool, "usable_count", lambda: 1)
+    monkeypatch.setattr(agent_module, "admission", agent_module.AdmissionController())
+    return agent_module
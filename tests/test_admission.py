@@ -0,0 +1,86 @@
+import threading
+import time
+
+
+def acquire_in_thread(admission, priority):
+    """Start an acquire in the background; the returned dict gets the slot once admitted"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("slot", admission.acquire(priority)), daemon=True)
+    thread.start()
+    return result
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_task_generation_overlaps_planning(agent):
+    planning = agent.admission.acquire("planning")
+    started = time.time()
+    background = agent.admission.acquire("background")
+    assert time.time() - started < 0.5
+    assert agent.admission.active == {"interactive": 0, "planning": 1, "background": 1}
+    agent.admission.release(background)
+    agent.admission.release(planning)
+
+
+def test_capacity_scales_with_usable_endpoints(agent, monkeypatch):
+    monkeypatch.setitem(agent.app.config, 'ADMISSION_SLOTS_PER_ENDPOINT', 4)
+    assert agent.admission.budgets()["background"] == 2
+    monkeypatch.setattr(agent.ollama_pool, "usable_count", lambda: 3)
+    assert agent.admission.budgets()["background"] == 10
+
+
+def test_chat_keeps_its_reserve_while_task_work_is_saturated(agent):
+    admission = agent.admission
+    slots = [admission.acquire("planning"), admission.acquire("background"), admission.acquire("background")]
+    waiting = acquire_in_thread(admission, "background")
+    assert not wait_for(lambda: "slot" in waiting, 0.5)
+    started = time.time()
+    slots.append(admission.acquire("interactive"))
+    assert time.time() - started < 0.5
+    for slot in slots:
+        admission.release(slot)
+    assert wait_for(lambda: "slot" in waiting)
+    admission.release(waiting["slot"])
+
+
+def test_waiting_calls_of_a_class_are_admitted_in_order(agent):
+    admission = agent.admission
+    held = [admission.acquire("background"), admission.acquire("background")]
+    first = acquire_in_thread(admission, "background")
+    assert wait_for(lambda: len(admission.waiting["background"]) == 1)
+    second = acquire_in_thread(admission, "background")
+    assert wait_for(lambda: len(admission.waiting["background"]) == 2)
+    admission.release(held.pop())
+    assert wait_for(lambda: "slot" in first)
+    assert "slot" not in second
+    admission.release(held.pop())
+    assert wait_for(lambda: "slot" in second)
+
+
+def test_embedding_calls_bypass_admission(agent, monkeypatch):
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"embedding": [3.0, 4.0]}
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("embedding waited for a generation slot")
+
+    endpoint = agent.OllamaEndpoint("http://ollama.test")
+    monkeypatch.setattr(agent.admission, "acquire", refuse)
+    monkeypatch.setattr(agent.ollama_pool, "acquire", lambda model: endpoint)
+    monkeypatch.setattr(agent.ollama_pool, "release", lambda endpoint: None)
+    monkeypatch.setattr(agent.requests, "post", lambda *args, **kwargs: Response())
+    monkeypatch.setitem(agent.app.config, 'SEMANTIC_CACHE_EMBED_MODEL', "nomic-embed-text")
+    cache = agent.SemanticCache()
+    vectors = cache.embed("Build the landing page")
+    assert "ollama:nomic-embed-text" in vectors
@@ -0,0 +1,51 @@
+import pytest
+
+
+@pytest.fixture
+def project(agent, tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "document_store", agent.DocumentStore(str(tmp_path / "documents")))
+    return agent.new_project("A site")
+
+
+def continued_session(agent, project, task):
+    """A session whose context already covers the documents this task sees"""
+    session = agent.AgentSession("Agent1")
+    session.followup(task, project, [{"role": "user", "content": task.description}])
+    session.advance("http://ollama.test", "llama2:13b", [1, 2, 3])
+    return session
+
+
+def next_task(agent, project, session, documents=None):
+    task = agent.Task("Write the next page", "Agent1")
+    task.documents = documents
+    return task, session.followup(task, project, [{"role": "user", "content": task.description}])
+
+
+def test_unchanged_documents_continue_the_session(agent, project):
+    agent.document_store.add("brief.txt", ["Make it blue."], "hash-brief", project["id"])
+    session = continued_session(agent, project, agent.Task("Write the home page", "Agent1"))
+    task, followup = next_task(agent, project, session)
+    assert followup is not None
+    assert "Write the next page" in followup[-1]["content"]
+    assert session.context is not None
+
+
+def test_new_upload_starts_the_session_over(agent, project):
+    agent.document_store.add("brief.txt", ["Make it blue."], "hash-brief", project["id"])
+    session = continued_session(agent, project, agent.Task("Write the home page", "Agent1"))
+    agent.document_store.add("palette.txt", ["Use #0044ff."], "hash-palette", project["id"])
+    task, followup = next_task(agent, project, session)
+    assert followup is None
+    assert session.context is None
+    # The fresh call's context then covers the new set
+    session.advance("http://ollama.test", "llama2:13b", [4, 5, 6])
+    assert next_task(agent, project, session)[1] is not None
+
+
+def test_no_documents_differs_from_all_documents(agent, project):
+    agent.document_store.add("brief.txt", ["Make it blue."], "hash-brief", project["id"])
+    task = agent.Task("Write the home page", "Agent1")
+    task.documents = []
+    session = continued_session(agent, project, task)
+    assert next_task(agent, project, session, documents=[])[1] is not None
+    assert next_task(agent, project, session, documents=None)[1] is None
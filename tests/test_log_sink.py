@@ -0,0 +1,52 @@
+import io
+import itertools
+import sys
+import time
+
+sequence = itertools.count(1)
+
+
+def record(message, agent="Agent1", level="info"):
+    now = time.time()
+    return {"seq": next(sequence), "time": now, "timestamp": "2026-01-01 00:00:00", "agent": agent,
+            "level": level, "message": message}
+
+
+def test_writer_survives_a_failed_batch(agent, tmp_path, monkeypatch):
+    sink = agent.LogSink(str(tmp_path / "logs"))
+    write = sink.write
+    failures = []
+
+    def fail_once(records):
+        if not failures:
+            failures.append(records)
+            raise RuntimeError("disk went away")
+        write(records)
+
+    monkeypatch.setattr(sink, "write", fail_once)
+    sink.submit(record("lost with the failed batch"))
+    assert sink.flush(timeout=2)
+    sink.submit(record("written after the failure"))
+    started = time.time()
+    messages = [r["message"] for r in sink.query()]
+    assert time.time() - started < 2
+    assert messages == ["written after the failure"]
+    assert sink.thread.is_alive()
+
+
+def test_console_that_cannot_encode_a_record_loses_nothing(agent, tmp_path, monkeypatch):
+    monkeypatch.setitem(agent.app.config, 'LOG_STDOUT', True)
+    monkeypatch.setattr(sys, "stdout", io.TextIOWrapper(io.BytesIO(), encoding="ascii"))
+    sink = agent.LogSink(str(tmp_path / "logs"))
+    sink.submit(record("Plan: design → build → test"))
+    sink.submit(record("plain ascii"))
+    assert [r["message"] for r in sink.query()] == ["Plan: design → build → test", "plain ascii"]
+
+
+def test_flush_gives_up_when_the_writer_is_stuck(agent, tmp_path, monkeypatch):
+    sink = agent.LogSink(str(tmp_path / "logs"))
+    monkeypatch.setattr(sink, "write", lambda records: time.sleep(3))
+    sink.submit(record("slow"))
+    started = time.time()
+    assert not sink.flush(timeout=0.3)
+    assert time.time() - started < 1
@@ -0,0 +1,73 @@
+import pytest
+
+# Stand-ins for the embedding model: descriptions that mean the same thing point the same way
+MODEL_VECTORS = {
+    "Write the CSS for the header": [1.0, 0.0, 0.0],
+    "Write the CSS for the site header": [0.99, 0.14, 0.0],
+    "Write the CSS for the footer": [0.6, 0.8, 0.0],
+    "Build the navbar": [0.0, 0.0, 1.0],
+    "Build the navigation bar": [0.0, 0.1, 0.99],
+}
+
+
+@pytest.fixture
+def cache(agent, monkeypatch):
+    def embed(text):
+        return {"hashing": agent.hashing_vector(text), "ollama:test-embed": agent.normalize_vector(MODEL_VECTORS[text])}
+
+    cache = agent.SemanticCache()
+    monkeypatch.setattr(cache, "embed", embed)
+    monkeypatch.setattr(agent, "semantic_cache", cache)
+    return cache
+
+
+def test_hashing_fallback_never_drafts_or_reuses(agent, cache, monkeypatch):
+    monkeypatch.setattr(cache, "embed", lambda text: {"hashing": agent.hashing_vector(text)})
+    cache.add("Agent1", "Write the CSS for the header", "header { }", "p1")
+    outcome, similarity, entry = cache.lookup("Agent1", "Write the CSS for the footer", "p1")
+    assert similarity > 0.8  # Shared words alone make the hashing vectors look alike
+    assert (outcome, entry) == ("miss", None)
+
+
+def test_reuse_stays_within_the_project(agent, cache):
+    cache.add("Agent1", "Write the CSS for the header", "header { }", "p1")
+    outcome, _, entry = cache.lookup("Agent1", "Write the CSS for the site header", "p1")
+    assert outcome == "reuse" and entry["result"] == "header { }"
+    outcome, _, entry = cache.lookup("Agent1", "Write the CSS for the site header", "p2")
+    assert outcome == "draft" and entry["project_id"] == "p1"
+
+
+def test_same_project_entry_is_reused_over_a_closer_one_elsewhere(agent, cache):
+    cache.add("Agent1", "Write the CSS for the site header", "theirs", "p2")
+    cache.add("Agent1", "Write the CSS for the header", "ours", "p1")
+    outcome, _, entry = cache.lookup("Agent1", "Write the CSS for the site header", "p1")
+    assert (outcome, entry["result"]) == ("reuse", "ours")
+
+
+def test_model_space_matches_paraphrases_and_keeps_unrelated_apart(agent, cache):
+    cache.add("Agent1", "Build the navbar", "<nav></nav>", "p1")
+    cache.add("Agent1", "Write the CSS for the header", "header { }", "p1")
+    assert cache.lookup("Agent1", "Build the navigation bar", "p1")[0] == "reuse"
+    assert cache.lookup("Agent1", "Write the CSS for the footer", "p1")[0] == "miss"
+
+
+def test_thresholds_are_looked_up_per_space(agent, monkeypatch):
+    monkeypatch.setitem(agent.app.config, 'SEMANTIC_CACHE_THRESHOLDS', {
+        'ollama': {'draft': 0.8, 'reuse': 0.95},
+        'ollama:mxbai-embed-large': {'draft': 0.7, 'reuse': 0.9},
+        'hashing': {'reuse': None}
+    })
+    assert agent.semantic_cache_thresholds("ollama:nomic-embed-text") == {"draft": 0.8, "reuse": 0.95}
+    assert agent.semantic_cache_thresholds("ollama:mxbai-embed-large") == {"draft": 0.7, "reuse": 0.9}
+    assert agent.semantic_cache_thresholds("hashing") == {"draft": None, "reuse": None}
+
+
+def test_consulting_the_cache_drafts_from_another_project(agent, cache):
+    project = agent.new_project("Another site")
+    cache.add("Agent1", "Write the CSS for the header", "header { }", "elsewhere")
+    task = agent.Task("Write the CSS for the site header", "Agent1")
+    messages = [{"role": "user", "content": task.description}]
+    trace = agent.get_task_trace(task.id, "Agent1", project["id"])
+    assert agent.consult_semantic_cache(task, "Agent1", messages, trace, project) is None
+    assert task.semantic_cache["outcome"] == "draft"
+    assert "header { }" in messages[-1]["content"]
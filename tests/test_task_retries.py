@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+
+def test_outage_does_not_use_up_attempts(agent, monkeypatch):
+    monkeypatch.setattr(agent.ollama_pool, "retry_after", lambda: 12)
+    task = agent.Task("Write the landing page", "Agent1")
+    for _ in range(agent.TASK_MAX_ATTEMPTS + 2):
+        agent.fail_task(task, "Agent1", agent.LLMUnavailableError("No healthy Ollama endpoint out of 1 configured"))
+    assert task.attempts == 0
+    assert task.status == "failed"
+    assert 10 < task.retry_at - time.time() <= 12
+
+
+def test_overloaded_backend_requeues_at_its_retry_after(agent):
+    task = agent.Task("Write the landing page", "Agent1")
+    agent.fail_task(task, "Agent1", agent.LLMOverloadedError("Too many background LLM requests queued", 45))
+    assert task.attempts == 0
+    assert 43 < task.retry_at - time.time() <= 45
+
+
+def test_generation_errors_count_until_the_task_gives_up(agent):
+    task = agent.Task("Write the landing page", "Agent1")
+    for _ in range(agent.TASK_MAX_ATTEMPTS):
+        agent.fail_task(task, "Agent1", agent.LLMTimeoutError("No first token from Ollama within 60s"))
+    assert task.attempts == agent.TASK_MAX_ATTEMPTS
+    assert task.retry_at is None
+
+
+def test_failures_that_empty_the_pool_are_reported_as_an_outage(agent, monkeypatch):
+    endpoint = agent.OllamaEndpoint("http://ollama.test")
+
+    def refuse(*args, **kwargs):
+        raise agent.requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(agent.ollama_pool, "acquire", lambda *args, **kwargs: endpoint)
+    monkeypatch.setattr(agent.ollama_pool, "usable_count", lambda: 0)
+    monkeypatch.setattr(agent.requests, "post", refuse)
+    monkeypatch.setattr(agent, "backoff_delay", lambda attempt: 0)
+    with pytest.raises(agent.LLMUnavailableError):
+        "".join(agent.stream_from_pool([{"role": "user", "content": "hi"}], max_retries=2))
+
+
+def test_circuit_lets_one_probe_through_and_reopens_after_an_abandoned_trial(agent):
+    circuit = agent.CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    circuit.record_failure()
+    circuit.record_failure()
+    with pytest.raises(agent.LLMUnavailableError):
+        circuit.before_call()
+    time.sleep(0.15)
+    circuit.before_call()
+    with pytest.raises(agent.LLMUnavailableError):
+        circuit.before_call()  # Only one trial call at a time
+    circuit.end_trial()
+    circuit.before_call()  # The abandoned trial does not leave the circuit stuck half-open
+    circuit.record_success()
+    assert circuit.state == "closed"